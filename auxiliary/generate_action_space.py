@@ -27,14 +27,10 @@ This substation_config is represented by the variable "act_dict"
 Note that for the actions space the ids have to be chosen consistently,
 that is, related to only one substation.
 
-The list of actions is created by looping through all substations and creating
-all valid substation configurations for each substation.
-A crucial command to do this is:
-env.get_obj_connect_to(None, substation_nr).items()
-
-which gives the ids of all the elements connected to a specific substation as
-well as the total number of elements connected. For example, for 
-substation_nr=1 one obtains
+The actions are enumerated per substation, directly as set topology vectors
+(rows of a (N_ACTIONS, N_OBJECTS) matrix, with 0 for objects that are not set),
+using bitmasks over the objects connected to the substation. For example, for
+substation_nr=1 the connected objects are
 
 dict_items([('loads_id', array([0])),
             ('generators_id', array([0])),
@@ -42,406 +38,527 @@ dict_items([('loads_id', array([0])),
             ('lines_ex_id', array([0])), 
             ('nb_elements', 6)])
 
-The actions are constructed in such a way that they satisfy the substation
-related constraints. However, the connex constraint is not checked.
-
-After substation_config is created (or "act_dict"), this needs to be translated 
-into a format to be used within the grid2op package which defines how an action
-is displayed. It is of a datatype called "TopologyAction" which
-is derived from "Action_space" method and it needs a dictionary of the type:
-    {"set_bus":substation_config} 
-    where substation is the "key" of this dictionary
-Another key that this "Action_space" method can take is "change_bus" but that 
-is not considered here. 
+Mirrored configurations (swapping busbars 1 and 2) are only included once, and
+configurations that isolate a single object on a busbar (beta) are excluded.
+There are two enumerations, which differ in the configurations that connect
+only non-line objects to a busbar (gamma):
+    - the legacy enumeration reproduces the original generator, which only
+      excluded some of these, by hard-coded rules for substations of
+      rte_case14_realistic. It only exists because the action indices in
+      the existing tutor data refer to it, so it is only allowed for, and
+      the default for, rte_case14_realistic,
+    - the gamma enumeration excludes all of these, for any grid.
+The connex constraint is not checked. Since the enumeration only depends on
+which objects are connected to which substation, it works for any grid2op
+environment; the actions are generated substation by substation, so that
+large grids need not have their entire action space in memory at once.
+
+Grid2op actions of the type "TopologyAction" are only created from the set
+topology vectors when needed, via the action space:
+    action_space({"set_bus": set_topo_vect})
 """
-import grid2op
+from __future__ import annotations
 import numpy as np
 import itertools as it
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Sequence, Iterator, Union, TYPE_CHECKING
 import auxiliary.util as util
 import argparse
+import os
+import collections.abc
+import importlib.metadata
+import json
 
-def create_dictionary(combs,sub_elem): 
-    """ To create action in the form of dictionary for this particular 
-    input combination for this list of elements
-    #the input combination provided pertains to the combination for a single 
-    # busbar, i.e. busbar number 1. 
-    # The combination for busbar number 2 is extracted from here in the manner
-    that if the input combination (combs) does not contain elements which are
-    not in the list of elements (sub_elem) then these elements will form the
-    combination for busbar 2."""
-    sub_elem_local=sub_elem.copy() #to create a local copy of sub_elem
-    #variables to count the number of loads, gens and lines in this combination
-    ctr_load=0
-    ctr_gen=0
-    ctr_line_or=0
-    ctr_line_ex=0
-    elem1=[]
-    elem2=[]
-    elem3=[]
-    elem4=[]
-    elem5=[]
-    elem6=[]
-    elem7=[]
-    elem8=[]
-    copy_combs=sub_elem_local.copy()
-    for elem in sub_elem_local:  
-        #check if elements in sub_elem_local and then remove them
-        if elem in combs: 
-        # removing elements from overall list since they will be
-        # assigned to busbar1
-            copy_combs.remove(elem)
-        # copy_combs will be the combination of elements for busbar 2
-    # this below loop will create the required setup for bus bar 1
-    for elem in combs: 
-        #to create the dictionary related to elements on busbar 1
-        if 'loads_id' in elem:
-            length=len(elem)-8 # 8 is length of string 'loads_id', 
-            # done in this manner for 2 or more digit ids
-            elem1.append(int(elem[-length:])) 
-            ctr_load+=1
-        elif 'generators_id' in elem:
-            length=len(elem)-13  # 13 is length of string 'generators_id'
-            elem2.append(int(elem[-length:]))
-            ctr_gen+=1
-        elif 'lines_or_id' in elem:
-            length=len(elem)-11 # 11 is length of string 'lines_or_id'
-            elem3.append(int(elem[-length:]))
-            ctr_line_or+=1      
-        elif 'lines_ex_id' in elem:
-            length=len(elem)-11  # 11 is length of string 'lines_ex_id'
-            elem4.append(int(elem[-length:]))
-            ctr_line_ex+=1
-        
-    # to create the list of '1's in order to create the pair as required for 
-    # the four types of elements: loads, gens, lines_or, lines_ex
-    busbar_loads=[1]*ctr_load 
-    #loads=list(zip(elem1,busbar1))
-    busbar_gens=[1]*ctr_gen
-    #gens=list(zip(elem2,busbar1))
-    busbar_lines_or=[1]*ctr_line_or
-    #lines_or=list(zip(elem3,busbar1))
-    busbar_lines_ex=[1]*ctr_line_ex
-    #lines_ex=list(zip(elem4,busbar1))
-    
-    
-    # resetting the variables
-    ctr_load=0
-    ctr_gen=0
-    ctr_line_ex=0
-    ctr_line_or=0
-    # this below loop will create the required setup for bus bar 2
-    for elem in copy_combs: 
-        if 'loads_id' in elem:
-            length=len(elem)-8 # 8 is length of string 'loads_id'
-            # done in this manner for 2 or more digit ids
-            elem5.append(int(elem[-length:])) 
-            ctr_load+=1
-        elif 'generators_id' in elem:
-            length=len(elem)-13  # 13 is length of string 'generators_id'
-            elem6.append(int(elem[-length:]))
-            ctr_gen+=1
-        elif 'lines_or_id' in elem:
-            length=len(elem)-11 # 11 is length of string 'lines_or_id'
-            elem7.append(int(elem[-length:]))
-            ctr_line_or+=1      
-        elif 'lines_ex_id' in elem:
-            length=len(elem)-11  # 11 is length of string 'lines_ex_id'
-            elem8.append(int(elem[-length:]))
-            ctr_line_ex+=1
-
-    #the following sets of four lines each do this:
-            
-    # 1. To create the list of '2's in order to create the pair as required for 
-    # the four types of elements: loads, gens, lines_or, lines_ex
-    # 2. To append the list of 2s to the list of 1s
-    # 3. append the elements for bus bar 2 to the previously created list for busbar1
-    # 4. create the pairs of (id_number, busbar number)
-    busbar2=[2]*ctr_load
-    busbar_loads=busbar_loads+busbar2
-    elem1=elem1+elem5 #for loads
-    loads=list(zip(elem1,busbar_loads))
-    
-    busbar2=[2]*ctr_gen
-    busbar_gens=busbar_gens+busbar2
-    elem2=elem2+elem6
-    gens=list(zip(elem2,busbar_gens))
-    
-    busbar2=[2]*ctr_line_or
-    busbar_lines_or=busbar_lines_or+busbar2
-    elem3=elem3+ elem7
-    
-    lines_or=list(zip(elem3,busbar_lines_or))
-    
-    busbar2=[2]*ctr_line_ex
-    busbar_lines_ex=busbar_lines_ex+busbar2
-    elem4=elem4+elem8
-    lines_ex=list(zip(elem4,busbar_lines_ex))
-
-    # to create the dictionary elements of this manner:
-    # {"loads_id" : [(id1,busbar_nr), (id2,busbar_nr), ...], 
-    # "generators_id" : [(id1,busbar_nr), (id2,busbar_nr), ...],
-    # "lines_or_id" : [(id1,busbar_nr), (id2,busbar_nr), ...],
-    # "lines_ex_id" : [(id1,busbar_nr), (id2,busbar_nr), ...]}
-    act_dict=dict(zip(keys[0:],[loads]))
-    act_dict.update(zip(keys[1:],[gens]))
-    act_dict.update(zip(keys[2:],[lines_or]))
-    act_dict.update(zip(keys[3:],[lines_ex]))
-    # create the dictionary as "set_bus": dictionary to feed as input to 
-    # the grid2op method of "action_space"
-    action=action_space({"set_bus":act_dict})
-    return action
-
-def check_gamma(combinations):
-  """This function is used to remove element combinations for 
-  a single busbar which violate the 'One Line Constraint',(also called 
-  gamma constraint) which states:
-  Out of the elements connected to a bus-bar, at least one of them has to be a line. 
-  Or: a bus-bar cannot have ONLY non-line elements (loads, generators) connected to it.
-  The input to this function is a combination of elements, 
-  e.g: [('loads_id1,generators_id1), ('line_ex_id1,generators_id1'), ('line_or_id2,generators_id1')]
-  In this example, the first combination:('loads_id1,generators_id1) violates the gamma constraint. 
-  Hence, it has to be removed. So the resulting set of combinations of elements that will be returned
-  from this function are
-  combs : [('line_ex_id1,generators_id1'), ('line_or_id2,generators_id1')] """
-  for elem in combinations: 
-    #the following loop is to remove combinations
-    #that have ONLY two non-line elements (gamma)
-    temp1=elem[0]
-    temp2=elem[1]
-    if((''.join(temp1)).find('loads_id') != -1 and (''.join(temp2)).find('generators_id') != -1):
-      combinations.remove(elem)
-  return combinations
-
-def return_DN_actions_indices(all_actions):
-  """To only list the actions which are the same as the default configuration
-      (also called the "do-nothing actions")"""
-  return (len(all_actions) - 1)
-  
+# grid2op is only imported when an environment has to be made, since
+# importing it is slow and loading the action space files does not need it
+if TYPE_CHECKING:
+    import grid2op
 
-def get_obj_connect_to_subtation(sub_items : List[Tuple['str',np.array]], 
-                                 disable_line: int = -1) -> \
-                                Tuple[List[str], int]:
-    '''
-    Returns the objects connected to a subtation.
+# The version of the action space files. Should be incremented whenever the
+# enumeration of the actions changes, so that existing files become stale
+ACTION_SPACE_VERSION = 2
+# The enumerations of the actions. Existing tutor data refers to the legacy enumeration
+LEGACY_ENUMERATION = 'legacy'
+GAMMA_ENUMERATION = 'gamma'
+ENUMERATIONS = (LEGACY_ENUMERATION, GAMMA_ENUMERATION)
+# Per substation, the number of actions of rte_case14_realistic without a disabled line,
+# as generated by the original generator. Used to check the legacy enumeration
+LEGACY_RTE_CASE14_SUB_ACTION_COUNTS = [0, 25, 3, 26, 11, 25, 0, 0, 11, 0, 0, 0, 4, 0]
+# The environment the action spaces are generated for by default
+DEFAULT_ENV_NAME = 'rte_case14_realistic'
+
+
+def substation_bipartitions(is_line: Sequence[bool]) -> np.array:
+    """
+    Enumerate the valid configurations of the objects of a single substation
+    over its two busbars, using bitmasks: bit k of a mask indicates whether
+    object k is connected to busbar 1.
+
+    The following configurations are excluded:
+        - symmetric configurations: only configurations with at least as many
+          objects on busbar 1 as on busbar 2 are included; if both busbars
+          have the same number of objects, only the configurations with the
+          first object on busbar 1,
+        - configurations with a single object on busbar 2 (beta), since that
+          object would be disconnected from the rest of the substation,
+        - configurations that violate the gamma constraint: each busbar with
+          objects connected to it should have at least one line connected.
+    The configurations are ordered by the number of objects on busbar 1, and
+    then lexicographically by the objects on busbar 1, as would be produced
+    by itertools.combinations.
 
     Parameters
     ----------
-    sub_items : List['str',np.array]
-        The list of tuples of object types. Each tuple consists of a
-        string representing he object type and and array with the indexes
-        of the connected object of that type.
-        Also contains an entry with string 'nb_elements'.
-    disable_line : int, optional
-        The index of the line to be disabled. The default is -1.
+    is_line : Sequence[bool]
+        For each object of the substation, whether it is a line (origin or
+        extremity).
 
     Returns
     -------
-    sub_elem : List[str]
-        String representations of the objects
-    sub_nb_elem : int
-        Total number of connected objects.
+    np.array
+        Boolean matrix with shape (N_CONFIGURATIONS, N_OBJECTS). True
+        indicates that the object is connected to busbar 1, False to busbar 2.
+    """
+    is_line = np.asarray(is_line, dtype=bool)
+    n = len(is_line)
+    masks = np.arange(2 ** n, dtype=np.int64)
+    on_bus1 = ((masks[:, np.newaxis] >> np.arange(n)) & 1).astype(bool)
+    n_bus1 = on_bus1.sum(axis=1)
+    n_bus2 = n - n_bus1
 
-    '''
-    sub_elem = []
-    #sub_nb_elem is the number of elements conncted to this particular substation
-    for k,v in sub_items:
-        #this loop is to create a list of all elements connected 
-        #to a single substation
-        #example: k='lines_or_id' and v=array([2, 3, 4]
-            if k=='nb_elements': #there is a key in this dictionary called 
-            # "nb_elements" which we don't want 
-            # because we only want to list the names of the elements itself
+    # Symmetry halving, beta constraint
+    valid = (n_bus1 > n_bus2) | ((n_bus1 == n_bus2) & on_bus1[:, 0])
+    valid &= n_bus2 != 1
+    # Gamma constraint
+    valid &= (on_bus1 & is_line).any(axis=1)
+    valid &= (n_bus2 == 0) | (~on_bus1 & is_line).any(axis=1)
+
+    # Order lexicographically within the same number of objects on busbar 1:
+    # the value of the mask with reversed bits is descending in that order
+    reversed_value = on_bus1 @ (2 ** np.arange(n - 1, -1, -1, dtype=np.int64))
+    on_bus1, n_bus1, reversed_value = on_bus1[valid], n_bus1[valid], reversed_value[valid]
+    return on_bus1[np.lexsort((-reversed_value, n_bus1))]
+
+
+def _remove_while_iterating(combs: List[tuple], remove) -> List[tuple]:
+    """
+    Remove combinations as the original generator did, by removing them from
+    the list while iterating over it: the combination after each removed one
+    is skipped, and hence always kept.
+
+    Parameters
+    ----------
+    combs : List[tuple]
+        The combinations.
+    remove : Callable[[tuple], bool]
+        Whether a combination should be removed.
+
+    Returns
+    -------
+    List[tuple]
+        The remaining combinations.
+    """
+    kept = []
+    skip = False
+    for comb in combs:
+        if not skip and remove(comb):
+            skip = True
+            continue
+        kept.append(comb)
+        skip = False
+    return kept
+
+
+def legacy_substation_bipartitions(sub_id: int, names: Sequence[str]) -> np.array:
+    """
+    Enumerate the configurations of the objects of a single substation over
+    its two busbars as the original, itertools-based generator did.
+
+    This enumeration only exists to keep the action indices in existing
+    tutor data of rte_case14_realistic valid; it should not be used for other
+    grids (see resolve_enumeration()). It is the enumeration of
+    substation_bipartitions(), except for the gamma constraint, which is only
+    applied by the hard-coded rules of the original generator for substations
+    1, 2 and 5 of rte_case14_realistic (and only for substations with an even
+    number of objects).
+
+    Parameters
+    ----------
+    sub_id : int
+        The substation id.
+    names : Sequence[str]
+        For each object of the substation, its name as in the original
+        generator, i.e. the object type and id, such as 'loads_id1'.
+
+    Returns
+    -------
+    np.array
+        Boolean matrix with shape (N_CONFIGURATIONS, N_OBJECTS). True
+        indicates that the object is connected to busbar 1, False to busbar 2.
+    """
+    n = len(names)
+    has = lambda comb, name: name in [names[k] for k in comb]
+
+    combs = []
+    # Substations with less than four objects have no do-something actions
+    if n >= 4:
+        for j in range((n + 1) // 2, n + 1):
+            # Beta constraint
+            if j == n - 1:
                 continue
-            
-            #Added by Matthijs on nov 18 2021:
-            #Disable the line if it is to be disabled
-            if k in ('lines_or_id','lines_ex_id'):
-                if disable_line in v:
-                    v =  np.delete(v, np.where(v == disable_line))
-                    
-            
-            
-            if np.size(v)>1: #number of elements with key k connected to sub_id
-                for j in range(np.size(v)):
-                    str1 = k + str(v[j])
-                    sub_elem.append(str1)
-                    # example: str1 = 'lines_or_id' + str(2)
-            elif np.size(v)==1:
-                sub_elem.append(str(k)+str(v[0])) 
-    # By the end of the above loop, sub_elem will be complete
-
-    sub_nb_elem= len(sub_elem)
-    return sub_elem, sub_nb_elem         
-    
-def create_action_space(env,substation_ids=list(range(14)), disable_line=-1):
-    """ This function will produce a list of all actions possible for the 
-    substations identified in substation_ids.
-    - substations_id is a list of the ids of the substations that are in scope.
-    - sub_id is the id of a substation.
-    - sub_elem is a list that contains all the elements connected to a 
-    single substation (identified by sub_id).
-    - all_actions is a list that will contain a list of all actions for all 
-    substations in substation_ids. 
-    - also returns a list of indices of the all_actions list which are 
-    do-nothing actions. 
+            j_combs = list(it.combinations(range(n), j))
+            if n % 2 == 0 and j == n // 2:
+                # Symmetry halving
+                j_combs = j_combs[:len(j_combs) // 2]
+                if sub_id == 2:
+                    j_combs = _remove_while_iterating(
+                        j_combs, lambda c: has(c, 'loads_id1') and has(c, 'generators_id1'))
+            elif n % 2 == 0 and j == 4 and sub_id == 1:
+                j_combs = _remove_while_iterating(
+                    j_combs, lambda c: not has(c, 'generators_id0') and not has(c, 'loads_id0'))
+            elif n % 2 == 0 and j == 4 and sub_id == 5:
+                j_combs = _remove_while_iterating(
+                    j_combs, lambda c: not has(c, 'generators_id2') and not has(c, 'loads_id4'))
+            combs.extend(j_combs)
+
+    on_bus1 = np.zeros((len(combs), n), dtype=bool)
+    for i, comb in enumerate(combs):
+        on_bus1[i, list(comb)] = True
+    return on_bus1
+
+
+def resolve_enumeration(env_name: str, enumeration: Optional[str] = None) -> str:
+    """
+    Determine the enumeration of the action space of an environment. The
+    legacy enumeration hard-codes rules for substations of
+    rte_case14_realistic, so it is only allowed for that environment.
 
     Parameters
     ----------
-    disable_line : int, optional
-        The index of a line form the environment to be disabled. 
-        The default is -1, i.e no line.
-        
-    Raises
+    env_name : str
+        The name of the environment.
+    enumeration : Optional[str], optional
+        The enumeration, legacy or gamma. The default is None, in which case
+        the legacy enumeration is used for rte_case14_realistic, and the gamma
+        enumeration for other environments.
+
+    Returns
+    -------
+    str
+        The enumeration.
+    """
+    if enumeration is None:
+        enumeration = LEGACY_ENUMERATION if env_name == DEFAULT_ENV_NAME else GAMMA_ENUMERATION
+    assert enumeration in ENUMERATIONS, f'Enumeration should be one of {ENUMERATIONS}.'
+    assert enumeration != LEGACY_ENUMERATION or env_name == DEFAULT_ENV_NAME, \
+        f'The legacy enumeration is only defined for {DEFAULT_ENV_NAME}.'
+    return enumeration
+
+
+def iter_set_actions(n_objects: int,
+                     sub_objects: Sequence[Tuple[np.array, np.array]],
+                     enumeration: str = GAMMA_ENUMERATION,
+                     sub_names: Optional[Sequence[Sequence[str]]] = None) -> Iterator[Tuple[int, np.array]]:
+    """
+    Generate the 'set' busbar actions of a grid, substation by substation, so
+    that only the actions of a single substation are in memory at once.
+    Substations with a single valid configuration are skipped, since these
+    have no do-something actions.
+
+    Parameters
     ----------
+    n_objects : int
+        The number of objects in the grid, i.e. the length of the topology
+        vector.
+    sub_objects : Sequence[Tuple[np.array, np.array]]
+        Per substation, the indices in the topology vector of the connected
+        objects and, for each of these objects, whether it is a line.
+    enumeration : str, optional
+        The enumeration, legacy or gamma. The default is gamma.
+    sub_names : Optional[Sequence[Sequence[str]]], optional
+        Per substation, the names of the connected objects, as returned by
+        get_substation_object_names(). Required for the legacy enumeration.
+        The default is None.
+
+    Raises
+    ------
     Exception
-            Network has illegal state: this is likely due to removing a powerline
-            connected to a subtation with only two elements.
-        
+        Network has illegal state: this is likely due to removing a powerline
+        connected to a subtation with only two elements.
+
+    Yields
+    ------
+    int
+        The substation id.
+    np.array
+        The set topology vectors of the actions at that substation, with shape
+        (N_SUB_ACTIONS, N_OBJECTS). Zero indicates that an object is not set.
     """
-    nb_elements=list(env.sub_info)  #array of number of elements connected to each 
-                                     #substation 
-                              
-    global keys
-    global action_space
-
-    action_space=env.action_space #defining action space
-    keys=list(env.get_obj_connect_to(None,0).keys()) #keys returns the names used
-    all_actions=[]
-    temp_index = 0
-    for sub_id in substation_ids: # to loop through all substations
-        sub_actions = []
-        #print("SUBSTATION NUMBER: %d" % sub_id)
-        
-        sub_elem, sub_nb_elem = get_obj_connect_to_subtation(env.get_obj_connect_to(None, sub_id).items(),
-                                                            disable_line)
-
-        #Due to line removal, object can now be connected by only a single line (i.e. removal of line 18).
-        #This is illegal, and hence throws an exception.
-        if sub_nb_elem<2:
-             raise Exception('Network has illegal state: this is likely due to removing ' +
-                             'a powerline connected to a subtation with only two connected objects.')
-        
-        #For substations with less than four connected objects, there is only
-        #a single valid topology, so no legal do-something actions exist for these
-        #substations. Hence, we skip them.
-        if sub_nb_elem<4:
+    assert enumeration in ENUMERATIONS, f'Enumeration should be one of {ENUMERATIONS}.'
+    assert enumeration != LEGACY_ENUMERATION or sub_names is not None, \
+        'The legacy enumeration requires the names of the objects.'
+    assert enumeration != LEGACY_ENUMERATION or len(sub_objects) == len(LEGACY_RTE_CASE14_SUB_ACTION_COUNTS), \
+        f'The legacy enumeration is only defined for {DEFAULT_ENV_NAME}.'
+
+    for sub_id, (pos_topo_vect, is_line) in enumerate(sub_objects):
+        # Due to line removal, object can now be connected by only a single line (i.e. removal of line 18).
+        # This is illegal, and hence throws an exception.
+        if len(pos_topo_vect) < 2:
+            raise Exception('Network has illegal state: this is likely due to removing ' +
+                            'a powerline connected to a subtation with only two connected objects.')
+
+        if enumeration == LEGACY_ENUMERATION:
+            on_bus1 = legacy_substation_bipartitions(sub_id, sub_names[sub_id])
+        else:
+            on_bus1 = substation_bipartitions(is_line)
+        if len(on_bus1) < 2:
             continue
-        
-        # Below, we now start to fill the sub_actions list
-        # there are two cases:
-        # 1. if the number of elements connected is odd
-        # 2. if it is even
-        if(sub_nb_elem%2): #if it is an odd number
-            # From the formula created in the report, this part creates 
-            # the alpha/2 term
-            r=int((sub_nb_elem/2)+0.5) 
-            # To choose half of total space, since it is
-            # an odd number, we round it by adding 0.5
-            for j in range(r,sub_nb_elem+1):  
-                # choosing (0,sub_nb_elem+1) will result 
-                # in alpha term but choosing (r,sub_nb_elem+1) results in alpha/2
-                #print('Choosing '+ str(j)+ ' out of '+str(sub_nb_elem)) 
-                #bionomial coefficiants
-                if(j==sub_nb_elem-1): # removing beta/2 term
-                    # if it was entire "alpha" we would have to remove both 
-                    # j==1 and j==n-1. But since we have already reduced alpha
-                    # to alpha/2, we only need to choose the latter
-                    continue # the terms for sub_nb_elem-1 are now excluded
-                combs=list(it.combinations(sub_elem, j)) 
-                # this command creates the combinations for "sub_elem"
-                # this can also be explained by the line shown here:
-                # print('Choosing '+ str(j)+ ' out of '+str(sub_nb_elem))
-                # so, sub_nb_elem is the length of sub_elem. 
-                # e.g. if sub_nb_elem=6 and j =3, in this iteration it will be:
-                # "choosing 3 out of 6"
-                for each in combs:
-                # this is the loop to create the action for a particular 
-                # combination
-                        single_action=create_dictionary(each,sub_elem)
-                        sub_actions.append(single_action)
-        else: # if it is an even number
-            r=int(sub_nb_elem/2)  # To choose half of total space
-            for j in range(r,sub_nb_elem+1): 
-                # choosing (0,sub_nb_elem+1) will result 
-                # in alpha term but choosing (r,sub_nb_elem+1) results in alpha/2
-                #print('Choosing '+ str(j)+ ' out of '+str(sub_nb_elem))
-                if(j==sub_nb_elem-1): # removing beta/2 term
-                    continue
-                combs=list(it.combinations(sub_elem, j))
-               
-                if(j==int(sub_nb_elem/2) and sub_id!=2):
-                    # in an even number, the number of possiblities will be 
-                    # 1 more than the number. e.g.: sub_nb_elem=6, so number of 
-                    # possibilities is 7. Hence, the median (4th) possibility 
-                    # should be divided by half to get exactly half the 
-                    # number of possibilities. This is done below.
-                    combs=combs[0:int(len(combs)/2)]
-                    for each in combs:
-                        single_action=create_dictionary(each,sub_elem)
-                        sub_actions.append(single_action)
-                elif(j==int(sub_nb_elem/2) and sub_id==2): #gamma term hardcoding
-                    combs=combs[0:int(len(combs)/2)]
-                    # these substrings are hard coded to exclude the 
-                    # combinations as per the gamma constraint
-                    sub_string1='loads_id1'
-                    sub_string2='generators_id1'
-                    for elem in combs:
-                        if sub_string1 in elem and sub_string2 in elem:
-                            combs.remove(elem)
-                    for each in combs:
-                        single_action=create_dictionary(each,sub_elem)
-                        sub_actions.append(single_action)
-                    
-                elif(j==4) and (sub_id==1): # for gamma term hardcoding
-                    # these substrings are hard coded to exclude the 
-                    # combinations as per the gamma constraint
-                    sub_string1='generators_id0'
-                    sub_string2='loads_id0'
-                    for elem in combs:
-                        if (sub_string1 not in elem) and (sub_string2 not in elem):
-                            combs.remove(elem)
-                    for each in combs:
-                        single_action=create_dictionary(each,sub_elem)
-                        sub_actions.append(single_action)
-                    
-                elif(j==4) and (sub_id==5): #gamma term hardcoding
-                    # these substrings are hard coded to exclude the 
-                    # combinations as per the gamma constraint
-                    sub_string1='generators_id2'
-                    sub_string2='loads_id4'
-                    for elem in combs:
-                        if (sub_string1 not in elem) and (sub_string2 not in elem):
-                            combs.remove(elem)
-                    for each in combs:
-                        single_action=create_dictionary(each,sub_elem)
-                        sub_actions.append(single_action)
-                    
-                else:
-                    # this case is for all other cases not described above
-                    combs=list(it.combinations(sub_elem, j))
-                    for each in combs:
-                        single_action=create_dictionary(each,sub_elem)
-                        sub_actions.append(single_action)
-        
-        #Added by Matthijs on 17/11/2021 to remove do-nothing actions
-        if len(sub_actions) > 1:
-            all_actions.extend(sub_actions)
 
-    return all_actions
+        sub_set_actions = np.zeros((len(on_bus1), n_objects), dtype=np.int32)
+        sub_set_actions[:, pos_topo_vect] = np.where(on_bus1, 1, 2)
+        yield sub_id, sub_set_actions
+
+
+def enumerate_set_actions(n_objects: int,
+                          sub_objects: Sequence[Tuple[np.array, np.array]],
+                          enumeration: str = GAMMA_ENUMERATION,
+                          sub_names: Optional[Sequence[Sequence[str]]] = None) -> np.array:
+    """
+    Enumerate the 'set' busbar actions of a grid, substation by substation.
+    See iter_set_actions().
+
+    Parameters
+    ----------
+    n_objects : int
+        The number of objects in the grid, i.e. the length of the topology
+        vector.
+    sub_objects : Sequence[Tuple[np.array, np.array]]
+        Per substation, the indices in the topology vector of the connected
+        objects and, for each of these objects, whether it is a line.
+    enumeration : str, optional
+        The enumeration, legacy or gamma. The default is gamma.
+    sub_names : Optional[Sequence[Sequence[str]]], optional
+        Per substation, the names of the connected objects. Required for the
+        legacy enumeration. The default is None.
+
+    Returns
+    -------
+    np.array
+        The set topology vectors of the actions, with shape
+        (N_ACTIONS, N_OBJECTS). Zero indicates that an object is not set.
+    """
+    return np.concatenate([np.zeros((0, n_objects), dtype=np.int32)] +
+                          [sub_set_actions for _, sub_set_actions
+                           in iter_set_actions(n_objects, sub_objects, enumeration, sub_names)])
+
+
+def validate_set_actions(set_actions: np.array,
+                         sub_objects: Sequence[Tuple[np.array, np.array]],
+                         gamma: bool = True) -> np.array:
+    """
+    Check, for a matrix of set topology vectors, which rows are valid 'set'
+    busbar actions of the grid. A valid action sets all objects of exactly
+    one substation, and no other objects, to busbar 1 or 2, such that:
+        - the action is not the mirror of an action in the enumeration, i.e.
+          busbar 1 has more objects than busbar 2, or the first object
+          is on busbar 1 if they have the same number of objects,
+        - busbar 2 does not have a single object connected (beta),
+        - each busbar with objects connected has at least one line connected
+          (gamma), unless gamma is False. The legacy enumeration does not
+          satisfy this constraint.
+    This does not depend on the grid, so it can be used to check action
+    spaces that were not generated by iter_set_actions().
+
+    Parameters
+    ----------
+    set_actions : np.array
+        The set topology vectors, with shape (N_ACTIONS, N_OBJECTS).
+    sub_objects : Sequence[Tuple[np.array, np.array]]
+        Per substation, the indices in the topology vector of the connected
+        objects and, for each of these objects, whether it is a line.
+    gamma : bool, optional
+        Whether to check the gamma constraint. The default is True.
+
+    Returns
+    -------
+    np.array
+        Boolean array with shape (N_ACTIONS,), indicating which rows are
+        valid actions.
+    """
+    set_actions = np.asarray(set_actions)
+    is_set = set_actions != 0
+    n_set = is_set.sum(axis=1)
+    valid = np.zeros(len(set_actions), dtype=bool)
+
+    for pos_topo_vect, is_line in sub_objects:
+        sub_set = set_actions[:, pos_topo_vect]
+
+        # Exactly the objects of this substation should be set, to busbar 1 or 2
+        at_sub = (n_set == len(pos_topo_vect)) & is_set[:, pos_topo_vect].all(axis=1)
+        at_sub &= np.isin(sub_set, (1, 2)).all(axis=1)
+
+        on_bus1 = sub_set == 1
+        n_bus1 = on_bus1.sum(axis=1)
+        n_bus2 = len(pos_topo_vect) - n_bus1
+        if len(pos_topo_vect) > 0:
+            at_sub &= (n_bus1 > n_bus2) | ((n_bus1 == n_bus2) & on_bus1[:, 0])
+        at_sub &= n_bus2 != 1
+        if gamma:
+            at_sub &= (on_bus1 & is_line).any(axis=1)
+            at_sub &= (n_bus2 == 0) | (~on_bus1 & is_line).any(axis=1)
+        valid |= at_sub
+
+    return valid
+
+
+def get_substation_objects(env: grid2op.Environment.Environment,
+                           disable_line: int = -1) -> List[Tuple[np.array, np.array]]:
+    """
+    Find, per substation, the objects connected to it, in the order loads,
+    generators, line origins, line extremities (by increasing id).
+
+    Parameters
+    ----------
+    env : grid2op.Environment.Environment
+        The environment.
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. Its objects
+        are excluded. The default is -1, i.e no line.
+
+    Returns
+    -------
+    List[Tuple[np.array, np.array]]
+        Per substation, the indices in the topology vector of the connected
+        objects and, for each of these objects, whether it is a line.
+    """
+    line_ids = np.arange(env.n_line)
+    line_kept = line_ids != disable_line
+
+    sub_objects = []
+    for sub_id in range(env.n_sub):
+        pos_topo_vect = np.concatenate(
+            [env.load_pos_topo_vect[env.load_to_subid == sub_id],
+             env.gen_pos_topo_vect[env.gen_to_subid == sub_id],
+             env.line_or_pos_topo_vect[(env.line_or_to_subid == sub_id) & line_kept],
+             env.line_ex_pos_topo_vect[(env.line_ex_to_subid == sub_id) & line_kept]]).astype(int)
+        n_non_line = np.sum(env.load_to_subid == sub_id) + np.sum(env.gen_to_subid == sub_id)
+        is_line = np.arange(len(pos_topo_vect)) >= n_non_line
+        sub_objects.append((pos_topo_vect, is_line))
+    return sub_objects
+
+
+def get_substation_object_names(env: grid2op.Environment.Environment,
+                                disable_line: int = -1) -> List[List[str]]:
+    """
+    Find, per substation, the names of the objects connected to it, as used
+    by the original generator (e.g. 'loads_id1'), in the order of
+    get_substation_objects().
+
+    Parameters
+    ----------
+    env : grid2op.Environment.Environment
+        The environment.
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. Its objects
+        are excluded. The default is -1, i.e no line.
+
+    Returns
+    -------
+    List[List[str]]
+        Per substation, the names of the connected objects.
+    """
+    line_kept = np.arange(env.n_line) != disable_line
+    return [[f'loads_id{i}' for i in np.flatnonzero(env.load_to_subid == sub_id)] +
+            [f'generators_id{i}' for i in np.flatnonzero(env.gen_to_subid == sub_id)] +
+            [f'lines_or_id{i}' for i in np.flatnonzero((env.line_or_to_subid == sub_id) & line_kept)] +
+            [f'lines_ex_id{i}' for i in np.flatnonzero((env.line_ex_to_subid == sub_id) & line_kept)]
+            for sub_id in range(env.n_sub)]
+
+
+def create_set_action_space(env: grid2op.Environment.Environment,
+                            disable_line: int = -1,
+                            enumeration: Optional[str] = None) -> np.array:
+    """
+    Create the set topology vectors of all legal do-something 'set' busbar
+    actions of an environment.
+
+    Parameters
+    ----------
+    env : grid2op.Environment.Environment
+        The environment.
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. 
+        The default is -1, i.e no line.
+    enumeration : Optional[str], optional
+        The enumeration, legacy or gamma. The default is None, i.e. legacy
+        for rte_case14_realistic and gamma otherwise (see
+        resolve_enumeration()).
+
+    Returns
+    -------
+    np.array
+        The set topology vectors of the actions, with shape
+        (N_ACTIONS, N_OBJECTS).
+    """
+    enumeration = resolve_enumeration(get_env_name(env), enumeration)
+    return enumerate_set_actions(env.dim_topo, get_substation_objects(env, disable_line), enumeration,
+                                 get_substation_object_names(env, disable_line))
+
+
+class LazySetBusActions(collections.abc.Sequence):
+    """
+    Sequence of grid2op 'set' busbar actions, which are only created from
+    their set topology vectors when they are first accessed.
+    """
+
+    def __init__(self, env_action_space: grid2op.Action.ActionSpace, set_topo_vects: np.array):
+        """
+        Parameters
+        ----------
+        env_action_space : grid2op.Action.ActionSpace
+            The action space used to create the actions.
+        set_topo_vects : np.array
+            The set topology vectors of the actions, with shape
+            (N_ACTIONS, N_OBJECTS).
+        """
+        self.env_action_space = env_action_space
+        self.set_topo_vects = set_topo_vects
+        self._actions = [None] * len(set_topo_vects)
+
+    def __len__(self) -> int:
+        return len(self.set_topo_vects)
+
+    def __getitem__(self, idx: int) -> grid2op.Action.TopologyAction:
+        if self._actions[idx] is None:
+            self._actions[idx] = self.env_action_space({'set_bus': np.array(self.set_topo_vects[idx])})
+        return self._actions[idx]
+
 
 class action_identificator():
     '''
     Class for identifying action IDs as originating from Medha's model and
-    retrieving the corresponding Grid2Op actions. The actions are limited
+    retrieving the corresponding set topology vectors. The actions are limited
     to instances of setting the topology vector.
     
-    A class to reduce overhead.
+    A class to reduce overhead. The set topology vectors are loaded from the
+    action space file, which is only generated if it is missing or stale.
     '''
     
-    def __init__(self,line_disabled: int=-1):
+    def __init__(self, line_disabled: int = -1, action_space_path: Optional[str] = None):
+        '''
+        Parameters
+        ----------
+        line_disabled : int, optional
+            The index of the disabled line. The default is -1, i.e no line.
+        action_space_path : Optional[str], optional
+            The directory of the action space files. The default is None,
+            in which case the directory in the config is used.
+        '''
+        if action_space_path is None:
+            action_space_path = util.load_config()['paths']['action_space']
 
-        self.all_actions = get_env_actions(line_disabled)
+        # Matrix of the set topology vectors of all actions, rows indexed by
+        # action id
+        self.set_topo_vects = load_set_action_space(action_space_path, line_disabled)
         
     def get_set_topo_vect(self, action_id: int):
         '''
@@ -460,49 +577,529 @@ class action_identificator():
             A 0 represent no change, 1 set to the first busbar, 2 set to the second busbar.
 
         '''
-        return self.all_actions[action_id]._set_topo_vect
+        return self.set_topo_vects[action_id]
     
-def get_env_actions(disable_line: int =-1) -> List[grid2op.Action.TopologyAction]:
+def make_env(env: Union[str, grid2op.Environment.Environment]) -> grid2op.Environment.Environment:
     '''
-    For the rte_case14_realistic environment, find the 'set' busbar actions that are
-    legal.
+    Make an environment from its name, if it is not an environment already.
+
+    Parameters
+    ----------
+    env : Union[str, grid2op.Environment.Environment]
+        The environment or the name of the environment.
+
+    Returns
+    -------
+    grid2op.Environment.Environment
+        The environment.
+    '''
+    if isinstance(env, str):
+        import grid2op
+        return grid2op.make(env)
+    return env
+
+
+def get_env_name(env: Union[str, grid2op.Environment.Environment]) -> str:
+    '''
+    Get the name of an environment.
+
+    Parameters
+    ----------
+    env : Union[str, grid2op.Environment.Environment]
+        The environment or the name of the environment.
+
+    Returns
+    -------
+    str
+        The name of the environment.
+    '''
+    return env if isinstance(env, str) else env.env_name
+
+
+def get_env_actions(disable_line: int = -1,
+                    env: Union[str, grid2op.Environment.Environment] = DEFAULT_ENV_NAME,
+                    enumeration: Optional[str] = None) \
+        -> List[grid2op.Action.TopologyAction]:
+    '''
+    For an environment, find the 'set' busbar actions that are legal.
 
     Parameters
     ----------
     disable_line : int, optional
         The index of a line form the environment to be disabled. 
         The default is -1, i.e no line.
+    env : Union[str, grid2op.Environment.Environment], optional
+        The environment or the name of the environment. The default is
+        rte_case14_realistic.
+    enumeration : Optional[str], optional
+        The enumeration, legacy or gamma. The default is None, i.e. legacy
+        for rte_case14_realistic and gamma otherwise (see
+        resolve_enumeration()).
         
     Returns
     -------
     all_actions : List[grid2op.Action.TopologyAction]
         The list of legal actions.
     '''
-    env = grid2op.make("rte_case14_realistic") #making the environment
-    actions=create_action_space(env,disable_line=disable_line) #default subset is all 14 substations
-    return actions
+    env = make_env(env)
+    return [env.action_space({'set_bus': set_topo_vect})
+            for set_topo_vect in create_set_action_space(env, disable_line, enumeration)]
   
-def generate_action_space(action_space_path: str, disable_line: int =-1):
+def action_space_filename(disable_line: int = -1,
+                          env_name: str = DEFAULT_ENV_NAME,
+                          enumeration: Optional[str] = None) -> str:
+    '''
+    The name of the file with the action space for a disabled line.
+
+    Parameters
+    ----------
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. 
+        The default is -1, i.e no line.
+    env_name : str, optional
+        The name of the environment. The default is rte_case14_realistic,
+        whose files are not prefixed with the environment name.
+    enumeration : Optional[str], optional
+        The enumeration, legacy or gamma. The default is None, i.e. legacy
+        for rte_case14_realistic and gamma otherwise (see
+        resolve_enumeration()). Files of the legacy enumeration are not
+        suffixed with the enumeration.
+
+    Returns
+    -------
+    str
+        The filename.
+    '''
+    enumeration = resolve_enumeration(env_name, enumeration)
+    prefix = '' if env_name == DEFAULT_ENV_NAME else f'{env_name}_'
+    suffix = '' if enumeration == LEGACY_ENUMERATION else f'_{enumeration}'
+    return prefix + ('action_space' if disable_line == -1 else
+                     f'action_space_lout:{disable_line}') + suffix + '.npy'
+
+
+def generate_action_space(action_space_path: str,
+                          disable_line: int = -1,
+                          env: Union[str, grid2op.Environment.Environment] = DEFAULT_ENV_NAME,
+                          enumeration: Optional[str] = None):
     '''
     Saves array representations of the legal do-something 'set' busbar actions 
-    of the rte_case14_realistic environment to a npy file.
+    of an environment to a npy file.
+    
+    The actions are written substation by substation into a memory-mapped
+    file, so that the action space of large grids need not fit in memory.
+    The legacy enumeration of rte_case14_realistic without a disabled line
+    is checked against the action counts of the original generator.
 
     Parameters
     ----------
-    action_space_file : str 
-        The npy file to save as.
+    action_space_path : str 
+        The directory to save the npy file in.
     disable_line : int, optional
         The index of a line form the environment to be disabled. 
         The default is -1, i.e no line.
+    env : Union[str, grid2op.Environment.Environment], optional
+        The environment or the name of the environment. The default is
+        rte_case14_realistic.
+    enumeration : Optional[str], optional
+        The enumeration, legacy or gamma. The default is None, i.e. legacy
+        for rte_case14_realistic and gamma otherwise (see
+        resolve_enumeration()).
     '''
-    set_actions = np.array([a._set_topo_vect for a in get_env_actions(disable_line=disable_line)])
-    n_actions = len(set_actions)
-    print(f'Nr. of actions foud: {n_actions}')
+    env_name = get_env_name(env)
+    enumeration = resolve_enumeration(env_name, enumeration)
+    env = make_env(env)
+    sub_objects = get_substation_objects(env, disable_line)
+    sub_names = get_substation_object_names(env, disable_line)
     
-    filename = 'action_space.npy' if disable_line == -1 else \
-                f'action_space_lout:{disable_line}.npy'
-    np.save(action_space_path + filename,set_actions)
+    # Count the actions first, so that the file can be allocated
+    sub_action_counts = [0] * len(sub_objects)
+    for sub_id, sub_set_actions in iter_set_actions(env.dim_topo, sub_objects, enumeration, sub_names):
+        sub_action_counts[sub_id] = len(sub_set_actions)
+    n_actions = sum(sub_action_counts)
+    print(f'Nr. of actions foud: {n_actions}')
+    if enumeration == LEGACY_ENUMERATION and env_name == DEFAULT_ENV_NAME and disable_line == -1:
+        assert sub_action_counts == LEGACY_RTE_CASE14_SUB_ACTION_COUNTS, \
+            'The legacy enumeration should match the original generator.'
     
+    # Write to a temporary file first, so that an interrupted generation does
+    # not leave an incomplete file behind
+    os.makedirs(action_space_path, exist_ok=True)
+    fpath = action_space_path + action_space_filename(disable_line, env_name, enumeration)
+    set_actions = np.lib.format.open_memmap(fpath + '.tmp', mode='w+', dtype=np.int32,
+                                            shape=(n_actions, env.dim_topo))
+    start = 0
+    for _, sub_set_actions in iter_set_actions(env.dim_topo, sub_objects, enumeration, sub_names):
+        assert validate_set_actions(sub_set_actions, sub_objects, enumeration == GAMMA_ENUMERATION).all(), \
+            'Enumerated actions should satisfy the substation constraints.'
+        set_actions[start:start+len(sub_set_actions)] = sub_set_actions
+        start += len(sub_set_actions)
+    set_actions.flush()
+    del set_actions
+    os.replace(fpath + '.tmp', fpath)
+
+    # The metadata is written last, so that it only describes a complete
+    # action space file
+    metadata = {'version': ACTION_SPACE_VERSION,
+                'enumeration': enumeration,
+                'env_name': env_name,
+                'disable_line': disable_line,
+                'sub_info': [int(n) for n in env.sub_info],
+                'dim_topo': int(env.dim_topo),
+                'n_actions': n_actions,
+                'grid2op_version': grid2op_version(),
+                'checksum': util.hash_file(fpath)}
+    with open(metadata_filepath(fpath) + '.tmp', 'w') as file:
+        json.dump(metadata, file)
+    os.replace(metadata_filepath(fpath) + '.tmp', metadata_filepath(fpath))
+
+
+def grid2op_version() -> Optional[str]:
+    '''
+    The version of the installed grid2op package, without importing it.
+
+    Returns
+    -------
+    Optional[str]
+        The version. None if grid2op is not installed.
+    '''
+    try:
+        return importlib.metadata.version('grid2op')
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def metadata_filepath(fpath: str) -> str:
+    '''
+    The path of the JSON metadata file belonging to an action space file.
+
+    Parameters
+    ----------
+    fpath : str
+        The path of the action space file.
+
+    Returns
+    -------
+    str
+        The path of the metadata file.
+    '''
+    return os.path.splitext(fpath)[0] + '.json'
+
+
+def read_action_space_metadata(fpath: str) -> Optional[dict]:
+    '''
+    Read the metadata of an action space file.
+
+    Parameters
+    ----------
+    fpath : str
+        The path of the action space file.
+
+    Returns
+    -------
+    Optional[dict]
+        The metadata. None if the metadata file is missing or unreadable.
+    '''
+    try:
+        with open(metadata_filepath(fpath)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def is_action_space_stale(fpath: str,
+                          env_name: str = DEFAULT_ENV_NAME,
+                          disable_line: int = -1,
+                          sub_info: Optional[Sequence[int]] = None,
+                          enumeration: Optional[str] = None) -> bool:
+    '''
+    Check whether an action space file is missing or stale. A file is stale
+    if its metadata is missing, if it was generated by a different version of
+    the generator, for a different environment, disabled line or
+    enumeration, or if its contents do not match the checksum in the
+    metadata. The grid2op version in the metadata is only informative, so
+    that cached files can be used where grid2op is missing or at another
+    version.
+
+    Parameters
+    ----------
+    fpath : str
+        The path of the action space file.
+    env_name : str, optional
+        The name of the environment. The default is rte_case14_realistic.
+    disable_line : int, optional
+        The index of the line disabled. The default is -1, i.e no line.
+    sub_info : Optional[Sequence[int]], optional
+        The number of objects per substation of the environment. If given, it
+        should match the metadata. The default is None.
+    enumeration : Optional[str], optional
+        The enumeration, legacy or gamma. The default is None, i.e. legacy
+        for rte_case14_realistic and gamma otherwise (see
+        resolve_enumeration()).
+
+    Returns
+    -------
+    bool
+        Whether the file should be (re)generated.
+    '''
+    enumeration = resolve_enumeration(env_name, enumeration)
+    metadata = read_action_space_metadata(fpath)
+    if metadata is None or not os.path.exists(fpath):
+        return True
+    if (metadata.get('version') != ACTION_SPACE_VERSION or
+            metadata.get('enumeration') != enumeration or
+            metadata.get('env_name') != env_name or
+            metadata.get('disable_line') != disable_line):
+        return True
+    if sub_info is not None and metadata.get('sub_info') != [int(n) for n in sub_info]:
+        return True
+    return metadata.get('checksum') != util.hash_file(fpath)
+
+
+class ActionSpaceRegistry:
+    """
+    Registry of the set action spaces, through which the action space files
+    are loaded. The action spaces are memoised per process, so that each file
+    is only validated and memory-mapped once, and an environment is only
+    made when a file is missing or stale and has to be (re)generated.
+    """
+
+    def __init__(self):
+        self._set_action_spaces = {}
+
+    def get_set_action_space(self,
+                             action_space_path: str,
+                             disable_line: int = -1,
+                             env: Union[str, grid2op.Environment.Environment] = DEFAULT_ENV_NAME,
+                             enumeration: Optional[str] = None) -> np.array:
+        '''
+        Get the set action space of an environment and disabled line. If
+        the action space file is missing or stale, it is (re)generated first.
+
+        Parameters
+        ----------
+        action_space_path : str
+            The directory of the action space files.
+        disable_line : int, optional
+            The index of a line form the environment to be disabled. 
+            The default is -1, i.e no line.
+        env : Union[str, grid2op.Environment.Environment], optional
+            The environment or the name of the environment. If an environment
+            is given, its sub_info is checked against the metadata. The
+            default is rte_case14_realistic.
+        enumeration : Optional[str], optional
+            The enumeration, legacy or gamma. The default is None, i.e.
+            legacy for rte_case14_realistic and gamma otherwise (see
+            resolve_enumeration()).
+
+        Returns
+        -------
+        np.array
+            The memory-mapped set topology vectors of the actions, with shape
+            (N_ACTIONS, N_OBJECTS).
+        '''
+        env_name = get_env_name(env)
+        enumeration = resolve_enumeration(env_name, enumeration)
+        fpath = action_space_path + action_space_filename(disable_line, env_name, enumeration)
+        key = (os.path.abspath(fpath), env_name, disable_line, enumeration)
+        if key not in self._set_action_spaces:
+            sub_info = None if isinstance(env, str) else env.sub_info
+            if is_action_space_stale(fpath, env_name, disable_line, sub_info, enumeration):
+                generate_action_space(action_space_path, disable_line, env, enumeration)
+            set_actions = np.load(fpath, mmap_mode='r')
+            metadata = read_action_space_metadata(fpath)
+            assert set_actions.shape == (metadata['n_actions'], metadata['dim_topo']), \
+                'The action space should have the shape described by its metadata.'
+            self._set_action_spaces[key] = set_actions
+        return self._set_action_spaces[key]
+
+    def clear(self):
+        '''
+        Forget the memoised action spaces.
+        '''
+        self._set_action_spaces.clear()
+
+
+# The registry used by all consumers of the action space files in a process
+action_space_registry = ActionSpaceRegistry()
+
+
+def load_set_action_space(action_space_path: str,
+                          disable_line: int = -1,
+                          env: Union[str, grid2op.Environment.Environment] = DEFAULT_ENV_NAME,
+                          enumeration: Optional[str] = None) -> np.array:
+    '''
+    Load the array representations of the legal do-something 'set' busbar
+    actions, as saved by generate_action_space(), through the action space
+    registry. The file is memory-mapped. If the file is missing or stale, it
+    is (re)generated first.
+
+    Parameters
+    ----------
+    action_space_path : str
+        The directory of the action space files.
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. 
+        The default is -1, i.e no line.
+    env : Union[str, grid2op.Environment.Environment], optional
+        The environment or the name of the environment. Only made if the file
+        needs to be (re)generated. The default is rte_case14_realistic.
+    enumeration : Optional[str], optional
+        The enumeration, legacy or gamma. The default is None, i.e. legacy
+        for rte_case14_realistic, to which the action indices in the tutor
+        data refer, and gamma otherwise (see resolve_enumeration()).
+
+    Returns
+    -------
+    np.array
+        The set topology vectors of the actions, with shape
+        (N_ACTIONS, N_OBJECTS).
+    '''
+    return action_space_registry.get_set_action_space(action_space_path, disable_line, env, enumeration)
+
+
+def action_ranking_filename(disable_line: int = -1,
+                            env_name: str = DEFAULT_ENV_NAME,
+                            enumeration: Optional[str] = None) -> str:
+    '''
+    The name of the file with the ranking of the action space for a disabled
+    line.
+
+    Parameters
+    ----------
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. 
+        The default is -1, i.e no line.
+    env_name : str, optional
+        The name of the environment. The default is rte_case14_realistic,
+        whose files are not prefixed with the environment name.
+    enumeration : Optional[str], optional
+        The enumeration of the ranked action space, legacy or gamma. The
+        default is None, i.e. legacy for rte_case14_realistic and gamma
+        otherwise (see resolve_enumeration()). Files of the legacy
+        enumeration are not suffixed with the enumeration.
+
+    Returns
+    -------
+    str
+        The filename.
+    '''
+    enumeration = resolve_enumeration(env_name, enumeration)
+    prefix = '' if env_name == DEFAULT_ENV_NAME else f'{env_name}_'
+    suffix = '' if enumeration == LEGACY_ENUMERATION else f'_{enumeration}'
+    return prefix + ('action_ranking' if disable_line == -1 else
+                     f'action_ranking_lout:{disable_line}') + suffix + '.npz'
+
+
+def save_action_ranking(action_space_path: str,
+                        action_ids: np.array,
+                        n_best: np.array,
+                        n_near_best: np.array,
+                        n_evaluated: int,
+                        disable_line: int = -1,
+                        env_name: str = DEFAULT_ENV_NAME,
+                        enumeration: Optional[str] = None):
+    '''
+    Save a ranking of the action space, as produced by scoring the actions
+    offline, to a npz file. The version and checksum of the ranked action
+    space file are saved with the ranking, so that the ranking is not applied
+    to another action space.
+
+    Parameters
+    ----------
+    action_space_path : str
+        The directory of the action space files.
+    action_ids : np.array
+        The ids of the actions in the action space, ordered by decreasing
+        utility.
+    n_best : np.array
+        Per ranked action, the number of timesteps in which it was the best
+        action.
+    n_near_best : np.array
+        Per ranked action, the number of timesteps in which it was the best
+        or a near-best action.
+    n_evaluated : int
+        The number of timesteps in which the actions were evaluated.
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. 
+        The default is -1, i.e no line.
+    env_name : str, optional
+        The name of the environment. The default is rte_case14_realistic.
+    enumeration : Optional[str], optional
+        The enumeration of the ranked action space, legacy or gamma. The
+        default is None, i.e. legacy for rte_case14_realistic and gamma
+        otherwise (see resolve_enumeration()).
+    '''
+    assert len(action_ids) == len(n_best) == len(n_near_best), "Arrays should have equal length."
+    metadata = read_action_space_metadata(action_space_path +
+                                          action_space_filename(disable_line, env_name, enumeration))
+    assert metadata is not None, "The ranked action space should have been generated."
+    assert len(action_ids) == metadata['n_actions'], "The ranking should rank all actions of the action space."
+
+    fpath = action_space_path + action_ranking_filename(disable_line, env_name, enumeration)
+    with open(fpath + '.tmp', 'wb') as file:
+        np.savez(file, action_ids=action_ids, n_best=n_best, n_near_best=n_near_best,
+                 n_evaluated=n_evaluated, action_space_version=metadata['version'],
+                 action_space_checksum=metadata['checksum'])
+    os.replace(fpath + '.tmp', fpath)
+
+
+def load_action_ranking(action_space_path: str,
+                        disable_line: int = -1,
+                        top_k: Optional[int] = None,
+                        env_name: str = DEFAULT_ENV_NAME,
+                        enumeration: Optional[str] = None) -> np.array:
+    '''
+    Load the ids of the actions in the action space, ordered by decreasing
+    utility, as saved by save_action_ranking(). The action space should be
+    loaded first (see load_set_action_space()), so that its file is
+    up-to-date.
+
+    Parameters
+    ----------
+    action_space_path : str
+        The directory of the action space files.
+    disable_line : int, optional
+        The index of a line form the environment to be disabled. 
+        The default is -1, i.e no line.
+    top_k : Optional[int], optional
+        If given, only the ids of the top_k highest ranked actions are
+        returned. The default is None.
+    env_name : str, optional
+        The name of the environment. The default is rte_case14_realistic.
+    enumeration : Optional[str], optional
+        The enumeration of the ranked action space, legacy or gamma. The
+        default is None, i.e. legacy for rte_case14_realistic and gamma
+        otherwise (see resolve_enumeration()).
+
+    Raises
+    ------
+    FileNotFoundError
+        If the action space has not been ranked.
+    ValueError
+        If the ranking was made for another version of the action space
+        file, e.g. before it was regenerated.
+
+    Returns
+    -------
+    np.array
+        The action ids.
+    '''
+    assert top_k is None or top_k > 0, "Top_k should be positive."
+
+    fpath = action_space_path + action_ranking_filename(disable_line, env_name, enumeration)
+    if not os.path.exists(fpath):
+        raise FileNotFoundError(f'No action ranking at {fpath}; it can be created with score_actions.py.')
+    metadata = read_action_space_metadata(action_space_path +
+                                          action_space_filename(disable_line, env_name, enumeration))
+    with np.load(fpath) as ranking:
+        if (metadata is None or
+                'action_space_checksum' not in ranking or
+                ranking['action_space_version'] != metadata['version'] or
+                ranking['action_space_checksum'] != metadata['checksum']):
+            raise ValueError(f'The action ranking at {fpath} does not belong to the current action space; '
+                             'it can be recreated with score_actions.py.')
+        action_ids = ranking['action_ids']
+    return action_ids if top_k is None else action_ids[:top_k]
 
 
 if __name__ == '__main__':
@@ -511,7 +1108,12 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--disable_line",  help="The index of the line to be disabled.",
                         required=False,default=-1,type=int)
+    parser.add_argument("--env",  help="The name of the grid2op environment.",
+                        required=False,default=DEFAULT_ENV_NAME,type=str)
+    parser.add_argument("--enumeration",  help="The enumeration of the actions, legacy or gamma. " +
+                        "Defaults to legacy for rte_case14_realistic, and gamma otherwise.",
+                        required=False,default=None,choices=ENUMERATIONS,type=str)
     args = parser.parse_args()
 
     config = util.load_config()
-    generate_action_space(config['paths']['action_space'], args.disable_line)
\ No newline at end of file
+    generate_action_space(config['paths']['action_space'], args.disable_line, args.env, args.enumeration)
\ No newline at end of file
@@ -5,111 +5,172 @@ Created on Thu Jan 27 09:27:46 2022
 
 @author: matthijs
 """
+from __future__ import annotations
 import numpy as np
-from typing import Sequence, Tuple, List, Optional
-import grid2op
-from grid2op.dtypes import dt_int
+from typing import Sequence, Tuple, List, Optional, Dict, TYPE_CHECKING
 import math
+from collections import OrderedDict
 
+# grid2op is only imported where it is used, since importing it is slow and
+# the connectivity and feature functions do not need it
+if TYPE_CHECKING:
+    import grid2op
 
-def extract_gen_features(obs_dict: dict) -> np.array:
+# The integer type of grid2op (grid2op.dtypes.dt_int)
+dt_int = np.int32
+
+
+def obs_vect_slice_map(obs: grid2op.Observation.BaseObservation) -> Dict[str, slice]:
+    """
+    Compute, for each attribute in the vector representation of a grid2op
+    observation (as produced by obs.to_vect()), the slice of the vector that
+    contains that attribute. The slice map only depends on the observation
+    space, and can hence be computed once.
+
+    Parameters
+    ----------
+    obs : grid2op.Observation.BaseObservation
+        Any observation from the observation space.
+
+    Returns
+    -------
+    Dict[str, slice]
+        Dictionary from attribute names (e.g. 'prod_p', 'rho', 'topo_vect')
+        to the slices of the observation vector.
+    """
+    offsets = np.concatenate(([0], np.cumsum(obs.shapes())))
+    assert offsets[-1] == len(obs.to_vect()), "Attribute sizes do not add up to the vector length."
+    return {attr: slice(int(offsets[i]), int(offsets[i + 1]))
+            for i, attr in enumerate(obs.attr_list_vect)}
+
+
+def stack_obs_attributes(obs_vects: np.array,
+                         slice_map: Dict[str, slice],
+                         attrs: Sequence[str]) -> np.array:
+    """
+    Given a matrix of grid2op observation vectors, extract a number of
+    attributes, which each have one value per object, and stack them as
+    features.
+
+    Parameters
+    ----------
+    obs_vects : np.array
+        Matrix of observation vectors, of shape (N, obs_vect_size).
+    slice_map : Dict[str, slice]
+        Slice map of the observation vector. Can be obtained with
+        obs_vect_slice_map().
+    attrs : Sequence[str]
+        The names of the attributes.
+
+    Returns
+    -------
+    np.array
+        Array of shape (N, N_objects, len(attrs)).
     """
-    Given the grid2op observation in dictionary form,
-    return the generator features.
+    return np.stack([obs_vects[:, slice_map[a]] for a in attrs], axis=-1)
+
+
+def extract_gen_features(obs_vects: np.array, slice_map: Dict[str, slice]) -> np.array:
+    """
+    Given a matrix of grid2op observation vectors, return the generator
+    features.
 
     Parameters
     ----------
-    obs_dict : dict
-        Dictionary representation of the grid2op observation. Can be obtained
-        with obs.to_dict().
+    obs_vects : np.array
+        Matrix of observation vectors, of shape (N, obs_vect_size).
+    slice_map : Dict[str, slice]
+        Slice map of the observation vector. Can be obtained with
+        obs_vect_slice_map().
 
     Returns
     -------
     X : np.array
-        Array representation of the features; rows correspond to the different
-        objects. Columns represent the 'p', 'q', 'v' features.
+        Array representation of the features, of shape (N, N_gen, 3).
+        The last dimension represents the 'p', 'q', 'v' features.
     """
-    X = np.array(list(obs_dict['gens'].values())).T
+    X = stack_obs_attributes(obs_vects, slice_map, ('prod_p', 'prod_q', 'prod_v'))
     return X
 
 
-def extract_load_features(obs_dict: dict) -> np.array:
+def extract_load_features(obs_vects: np.array, slice_map: Dict[str, slice]) -> np.array:
     """
-    Given the grid2op observation in dictionary form,
-    return the generator features.
+    Given a matrix of grid2op observation vectors, return the load
+    features.
 
     Parameters
     ----------
-    obs_dict : dict
-        Dictionary representation of the grid2op observation. Can be obtained
-        with obs.to_dict().
+    obs_vects : np.array
+        Matrix of observation vectors, of shape (N, obs_vect_size).
+    slice_map : Dict[str, slice]
+        Slice map of the observation vector. Can be obtained with
+        obs_vect_slice_map().
 
     Returns
     -------
     X : np.array
-        Array representation of the features; rows correspond to the different
-        objects. Columns represent the 'p', 'q', 'v' features.
+        Array representation of the features, of shape (N, N_load, 3).
+        The last dimension represents the 'p', 'q', 'v' features.
     """
-    X = np.array(list(obs_dict['loads'].values())).T
+    X = stack_obs_attributes(obs_vects, slice_map, ('load_p', 'load_q', 'load_v'))
     return X
 
 
-def extract_or_features(obs_dict: dict, thermal_limits: Sequence[int]) \
-                        -> np.array:
+def extract_or_features(obs_vects: np.array, slice_map: Dict[str, slice],
+                        thermal_limits: Sequence[int]) -> np.array:
     """
-    Given the grid2op observation in dictionary form,
-    return the load features.
+    Given a matrix of grid2op observation vectors, return the line origin
+    features.
 
     Parameters
     ----------
-    obs_dict : dict
-        Dictionary representation of the grid2op observation. Can be obtained
-        with obs.to_dict().
+    obs_vects : np.array
+        Matrix of observation vectors, of shape (N, obs_vect_size).
+    slice_map : Dict[str, slice]
+        Slice map of the observation vector. Can be obtained with
+        obs_vect_slice_map().
     thermal_limits : Sequence[int]
         Sequence with the thermal limits of the lines.
 
     Returns
     -------
     X : np.array
-        Array representation of the features;  rows correspond to the different
-        objects. Columns represent the 'p', 'q', 'v', 'a', 'line_rho',
+        Array representation of the features, of shape (N, N_line, 6).
+        The last dimension represents the 'p', 'q', 'v', 'a', 'line_rho',
         'line_capacity' features.
     """
-    X = np.array(list(obs_dict['lines_or'].values())).T
-    with np.errstate(divide='ignore', invalid='ignore'):
-        X = np.concatenate((X,
-                            np.reshape(np.array(obs_dict['rho']), (-1, 1)),
-                            np.reshape(np.array(thermal_limits), (-1, 1))),
-                           axis=1)
+    X = stack_obs_attributes(obs_vects, slice_map, ('p_or', 'q_or', 'v_or', 'a_or', 'rho'))
+    capacities = np.broadcast_to(np.asarray(thermal_limits, dtype=X.dtype), X.shape[:-1])
+    X = np.concatenate((X, capacities[..., np.newaxis]), axis=-1)
     return X
 
 
-def extract_ex_features(obs_dict: dict, thermal_limits: Sequence[int]) \
-                        -> np.array:
+def extract_ex_features(obs_vects: np.array, slice_map: Dict[str, slice],
+                        thermal_limits: Sequence[int]) -> np.array:
     """
-    Given the grid2op observation in dictionary form,
-    return the generator features.
+    Given a matrix of grid2op observation vectors, return the line extremity
+    features.
 
     Parameters
     ----------
-    obs_dict : dict
-        Dictionary representation of the grid2op observation. Can be obtained
-        with obs.to_dict().
+    obs_vects : np.array
+        Matrix of observation vectors, of shape (N, obs_vect_size).
+    slice_map : Dict[str, slice]
+        Slice map of the observation vector. Can be obtained with
+        obs_vect_slice_map().
     thermal_limits : Sequence[int]
         Sequence with the thermal limits of the lines.
+
     Returns
     -------
     X : np.array
-        Array representation of the features; rows correspond to the different
-        objects. Columns represent the 'p', 'q', 'v', 'a', 'line_rho',
+        Array representation of the features, of shape (N, N_line, 6).
+        The last dimension represents the 'p', 'q', 'v', 'a', 'line_rho',
         'line_capacity' features.
     """
-    X = np.array(list(obs_dict['lines_ex'].values())).T
-    with np.errstate(divide='ignore', invalid='ignore'):
-        X = np.concatenate((X,
-                            np.reshape(np.array(obs_dict['rho']), (-1, 1)),
-                            np.reshape(np.array(thermal_limits), (-1, 1))),
-                           axis=1)
+    X = stack_obs_attributes(obs_vects, slice_map, ('p_ex', 'q_ex', 'v_ex', 'a_ex', 'rho'))
+    capacities = np.broadcast_to(np.asarray(thermal_limits, dtype=X.dtype), X.shape[:-1])
+    X = np.concatenate((X, capacities[..., np.newaxis]), axis=-1)
     return X
 
 
@@ -147,78 +208,157 @@ def connectivity_matrices(sub_info: Sequence[int],
     connectivity_matrix_line = np.array
         The sparse connectivity matrix between objects connected by lines.
     """
+    provider = ConnectivityProvider(sub_info, line_or_pos_topo_vect, line_ex_pos_topo_vect, capacity=0)
+    return provider.compute(topo_vect)
 
-    beg_ = 0
-    end_ = 0
-    row_ind_samebus = []
-    col_ind_samebus = []
-    row_ind_otherbus = []
-    col_ind_otherbus = []
-    row_ind_line = []
-    col_ind_line = []         
-    
-    for sub_id, nb_obj in enumerate(sub_info):
-        # it must be a vanilla python integer, otherwise it's not handled by 
-        # some backend
-        # especially if written in c++
-        nb_obj = int(nb_obj)
-        end_ += nb_obj
-        # tmp = np.zeros(shape=(nb_obj, nb_obj), dtype=dt_float)
-        for obj1 in range(nb_obj):
-            my_bus = topo_vect[beg_+obj1]
-            if my_bus == -1:
-                # object is disconnected, nothing is done
-                continue
-            # connect an object to itself
-#                 row_ind.append(beg_ + obj1)
-#                 col_ind.append(beg_ + obj1)
-#                 WHY??
-
-            # connect the other objects to it
-            for obj2 in range(obj1+1, nb_obj):
-                my_bus2 = topo_vect[beg_+obj2]
-                if my_bus2 == -1:
-                    # object is disconnected, nothing is done
-                    continue
-                if my_bus == my_bus2:
-                    # objects are on the same bus
-                    # tmp[obj1, obj2] = 1
-                    # tmp[obj2, obj1] = 1
-                    row_ind_samebus.append(beg_ + obj2)
-                    col_ind_samebus.append(beg_ + obj1)
-                    row_ind_samebus.append(beg_ + obj1)
-                    col_ind_samebus.append(beg_ + obj2)
-                else:
-                    # objects are on different bus 
-                    row_ind_otherbus.append(beg_ + obj2)
-                    col_ind_otherbus.append(beg_ + obj1)
-                    row_ind_otherbus.append(beg_ + obj1)
-                    col_ind_otherbus.append(beg_ + obj2)                      
-        beg_ += nb_obj
-
-    # both ends of a line are connected together (if line is connected)
-    for q_id in range(len(line_or_pos_topo_vect)):
-        if topo_vect[line_or_pos_topo_vect][q_id] != -1:
-            # if powerline is connected, connect both its side
-            row_ind_line.append(line_or_pos_topo_vect[q_id])
-            col_ind_line.append(line_ex_pos_topo_vect[q_id])
-            row_ind_line.append(line_ex_pos_topo_vect[q_id])
-            col_ind_line.append(line_or_pos_topo_vect[q_id])
-         
-    row_ind_samebus = np.array(row_ind_samebus).astype(dt_int)
-    col_ind_samebus = np.array(col_ind_samebus).astype(dt_int)
-    row_ind_otherbus = np.array(row_ind_otherbus).astype(dt_int)
-    col_ind_otherbus = np.array(col_ind_otherbus).astype(dt_int)
-    row_ind_line = np.array(row_ind_line).astype(dt_int)
-    col_ind_line = np.array(col_ind_line).astype(dt_int)
-           
-    connectivity_matrix_samebus = np.stack((row_ind_samebus, col_ind_samebus))
-    connectivity_matrix_otherbus = np.stack((row_ind_otherbus, col_ind_otherbus))
-    connectivity_matrix_line = np.stack((row_ind_line, col_ind_line))
-
-    return connectivity_matrix_samebus, \
-        connectivity_matrix_otherbus, \
-        connectivity_matrix_line
+
+class ConnectivityProvider:
+    """
+    Computes the connectivity matrices (see connectivity_matrices()) of
+    arbitrary topologies of a grid layout. The pairs of objects that could be
+    connected are precomputed once, so that the matrices of a topology are
+    computed with a few vectorized operations.
+
+    The matrices of recently requested topologies are memoized in an LRU
+    cache with a bounded capacity. The number of cache hits and misses are
+    tracked.
+    """
+
+    def __init__(self,
+                 sub_info: Sequence[int],
+                 line_or_pos_topo_vect: Sequence[int],
+                 line_ex_pos_topo_vect: Sequence[int],
+                 capacity: int = 10000):
+        """
+        Parameters
+        ----------
+        sub_info : Sequence[int]
+            The number of objects per substation.
+        line_or_pos_topo_vect : Sequence[int]
+            The indices in the topo vector of the line origins.
+        line_ex_pos_topo_vect : Sequence[int]
+            The indices in the topo vector of the line extremities.
+        capacity : int, optional
+            The maximum number of topologies of which the matrices are
+            memoized. The default is 10000.
+        """
+        assert capacity >= 0, "The capacity cannot be negative."
+        assert len(line_or_pos_topo_vect) == len(line_ex_pos_topo_vect), \
+            "The number of line origins and extremities should be equal."
+
+        self.n_objects = int(np.sum(sub_info))
+        self.line_or_pos_topo_vect = np.asarray(line_or_pos_topo_vect, dtype=np.int64)
+        self.line_ex_pos_topo_vect = np.asarray(line_ex_pos_topo_vect, dtype=np.int64)
+        self.capacity = capacity
+
+        # The pairs (obj1, obj2), obj1 < obj2, of objects at the same
+        # substation, in the order of substation, obj1, and obj2
+        sub_starts = np.concatenate(([0], np.cumsum(sub_info)[:-1])).astype(np.int64)
+        pairs = [np.triu_indices(int(nb_obj), k=1) for nb_obj in sub_info]
+        self.pair_obj1 = np.concatenate([beg + p[0] for beg, p in zip(sub_starts, pairs)]).astype(np.int64)
+        self.pair_obj2 = np.concatenate([beg + p[1] for beg, p in zip(sub_starts, pairs)]).astype(np.int64)
+
+        self._cache = OrderedDict()
+        self.hits, self.misses = 0, 0
+
+    @classmethod
+    def from_env(cls, env: grid2op.Environment.Environment, capacity: int = 10000) -> 'ConnectivityProvider':
+        """
+        Factory class: initialize a ConnectivityProvider for the layout of an
+        environment, e.g. for making predictions on its observations.
+
+        Parameters
+        ----------
+        env : grid2op.Environment.Environment
+            The environment.
+        capacity : int, optional
+            The maximum number of topologies of which the matrices are
+            memoized. The default is 10000.
+
+        Returns
+        -------
+        ConnectivityProvider
+            The connectivity provider.
+        """
+        return cls(env.sub_info, env.line_or_pos_topo_vect, env.line_ex_pos_topo_vect, capacity)
+
+    @staticmethod
+    def _bidirectional(obj1: np.array, obj2: np.array) -> np.array:
+        # Create the edges (obj2, obj1), (obj1, obj2) for each pair
+        return np.stack((np.stack((obj2, obj1), axis=1).reshape(-1),
+                         np.stack((obj1, obj2), axis=1).reshape(-1))).astype(dt_int)
+
+    def compute(self, topo_vect: Sequence[int]) -> Tuple[np.array, np.array, np.array]:
+        """
+        Compute the connectivity matrices of a topology, without using the
+        cache.
+
+        Parameters
+        ----------
+        topo_vect : Sequence[int]
+            The bus to which each object is connected.
+
+        Returns
+        -------
+        Tuple[np.array, np.array, np.array]
+            The sparse connectivity matrices between objects connected to the
+            same bus, to the other bus, and by lines.
+        """
+        topo_vect = np.asarray(topo_vect)
+        assert len(topo_vect) == self.n_objects, "The topology vector does not match the layout."
+
+        bus1, bus2 = topo_vect[self.pair_obj1], topo_vect[self.pair_obj2]
+        connected = (bus1 != -1) & (bus2 != -1)
+        samebus = connected & (bus1 == bus2)
+        otherbus = connected & (bus1 != bus2)
+
+        # Both ends of a line are connected together, if the line is connected
+        line_connected = topo_vect[self.line_or_pos_topo_vect] != -1
+        line_or = self.line_or_pos_topo_vect[line_connected]
+        line_ex = self.line_ex_pos_topo_vect[line_connected]
+
+        return self._bidirectional(self.pair_obj1[samebus], self.pair_obj2[samebus]), \
+            self._bidirectional(self.pair_obj1[otherbus], self.pair_obj2[otherbus]), \
+            self._bidirectional(line_ex, line_or)
+
+    def get(self, topo_vect: Sequence[int]) -> Tuple[np.array, np.array, np.array]:
+        """
+        Get the connectivity matrices of a topology, from the cache if
+        possible.
+
+        Parameters
+        ----------
+        topo_vect : Sequence[int]
+            The bus to which each object is connected.
+
+        Returns
+        -------
+        Tuple[np.array, np.array, np.array]
+            The sparse connectivity matrices between objects connected to the
+            same bus, to the other bus, and by lines.
+        """
+        key = np.asarray(topo_vect, dtype=np.int8).tobytes()
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        self.misses += 1
+        matrices = self.compute(topo_vect)
+        if self.capacity > 0:
+            self._cache[key] = matrices
+            if len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return matrices
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of requests served from the cache. Zero if there were no
+        requests.
+        """
+        n_requests = self.hits + self.misses
+        return self.hits / n_requests if n_requests else 0.0
 
 
 def tv_groupby_subst(tv: Sequence, sub_info: Sequence[int]) -> \
@@ -266,6 +406,8 @@ def init_env(config: dict,
     env : TYPE
         The Grid2Op environment.
     """
+    import grid2op
+
     data_path = config['paths']['rte_case14_realistic']
     scenario_path = config['paths']['rte_case14_realistic_chronics']
 
@@ -336,6 +478,8 @@ def skip_to_next_day(env: grid2op.Environment.Environment,
     fast_forward_divergingpowerflow_exception : bool
         Whether a DivergingPowerFlowException occurred while fast-forwarding.
     """
+    import grid2op
+
     # Reset environment
     env.set_id(chronic_id)
     env.reset()
@@ -9,10 +9,11 @@ import numpy as np
 
 import yaml
 import os
-from typing import List, Sequence, Callable
+from typing import List, Sequence, Callable, Iterable, Iterator
 import json
+import hashlib
 
-import training.models
+from training.network_type import NetworkType
 
 
 def load_config():
@@ -35,7 +36,7 @@ def load_config():
             config = yaml.safe_load(stream)
         except yaml.YAMLError as exc:
             raise exc
-    config['training']['GCN']['hyperparams']['network_type'] = training.models.GCN.NetworkType(
+    config['training']['GCN']['hyperparams']['network_type'] = NetworkType(
         config['training']['GCN']['hyperparams']['network_type']
     )
 
@@ -45,6 +46,8 @@ def load_config():
                    (config['rte_case14_realistic']['n_subs'], 'n_subs'),
                    (config['training']['settings']['train_log_freq'], 'train_log_freq'),
                    (config['training']['settings']['val_log_freq'], 'val_log_freq'),
+                   (config['training']['settings']['connectivity_cache_capacity'], 'connectivity_cache_capacity'),
+                   (config['training']['settings']['change_action_cache_capacity'], 'change_action_cache_capacity'),
                    (config['training']['hyperparams']['n_epoch'], 'n_epoch'),
                    (config['training']['hyperparams']['lr'], 'lr'),
                    (config['training']['hyperparams']['N_node_hidden'], 'N_node_hidden'),
@@ -56,7 +59,6 @@ def load_config():
                    (config['training']['hyperparams']['non_sub_label_weight'], 'non_sub_label_weight'),
                    (config['training']['hyperparams']['early_stopping_patience'], 'early_stopping_patience'),
                    (config['training']['hyperparams']['action_frequency_threshold'], 'action_frequency_threshold'),
-                   (config['training']['constants']['estimated_train_size'], 'estimated_train_size'),
                    (config['training']['GCN']['hyperparams']['N_GCN_layers'], 'N_GCN_layers'),
                    (config['training']['GCN']['constants']['N_f_gen'], 'N_f_gen'),
                    (config['training']['GCN']['constants']['N_f_load'], 'N_f_load'),
@@ -74,6 +76,23 @@ def load_config():
            " the number of lines."
     assert 0 <= config['dataset']['train_perc'] <= 1, "Train. perc. should be in percentage range."
     assert 0 <= config['dataset']['val_perc'] <= 1, "Val. perc. should be in percentage range."
+    assert config['dataset']['train_perc'] + config['dataset']['val_perc'] <= 1, \
+           "Train. and val. perc. together should be in percentage range."
+    assert config['training']['hyperparams']['sampling_temperature'] is None or \
+           config['training']['hyperparams']['sampling_temperature'] >= 0, \
+           "Sampling temperature should be None or non-negative."
+    assert config['training']['settings']['val_batch_size'] > 0, "Val. batch size should be positive."
+    assert config['training']['settings']['val_subsample_fraction'] is None or \
+           0 < config['training']['settings']['val_subsample_fraction'] <= 1, \
+           "Val. subsample fraction should be None or in range (0,1]."
+    assert config['training']['settings']['full_val_freq'] > 0, "Full val. frequency should be positive."
+    assert config['training']['settings']['full_val_margin'] >= 0, "Full val. margin cannot be negative."
+    assert config['training']['settings']['logging_queue_size'] > 0, "Logging queue size should be positive."
+    assert config['training']['settings']['watch_log'] in [None, 'gradients', 'parameters', 'all'], \
+           "Watch_log should be value gradients, parameters, all, or null."
+    for top_k, n in [(config['tutor_generated_data']['action_space_top_k'], 'action_space_top_k'),
+                     (config['training']['settings']['val_action_space_top_k'], 'val_action_space_top_k')]:
+        assert top_k is None or top_k > 0, f'Parameter {n} should be None or positive.'
     assert config['training']['hyperparams']['model_type'] in ['GCN', 'FCNN'], \
            "Model_type should be value GCN or FCNN."
     assert config['training']['GCN']['hyperparams']['aggr'] in ['add', 'mean'], \
@@ -106,21 +125,79 @@ def flatten(t: Sequence[Sequence]) -> List:
     return [item for sublist in t for item in sublist]
 
 
-def hash_nparray(arr: np.array) -> int:
+def batched(it: Iterable, n: int) -> Iterator[List]:
     """
-    Hashes a numpy array.
+    Split an iterable into lists of n consecutive elements. The last list
+    can be shorter.
+
+    Parameters
+    ----------
+    it : Iterable
+        The iterable.
+    n : int
+        The number of elements per list.
+
+    Returns
+    -------
+    Iterator[List]
+        The lists.
+    """
+    assert n > 0, "N should be positive."
+    batch = []
+    for item in it:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def hash_file(fpath: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Hashes the contents of a file.
+
+    Parameters
+    ----------
+    fpath : str
+        The path of the file.
+    chunk_size : int, optional
+        The number of bytes read at once. The default is 1 MiB.
+
+    Returns
+    -------
+    str
+        The hexadecimal blake2b digest of the file contents.
+    """
+    h = hashlib.blake2b()
+    with open(fpath, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_layout_array(arr: np.array, line_disabled: int) -> int:
+    """
+    Hashes an array the shape of the topology vector, together with the line
+    disabled. Since the line disabled determines the layout of the topology
+    vector, equal arrays of different layouts receive different hashes. The
+    hash is stable across processes and runs.
 
     Parameters
     ----------
     arr : np.array
-        The array.
+        The array. Should have elements that fit in a signed 8-bit integer.
+    line_disabled : int
+        The line index disabled. -1 if no line is disabled.
 
     Returns
     -------
     int
-        The hash value.
+        The hash value, a signed 64-bit integer.
     """
-    return hash(arr.data.tobytes())
+    h = hashlib.blake2b(np.int64(line_disabled).tobytes(), digest_size=8)
+    h.update(np.ascontiguousarray(arr, dtype=np.int8).tobytes())
+    return int.from_bytes(h.digest(), 'little', signed=True)
 
 
 class NumpyEncoder(json.JSONEncoder):
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the cold-start import time of the entry points of the package, and
+report which of the heavy dependencies each of them imports.
+
+Each module is imported in a fresh interpreter, so that the measured time
+includes importing all its dependencies. To compare before/after a change,
+check out the other revision in a separate worktree and pass its root:
+
+    git worktree add /tmp/before <revision>
+    python benchmark_imports.py --root /tmp/before
+    python benchmark_imports.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# The modules imported by the entry points, or used directly for inference
+# and preprocessing
+MODULES = ['auxiliary.util',
+           'auxiliary.generate_action_space',
+           'data_preprocessing_analysis.imitation_data_preprocessing',
+           'training.postprocessing',
+           'training.dataloader',
+           'training.training',
+           'preprocess_data',
+           'generate_imitation_data',
+           'train_network']
+
+# The dependencies that are slow to import
+HEAVY_MODULES = ['grid2op', 'torch', 'torch_geometric', 'wandb', 'sklearn', 'matplotlib']
+
+IMPORT_SNIPPET = '''
+import importlib, json, sys, time
+tick = time.perf_counter()
+importlib.import_module({module!r})
+seconds = time.perf_counter() - tick
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def time_import(module: str, root: str) -> dict:
+    """
+    Import a module in a fresh interpreter, and measure the time it takes.
+
+    Parameters
+    ----------
+    module : str
+        The name of the module.
+    root : str
+        The root of the package, used as working directory.
+
+    Returns
+    -------
+    dict
+        With the import time in seconds under 'seconds' and the heavy
+        dependencies imported under 'heavy'. If the import failed, the last
+        line of the error under 'error' instead.
+    """
+    result = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET.format(module=module, heavy=HEAVY_MODULES)],
+                            cwd=root, capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=root))
+    if result.returncode != 0:
+        return {'error': (result.stderr.strip().splitlines() or ['unknown error'])[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cold-start import time of the entry points.')
+    parser.add_argument("--root", help="The root of the package to benchmark. Defaults to this package.",
+                        required=False, default=os.path.dirname(os.path.abspath(__file__)), type=str)
+    parser.add_argument("-n", "--n_runs", help="The number of runs per module, of which the median is reported.",
+                        required=False, default=5, type=int)
+    args = parser.parse_args()
+
+    print(f'{"module":<58} {"seconds":>8}  heavy dependencies')
+    for module in MODULES:
+        runs = [time_import(module, args.root) for _ in range(args.n_runs)]
+        if 'error' in runs[0]:
+            print(f'{module:<58} {"failed":>8}  {runs[0]["error"]}')
+            continue
+        seconds = statistics.median(r['seconds'] for r in runs)
+        print(f'{module:<58} {seconds:>8.3f}  {", ".join(runs[0]["heavy"]) or "-"}')
+
+
+if __name__ == "__main__":
+    main()
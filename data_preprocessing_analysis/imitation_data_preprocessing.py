@@ -5,11 +5,11 @@ Created on Thu Oct 28 16:30:55 2021
 
 @author: matthijs
 """
+from __future__ import annotations
 import shutil
 
-import grid2op
 import numpy as np
-from typing import List, Tuple, Callable, Sequence
+from typing import List, Tuple, Sequence, Iterable, Dict, Optional, TYPE_CHECKING
 from pathlib import Path, PosixPath
 import re
 import json
@@ -17,11 +17,16 @@ import auxiliary.grid2op_util as g2o_util
 import auxiliary.util as util
 from auxiliary.util import NumpyEncoder
 from tqdm import tqdm
-from auxiliary.generate_action_space import action_identificator
+from auxiliary.generate_action_space import action_identificator, load_set_action_space
 from collections import Counter
 import os
-from random import shuffle
-import shutil
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+
+# grid2op is only imported when the raw data is processed, so that the data
+# loaders can use this module without importing it
+if TYPE_CHECKING:
+    import grid2op
 
 
 def get_filepaths(tutor_data_path: str) -> List[Path]:
@@ -69,22 +74,65 @@ def extract_data_from_filepath(relat_fp: PosixPath) \
            int(dayscomp)
 
 
-def extract_data_from_single_ts(ts_vect: np.array, grid2op_vect_len: int,
-                                vect2obs_func: Callable, line_disabled: int,
-                                env_info_dict: dict, thermal_limits: Sequence[int]) -> dict:
+SPLITS = ['train', 'val', 'test']
+
+
+def assign_splits(chronic_ids: Iterable[int], train_perc: float, val_perc: float, seed: int) -> Dict[int, str]:
     """
-    Given the vector of a datapoint representing a single timestep, extract
-    the interesting data from this vector and return it as a dictionary.
+    Assign chronics to the train, val, and test splits. The chronics are
+    ranked by a hash of the seed and their id, and the ranking is cut so that
+    the splits get the given fractions of the chronics, up to rounding. Hence,
+    the assignment is pseudo-random and reproducible, and independent of the
+    order of the chronics. All files of a chronic, e.g. with different lines
+    disabled, end up in the same split.
 
     Parameters
     ----------
-    ts_vect : np.array
-        The vector.
-    grid2op_vect_len : int
-        The length of the vector that represents a grid2op observation.
-    vect2obs_func : Callable
-        Function for transferring a vector representation of a grid2op
-        observation to the corresponding grid2op observation object.
+    chronic_ids : Iterable[int]
+        The ids of the chronics. Duplicates are ignored.
+    train_perc : float
+        The fraction of chronics assigned to the train split.
+    val_perc : float
+        The fraction of chronics assigned to the val split. The remainder is
+        assigned to the test split.
+    seed : int
+        The seed of the assignment.
+
+    Returns
+    -------
+    Dict[int, str]
+        Dictionary from the id of each chronic to its split: 'train', 'val',
+        or 'test'.
+    """
+    def rank_key(chronic_id: int) -> Tuple[bytes, int]:
+        return hashlib.blake2b(f'{seed}:{chronic_id}'.encode(), digest_size=8).digest(), chronic_id
+
+    ranked_ids = sorted(set(chronic_ids), key=rank_key)
+    n_train = round(train_perc * len(ranked_ids))
+    n_train_val = round((train_perc + val_perc) * len(ranked_ids))
+    assert n_train > 0, "The train split should contain at least one chronic."
+    assert n_train_val > n_train, "The val split should contain at least one chronic."
+
+    return {chronic_id: 'train' if rank < n_train else 'val' if rank < n_train_val else 'test'
+            for rank, chronic_id in enumerate(ranked_ids)}
+
+
+def extract_data_from_records(records: np.array, slice_map: Dict[str, slice],
+                              line_disabled: int, env_info_dict: dict,
+                              thermal_limits: Sequence[int]) -> dict:
+    """
+    Given a matrix of raw datapoints, each representing a single timestep,
+    extract the interesting data from these vectors and return it as a
+    dictionary of arrays. The first dimension of each array indexes the
+    datapoints.
+
+    Parameters
+    ----------
+    records : np.array
+        The matrix of raw datapoints, of shape (N, 5 + obs_vect_size).
+    slice_map : Dict[str, slice]
+        Slice map of the grid2op observation vector, which constitutes the
+        final columns of the raw datapoints.
     line_disabled : int
         The line index to be disabled. -1 if no line is disabled.
     env_info_dict: dict
@@ -98,34 +146,33 @@ def extract_data_from_single_ts(ts_vect: np.array, grid2op_vect_len: int,
     dict
         The dictionary containing the relevant data.
     """
-    grid2op_obs_vect = ts_vect[-grid2op_vect_len:]
-    obs = vect2obs_func(grid2op_obs_vect)
-    obs_dict = obs.to_dict()
-
-    data = {'action_index': int(ts_vect[0]),
-            'timestep': int(ts_vect[4]),
-            'gen_features': g2o_util.extract_gen_features(obs_dict),
-            'load_features': g2o_util.extract_load_features(obs_dict),
-            'or_features': g2o_util.extract_or_features(obs_dict,
+    obs_vect_size = max(sl.stop for sl in slice_map.values())
+    obs_vects = records[:, -obs_vect_size:]
+
+    data = {'action_index': records[:, 0].astype(int),
+            'timestep': records[:, 4].astype(int),
+            'gen_features': g2o_util.extract_gen_features(obs_vects, slice_map),
+            'load_features': g2o_util.extract_load_features(obs_vects, slice_map),
+            'or_features': g2o_util.extract_or_features(obs_vects, slice_map,
                                                         thermal_limits),
-            'ex_features': g2o_util.extract_ex_features(obs_dict,
+            'ex_features': g2o_util.extract_ex_features(obs_vects, slice_map,
                                                         thermal_limits),
-            'topo_vect': obs_dict['topo_vect'].copy()
+            'topo_vect': obs_vects[:, slice_map['topo_vect']].astype(int)
             }
 
     # Remove the disabled line from the data, if necessary
     if line_disabled != -1:
-        data['or_features'] = np.delete(data['or_features'], line_disabled, axis=0)
-        data['ex_features'] = np.delete(data['ex_features'], line_disabled, axis=0)
+        data['or_features'] = np.delete(data['or_features'], line_disabled, axis=1)
+        data['ex_features'] = np.delete(data['ex_features'], line_disabled, axis=1)
         data['topo_vect'] = np.delete(data['topo_vect'], [
             env_info_dict['dis_line_or_tv'],
-            env_info_dict['dis_line_ex_tv']])
+            env_info_dict['dis_line_ex_tv']], axis=1)
 
     # Assert the topo_vect has the same length as the features
-    assert len(data['topo_vect']) == len(data['gen_features']) + \
-                                     len(data['load_features']) + \
-                                     len(data['or_features']) + \
-                                     len(data['ex_features'])
+    assert data['topo_vect'].shape[1] == data['gen_features'].shape[1] + \
+                                         data['load_features'].shape[1] + \
+                                         data['or_features'].shape[1] + \
+                                         data['ex_features'].shape[1]
     return data
 
 
@@ -156,9 +203,10 @@ def env_info_line_disabled(env: grid2op.Environment.Environment,
                                  object
             'line_ex_pos_topo_vect': indices in the topo vect for each extremity
                                  object
-        POSSIBLY:
-            'dis_line_or_tv': index in the topo vect of the disabled line origin
-            'dis_line_ex_tv': index in the topo vect of the disabled line extremity
+            'dis_line_or_tv': index in the topo vect of the disabled line origin,
+                              -1 if no line is disabled
+            'dis_line_ex_tv': index in the topo vect of the disabled line extremity,
+                              -1 if no line is disabled
     """
     sub_info = env.sub_info.copy()
     gen_pos_topo_vect = env.gen_pos_topo_vect.copy()
@@ -205,235 +253,446 @@ def env_info_line_disabled(env: grid2op.Environment.Environment,
     if line_disabled != -1:
         info_dict['dis_line_or_tv'] = dis_line_or_tv
         info_dict['dis_line_ex_tv'] = dis_line_ex_tv
+    else:
+        info_dict['dis_line_or_tv'] = info_dict['dis_line_ex_tv'] = -1
 
     return info_dict
 
 
-class ConMatrixCache:
+def assert_elements_in(arr: np.array, allowed: Sequence[int], name: str,
+                       row_ids: Sequence[int] = None):
     """
-    Connectivity matrices are expensive to compute and store and many
-    datapoints might share the same connectivity matrix. For this reason, we
-    only compute/store each con. matrix once, and instead provide data points
-    with a hash pointing to the correct con. matrix.
+    Assert that all elements of a matrix are among the allowed values. If
+    not, the assertion message reports the offending rows.
+
+    Parameters
+    ----------
+    arr : np.array
+        The matrix. Rows represent datapoints.
+    allowed : Sequence[int]
+        The allowed values.
+    name : str
+        The name of the matrix, used in the assertion message.
+    row_ids : Sequence[int], optional
+        The ids of the rows reported in the assertion message. The default
+        is the row indices.
+    """
+    bad_rows = np.flatnonzero(~np.isin(arr, allowed).all(axis=1))
+    if row_ids is not None:
+        bad_rows = np.asarray(row_ids)[bad_rows]
+    assert len(bad_rows) == 0, f"Incorrect element in {name} at rows {bad_rows.tolist()}"
+
+
+# The per-datapoint columns of a processed data file and their data types
+DATAPOINT_COLUMNS = {'action_index': np.int32,
+                     'timestep': np.int32,
+                     'gen_features': np.float32,
+                     'load_features': np.float32,
+                     'or_features': np.float32,
+                     'ex_features': np.float32,
+                     'topo_vect': np.int8,
+                     'set_topo_vect': np.int8,
+                     'change_topo_vect': np.int8,
+                     'res_topo_vect': np.int8,
+                     'act_hash': np.int64}
+
+# The fields of a processed data file that are shared by all its datapoints
+STATIC_FIELDS = ['line_disabled', 'chronic_id', 'dayscomp', 'sub_info',
+                 'gen_pos_topo_vect', 'load_pos_topo_vect',
+                 'line_or_pos_topo_vect', 'line_ex_pos_topo_vect',
+                 'dis_line_or_tv', 'dis_line_ex_tv']
+
+
+def save_data_to_file(data: dict, static_data: dict, output_data_path: str) -> Optional[str]:
     """
+    Given a dictionary of columns, representing various data points, and
+    the static data shared by these datapoints, save these to a .npz file.
+    Each column is stored as a single array, with its first dimension
+    indexing the datapoints. If there are no datapoints, save nothing.
 
-    def __init__(self):
-        self.con_matrices = {}
+    Parameters
+    ----------
+    data : dict
+        Various data points. Should contain the columns in DATAPOINT_COLUMNS.
+    static_data : dict
+        The data shared by the datapoints. Should contain the fields in
+        STATIC_FIELDS.
+    output_data_path : str
+        The output directory where to save the file.
+
+    Returns
+    -------
+    Optional[str]
+        The name of the saved file. None if nothing was saved.
+    """
+    if len(data['action_index']) == 0:
+        return None
+
+    filename = f'data_lout{static_data["line_disabled"]}_' + \
+               f'chr{static_data["chronic_id"]}.npz'
+    columns = {k: np.asarray(data[k], dtype=dtype) for k, dtype in DATAPOINT_COLUMNS.items()}
+    static = {k: np.asarray(static_data[k]) for k in STATIC_FIELDS}
+    np.savez(output_data_path + filename, **columns, **static)
+    return filename
 
-    def get_key_add_to_dict(self, topo_vect: np.array,
-                            line_disabled: int,
-                            sub_info: np.array,
-                            line_or_pos_topo_vect: np.array,
-                            line_ex_pos_topo_vect: np.array
-                            ) -> int:
+
+class ProcessedDataFile:
+    """
+    Reader of a processed data file, as saved by save_data_to_file().
+    Provides access to the columns and to individual datapoints.
+    """
+
+    def __init__(self, fpath: str):
+        """
+        Parameters
+        ----------
+        fpath : str
+            The filepath of the file.
+        """
+        with np.load(fpath) as file:
+            self.columns = {k: file[k] for k in DATAPOINT_COLUMNS}
+            self.static = {k: (file[k] if file[k].ndim > 0 else file[k].item())
+                           for k in STATIC_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self.columns['action_index'])
+
+    def __getitem__(self, i: int) -> dict:
         """
-        This function fulfils two purposes: (1) if the corresponding con.
-        matrix hasn't been stored yet, compute it and store it;
-        (2) return the hash key of the corresponding con. matrix.
+        Get a single datapoint.
 
         Parameters
         ----------
-        topo_vect : np.array
-            The topology vector from which to compute the con. matrix.
-        line_disabled : int
-            The line index to be disabled. -1 if no line is disabled.
-        sub_info : np.array
-            Vector representing the number of objects per substation.
-        line_or_pos_topo_vect : np.array
-            Vector representing the indices of the line origins in the topo
-            vect.
-        line_ex_pos_topo_vect : np.array
-            Vector representing the indices of the line extremities in the topo
-            vect.
+        i : int
+            The offset of the datapoint in the file.
 
         Returns
         -------
-        h_topo_vect : int
-            The hash of the topology vector, which can be used to index
-            for con. matrices.
-
+        dict
+            The datapoint, including the static data.
         """
-        # Check that line_or_pos_topo_vect and line_ex_pos_topo_vect
-        # have no overlap
-        assert set(line_or_pos_topo_vect).isdisjoint(set(line_ex_pos_topo_vect))
-        # And have the same size
-        assert len(line_or_pos_topo_vect) == len(line_ex_pos_topo_vect)
-        # Check that the number of objects according to sub_info and topo_vect
-        # are equal
-        assert sum(sub_info) == len(topo_vect)
-
-        h_topo_vect = hash((line_disabled, util.hash_nparray(topo_vect)))
-        if h_topo_vect not in self.con_matrices:
-            con_matrices = g2o_util.connectivity_matrices(sub_info.astype(int),
-                                                          topo_vect.astype(int),
-                                                          line_or_pos_topo_vect.astype(int),
-                                                          line_ex_pos_topo_vect.astype(int))
+        dp = {k: v[i] for k, v in self.columns.items()}
+        dp.update(self.static)
+        return dp
 
-            self.con_matrices[h_topo_vect] = (topo_vect, con_matrices)
 
-        return h_topo_vect
+class FeatureMoments:
+    """
+    Tracks the number, mean, sum of squared deviations (M2), minimum and
+    maximum of a set of features, as well as a histogram from which
+    quantiles can be estimated.
+
+    The moments are updated with the method of Welford and merged with the
+    parallel algorithm of Chan et al., which, unlike raw sums of squares,
+    remain numerically stable for large datasets and large feature values.
+    The histogram has fixed bins that are uniform on an asinh scale, so that
+    histograms of different subsets of the data can be merged by adding the
+    counts.
+    """
+    # Bins of the histogram, uniform on the asinh scale between -ASINH_RANGE
+    # and ASINH_RANGE. Values outside are counted in the outermost bins.
+    N_BINS = 1024
+    ASINH_RANGE = float(np.arcsinh(1e6))
 
-    def save(self, fpath: str = ''):
+    def __init__(self, n_features: int):
+        """
+        Parameters
+        ----------
+        n_features : int
+            The number of features.
+        """
+        self.n = 0
+        self.mean = np.zeros(n_features)
+        self.M2 = np.zeros(n_features)
+        self.min = np.full(n_features, np.inf)
+        self.max = np.full(n_features, -np.inf)
+        self.hist = np.zeros((n_features, self.N_BINS), dtype=np.int64)
+
+    def _combine_moments(self, n: int, mean: np.array, M2: np.array):
+        # Combine the moments with those of another set of datapoints
+        # (Chan et al.)
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.M2 = self.M2 + M2 + delta ** 2 * (self.n * n / total)
+        self.n = total
+
+    def update(self, features: np.array):
         """
-        Save the dictionary of connectivity matrices as a json file.
+        Update the statistics with a batch of datapoints.
 
         Parameters
         ----------
-        fpath : str, optional
-            Where to store the json file. The default is the working directory.
+        features : np.array
+            The feature values. Rows represent datapoints, columns features.
+        """
+        if len(features) == 0:
+            return
+        features = features.astype(np.float64)
+        batch_mean = features.mean(axis=0)
+        self._combine_moments(len(features), batch_mean, ((features - batch_mean) ** 2).sum(axis=0))
+        self.min = np.minimum(self.min, features.min(axis=0))
+        self.max = np.maximum(self.max, features.max(axis=0))
+
+        # Update the histogram counts of each feature at once
+        n_features = features.shape[1]
+        bins = np.floor((np.arcsinh(features) + self.ASINH_RANGE) / (2 * self.ASINH_RANGE) * self.N_BINS)
+        bins = np.clip(bins, 0, self.N_BINS - 1).astype(np.int64) + np.arange(n_features) * self.N_BINS
+        self.hist += np.bincount(bins.reshape(-1), minlength=n_features * self.N_BINS) \
+            .reshape(n_features, self.N_BINS)
+
+    def merge(self, other: 'FeatureMoments'):
+        """
+        Add the statistics tracked by another FeatureMoments object.
 
+        Parameters
+        ----------
+        other : FeatureMoments
+            The other object.
         """
-        with open(fpath, 'w') as outfile:
-            json.dump(self.con_matrices, outfile, cls=NumpyEncoder)
+        if other.n == 0:
+            return
+        self._combine_moments(other.n, other.mean, other.M2)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.hist = self.hist + other.hist
+
+    @property
+    def std(self) -> np.array:
+        """
+        The (population) standard deviation of the features.
+        """
+        return np.sqrt(self.M2 / self.n)
 
-    @classmethod
-    def load(cls, fpath: str):
+    def quantile(self, q: float) -> np.array:
         """
-        Factory class: initialize a ConMatrixCache based on a file.
+        Estimate a quantile of the features from the histogram, interpolating
+        linearly (on the asinh scale) within bins.
 
         Parameters
         ----------
-        fpath : str
-            The filepath of the file.
+        q : float
+            The quantile, between zero and one.
+
+        Returns
+        -------
+        np.array
+            The estimated quantile of each feature.
         """
-        cmc = cls()
-        with open(fpath, 'r') as file:
-            cmc.con_matrices = json.loads(file.read())
-        return cmc
+        assert 0 <= q <= 1, "The quantile should be between zero and one."
+        width = 2 * self.ASINH_RANGE / self.N_BINS
+        cum_counts = np.cumsum(self.hist, axis=1)
+        target = q * self.n
+        bins = np.array([min(np.searchsorted(c, target), self.N_BINS - 1) for c in cum_counts])
+        rows = np.arange(len(bins))
+        counts_before = cum_counts[rows, bins] - self.hist[rows, bins]
+        frac = np.clip((target - counts_before) / np.maximum(self.hist[rows, bins], 1), 0, 1)
+        values = np.sinh(-self.ASINH_RANGE + (bins + frac) * width)
+        return np.clip(values, self.min, self.max)
+
+    def to_dict(self) -> dict:
+        """
+        Represent the tracked statistics as a JSON-serializable dictionary.
+        The histogram is stored sparsely.
 
+        Returns
+        -------
+        dict
+            The statistics.
+        """
+        nonzero = np.flatnonzero(self.hist)
+        return {'n': self.n, 'mean': self.mean, 'M2': self.M2, 'min': self.min, 'max': self.max,
+                'hist_index': nonzero, 'hist_count': self.hist.reshape(-1)[nonzero]}
 
-def save_data_to_file(data: List[dict], output_data_path: str):
-    """
-    Given a list of dictionaries, representing various data points,
-    save these to a json file. If the list is empty, save nothing.
+    @classmethod
+    def from_dict(cls, d: dict) -> 'FeatureMoments':
+        """
+        Factory class: initialize a FeatureMoments object based on a
+        dictionary, as produced by to_dict().
 
-    Parameters
-    ----------
-    data : List[dict]
-        Various data points.
-    output_data_path : str
-        The output directory where to save the file.
-    """
-    if not data:
-        return
+        Parameters
+        ----------
+        d : dict
+            The dictionary.
 
-    filename = f'data_lout{data[0]["line_disabled"]}_' + \
-               f'chr{data[0]["chronic_id"]}.json'
-    with open(output_data_path + filename, 'w') as outfile:
-        json.dump(data, outfile, cls=NumpyEncoder)
+        Returns
+        -------
+        FeatureMoments
+            The statistics object.
+        """
+        moments = cls(len(d['mean']))
+        moments.n = d['n']
+        moments.mean, moments.M2, moments.min, moments.max = \
+            [np.array(d[k], dtype=np.float64) for k in ['mean', 'M2', 'min', 'max']]
+        moments.hist.reshape(-1)[np.array(d['hist_index'], dtype=np.int64)] = d['hist_count']
+        return moments
 
 
 class FeatureStatistics:
     """
-    Used to track the statistics about features (N, mean, std), which are used
-    in feature normalization.
+    Used to track the statistics about features (N, mean, std, min, max,
+    quantiles) per object type, which are used in feature normalization.
 
     Since the dataset is too large to hold in memory completely, the feature
-    statistics are computed iteratively.
+    statistics are computed iteratively. Statistics of different subsets of
+    the data (e.g. different files) can be merged.
     """
+    OBJECT_TYPES = {'gen': 'gen_features',
+                    'load': 'load_features',
+                    'or': 'or_features',
+                    'ex': 'ex_features'}
+    QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
 
     def __init__(self):
-        # Initialize statistics about features
-        self.N_gen, self.N_load, self.N_line = 0, 0, 0
-        self.S_gen, self.S_load, self.S_or, self.S_ex = None, None, None, None
-        self.S2_gen, self.S2_load, self.S2_or, self.S2_ex = None, None, None, None
+        # Initialize statistics about features; these are created when the
+        # number of features is known
+        self.moments = {}
 
     def update_feature_statistics(self, data: dict):
         """
-        Update the statistics (number, sum, sum of squares) of the feature
-        values.
+        Update the statistics of the feature values.
 
         Parameters
         ----------
         data : np.array
-            Dictionary representing the datapoints, containing the features.
-
-        """
-        features = [data['gen_features'], data['load_features'],
-                    data['or_features'], data['ex_features']]
-
-        # Update number of objects
-        self.N_gen, self.N_load, self.N_line = [n + f.shape[0] for f, n in
-                                                zip(features[:-1], [self.N_gen, self.N_load, self.N_line])]
-
-        if self.S_gen is None:
-            # Initialize sum
-            self.S_gen, self.S_load, self.S_or, self.S_ex = \
-                [f.sum(axis=0) for f in features]
-            # Initialize sum of squares
-            self.S2_gen, self.S2_load, self.S2_or, self.S2_ex = \
-                [(f ** 2).sum(axis=0) for f in features]
-        else:
-            # Increase the sum
-            self.S_gen, self.S_load, self.S_or, self.S_ex = \
-                [s + f.sum(axis=0) for f, s in zip(features,
-                                                   [self.S_gen, self.S_load, self.S_or, self.S_ex])]
-            # Increase the sum of squares
-            self.S2_gen, self.S2_load, self.S2_or, self.S2_ex = \
-                [s2 + (f ** 2).sum(axis=0) for f, s2 in zip(features,
-                                                            [self.S2_gen, self.S2_load, self.S2_or, self.S2_ex])]
+            Dictionary representing one or more datapoints, containing the
+            features. The last dimension of the feature arrays indexes the
+            features, the other dimensions the objects.
+
+        """
+        for name, key in self.OBJECT_TYPES.items():
+            features = data[key].reshape(-1, data[key].shape[-1])
+            if name not in self.moments:
+                self.moments[name] = FeatureMoments(features.shape[1])
+            self.moments[name].update(features)
+
+    def merge(self, other: 'FeatureStatistics'):
+        """
+        Add the statistics tracked by another FeatureStatistics object, e.g.
+        one that tracked the statistics of another subset of the data.
+
+        Parameters
+        ----------
+        other : FeatureStatistics
+            The other object.
+        """
+        for name, moments in other.moments.items():
+            if name not in self.moments:
+                self.moments[name] = FeatureMoments(len(moments.mean))
+            self.moments[name].merge(moments)
+
+    def to_dict(self) -> dict:
+        """
+        Represent the tracked statistics as a JSON-serializable dictionary.
+
+        Returns
+        -------
+        dict
+            The statistics per object type.
+        """
+        return {name: moments.to_dict() for name, moments in self.moments.items()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'FeatureStatistics':
+        """
+        Factory class: initialize a FeatureStatistics object based on a
+        dictionary, as produced by to_dict().
+
+        Parameters
+        ----------
+        d : dict
+            The dictionary.
+
+        Returns
+        -------
+        FeatureStatistics
+            The feature statistics object.
+        """
+        fstats = cls()
+        fstats.moments = {name: FeatureMoments.from_dict(m) for name, m in d.items()}
+        return fstats
 
     def save_feature_statistics(self, fpath: str):
         """
         Save the feature statistics in the form of the mean and standard
-        deviation per object type to a specified location.
+        deviation per object type to a specified location. Additionally, the
+        minimum, maximum, and a number of quantiles are saved, which can be
+        used for robust normalization.
 
         Parameters
         ----------
         fpath : str
             The filepath to save to.
         """
-
-        def std(num, sm, sum2):
-            return np.sqrt(sum2 / num - (sm / num) ** 2)
-
         stats = {}
-        for name, N, S, S2 in [('gen', self.N_gen, self.S_gen, self.S2_gen),
-                               ('load', self.N_load, self.S_load, self.S2_load),
-                               ('or', self.N_line, self.S_or, self.S2_or),
-                               ('ex', self.N_line, self.S_ex, self.S2_ex)]:
-            stats[name] = {'mean': S / N,
-                           'std': std(N, S, S2)}
+        for name, moments in self.moments.items():
+            stats[name] = {'mean': moments.mean,
+                           'std': moments.std,
+                           'min': moments.min,
+                           'max': moments.max,
+                           'quantiles': {str(q): moments.quantile(q) for q in self.QUANTILES}}
         with open(fpath, 'w') as outfile:
             json.dump(stats, outfile, cls=NumpyEncoder)
 
 
-def process_raw_tutor_data(config: dict):
+class RawFileProcessor:
     """
-    Process the raw datapoints and store the processed datapoints.
+    Processes the raw datapoints in a single raw tutor data file, and stores
+    the processed datapoints in the directory of the split of its chronic.
 
-    Parameters
-    ----------
-    config : dict
-        Config dict with information such as file paths and constants.
+    The environment and the action identificators are expensive to create.
+    Hence, a processor is created once per (worker) process and reused for
+    all files processed by that process.
     """
 
-    # Specify paths
-    tutor_data_path = config['paths']['tutor_imitation']
-    output_data_path = config['paths']['processed_tutor_imitation']
-    con_matrix_path = config['paths']['con_matrix_cache']
-    fstats_path = config['paths']['feature_statistics']
-    ac_path = config['paths']['action_counter']
+    def __init__(self, config: dict, splits: Dict[int, str]):
+        """
+        Parameters
+        ----------
+        config : dict
+            Config dict with information such as file paths and constants.
+        splits : Dict[int, str]
+            The split of each chronic, see assign_splits().
+        """
+        self.tutor_data_path = config['paths']['tutor_imitation']
+        self.output_data_path = config['paths']['processed_tutor_imitation']
+        self.action_space_path = config['paths']['action_space']
+        self.splits = splits
+
+        # Initialize environment and environment variables
+        import grid2op
+        self.env = g2o_util.init_env(config, grid2op.Rules.AlwaysLegal)
+        self.obs_slice_map = g2o_util.obs_vect_slice_map(self.env.get_obs())
+        self.thermal_limits = config['rte_case14_realistic']['thermal_limits']
+
+        # Create a dictionary used for finding actions corresponding to action ids
+        self.action_iders = {}
+
+    def process_file(self, fp: Path) -> Tuple[FeatureStatistics, Counter, Optional[str]]:
+        """
+        Process the raw datapoints in a file and save the processed datapoints.
+
+        Parameters
+        ----------
+        fp : Path
+            The path of the raw data file.
+
+        Returns
+        -------
+        fstats : FeatureStatistics
+            The feature statistics of the datapoints in the file.
+        action_counter : Counter
+            The action frequencies of the datapoints in the file.
+        output_filename : Optional[str]
+            The path of the file with the processed datapoints, relative to
+            the directory of processed files. None if the file contained no
+            datapoints to save.
+        """
+        fstats = FeatureStatistics()
+        action_counter = Counter()
 
-    # Initialize environment and environment variables
-    env = g2o_util.init_env(config,
-                            grid2op.Rules.AlwaysLegal)
-    grid2op_vect_size = len(env.get_obs().to_vect())
-    thermal_limits = config['rte_case14_realistic']['thermal_limits']
-
-    # Create an object for caching connectivity matrices
-    cmc = ConMatrixCache()
-    # Create a dictionary used for finding actions corresponding to action ids
-    action_iders = {}
-    # Create object for tracking the feature statistics
-    fstats = FeatureStatistics()
-    # Object for tracking action frequencies. Can be used to filter out
-    # rare actions
-    action_counter = Counter()
-
-    for fp in tqdm(get_filepaths(tutor_data_path)):
         line_disabled, _, chronic_id, dayscomp = \
-            extract_data_from_filepath(fp.relative_to(tutor_data_path))
+            extract_data_from_filepath(fp.relative_to(self.tutor_data_path))
 
         # Load a single file with raw datapoints
         chr_ldis_raw_dps = np.load(fp)
@@ -441,153 +700,425 @@ def process_raw_tutor_data(config: dict):
         # If it doesn't already exit, create action_identificator for this
         # particular line disabled
         # Action identificator give the action corresponding to an action index
-        if line_disabled not in action_iders:
-            action_iders[line_disabled] = action_identificator(line_disabled)
-
-        # Create a list wherein to store the processed datapoints for this
-        # particular file
-        file_dps = []
+        if line_disabled not in self.action_iders:
+            self.action_iders[line_disabled] = action_identificator(line_disabled, self.action_space_path)
 
         # Env information specifically for a line removed
-        env_info_dict = env_info_line_disabled(env, line_disabled)
-
-        # Loop over the datapoints
-        for raw_dp in chr_ldis_raw_dps:
-            # Extract information dictionary from the datapoint
-            dp = extract_data_from_single_ts(raw_dp,
-                                             grid2op_vect_size,
-                                             env.observation_space.from_vect,
-                                             line_disabled,
-                                             env_info_dict,
-                                             thermal_limits)
-
-            # Add the data from the filepath and environment to the data dictionary
-            dp.update({'line_disabled': line_disabled,
-                       'chronic_id': chronic_id,
-                       'dayscomp': dayscomp})
-            dp.update({'sub_info': env_info_dict['sub_info'],
-                       'gen_pos_topo_vect': env_info_dict['gen_pos_topo_vect'],
-                       'load_pos_topo_vect': env_info_dict['load_pos_topo_vect'],
-                       'line_or_pos_topo_vect': env_info_dict['line_or_pos_topo_vect'],
-                       'line_ex_pos_topo_vect': env_info_dict['line_ex_pos_topo_vect'],
-                       })
-
-            # Update the feature statistics.
-            fstats.update_feature_statistics(dp)
-
-            # Find the set action topology vector and add it to the datapoint
-            if dp['action_index'] != -1:
-                action_ider = action_iders[line_disabled]
-                dp['set_topo_vect'] = action_ider.get_set_topo_vect(dp['action_index'])
-                # Remove disables lines from topo vect objects
-                if line_disabled != -1:
-                    dp['set_topo_vect'] = np.delete(dp['set_topo_vect'], [
-                        env_info_dict['dis_line_or_tv'],
-                        env_info_dict['dis_line_ex_tv']])
-            else:
-                dp['set_topo_vect'] = np.zeros_like(dp['topo_vect'])
-
-            dp['change_topo_vect'] = np.array([0 if s == 0 else abs(t - s) for t, s in
-                                               zip(dp['topo_vect'], dp['set_topo_vect'])])
-            dp['res_topo_vect'] = np.array([t if s == 0 else s for t, s in
-                                            zip(dp['topo_vect'], dp['set_topo_vect'])])
-
-            # Update action counter
-            # TODO: Change this for scenarios with different topologies
+        env_info_dict = env_info_line_disabled(self.env, line_disabled)
+
+        # Extract the information of all datapoints in the file at once
+        file_data = extract_data_from_records(chr_ldis_raw_dps,
+                                              self.obs_slice_map,
+                                              line_disabled,
+                                              env_info_dict,
+                                              self.thermal_limits)
+        topo_vect = file_data['topo_vect']
+        action_index = file_data['action_index']
+
+        # Update the feature statistics.
+        fstats.update_feature_statistics(file_data)
+
+        # Find the set action topology vectors; zero for do-nothing actions
+        set_topo_vect = np.zeros_like(topo_vect)
+        acted = action_index != -1
+        if acted.any():
+            action_set_topo_vects = self.action_iders[line_disabled].set_topo_vects[action_index[acted]]
+            # Remove disables lines from topo vect objects
             if line_disabled != -1:
-                raise NotImplementedError
-            act_hash = util.hash_nparray(dp['change_topo_vect'])
-            action_counter[act_hash] += 1
-            dp['act_hash'] = act_hash
-
-            # Skip datapoint if any other line is disabled
-            if -1 in dp['topo_vect']:
-                continue
-
-            assert len(dp['set_topo_vect']) == len(dp['topo_vect']) == len(dp['change_topo_vect']) \
-                   == len(dp['res_topo_vect']), "Not equal lengths"
-            assert len(dp['topo_vect']) == (56 if line_disabled == -1 else 54), \
-                "Incorrect length"
-            assert all([(o in [0, 1, 2]) for o in dp['set_topo_vect']]), \
-                "Incorrect element in set_topo_vect"
-            assert all([(o in [1, 2]) for o in dp['topo_vect']]), \
-                "Incorrect element in topo_vect"
-            assert all([(o in [0, 1]) for o in dp['change_topo_vect']]), \
-                "Incorrect element in change_topo_vect"
-            assert all([(o in [1, 2]) for o in dp['res_topo_vect']]), \
-                "Incorrect element in res_topo_vect"
-
-            # Add the index of the connectivity matrix to the data object
-            cm_index = cmc.get_key_add_to_dict(dp['topo_vect'],
-                                               line_disabled,
-                                               env_info_dict['sub_info'],
-                                               env_info_dict['line_or_pos_topo_vect'],
-
-                                               env_info_dict['line_ex_pos_topo_vect'])
-            dp['cm_index'] = cm_index
-            assert dp['cm_index'] in cmc.con_matrices
-
-            # Append datapoint to the datapoints for a particular chronic and
-            # line disabled, update summary object
-            file_dps.append(dp)
-
-        # Save the processed datapoints for a particular chronic and line disabled
-        save_data_to_file(file_dps, output_data_path)
-
-    cmc.save(con_matrix_path)
-    fstats.save_feature_statistics(fstats_path)
-    with open(ac_path, 'w') as outfile:
-        json.dump(action_counter,
-                  outfile,
-                  cls=NumpyEncoder)
+                action_set_topo_vects = np.delete(action_set_topo_vects, [
+                    env_info_dict['dis_line_or_tv'],
+                    env_info_dict['dis_line_ex_tv']], axis=1)
+            set_topo_vect[acted] = action_set_topo_vects
+
+        change_topo_vect = np.where(set_topo_vect == 0, 0, np.abs(topo_vect - set_topo_vect))
+        res_topo_vect = np.where(set_topo_vect == 0, topo_vect, set_topo_vect)
+
+        # Update action counter. Hashes are only computed for the unique
+        # change topology vectors. Since the hashes include the line disabled,
+        # the actions of different topology layouts are counted separately
+        unique_changes, change_inverse = np.unique(change_topo_vect, axis=0, return_inverse=True)
+        unique_act_hashes = np.array([util.hash_layout_array(c, line_disabled) for c in unique_changes],
+                                     dtype=np.int64)
+        act_hash = unique_act_hashes[change_inverse.reshape(-1)]
+        action_counter.update(act_hash.tolist())
+
+        # Skip datapoints if any other line is disabled
+        keep = ~(topo_vect == -1).any(axis=1)
+
+        # The sub_info of the env information excludes the objects of the disabled line
+        assert topo_vect.shape[1] == sum(env_info_dict['sub_info']), \
+            "Incorrect length"
+        assert_elements_in(set_topo_vect[keep], [0, 1, 2], "set_topo_vect", np.flatnonzero(keep))
+        assert_elements_in(topo_vect[keep], [1, 2], "topo_vect", np.flatnonzero(keep))
+        assert_elements_in(change_topo_vect[keep], [0, 1], "change_topo_vect", np.flatnonzero(keep))
+        assert_elements_in(res_topo_vect[keep], [1, 2], "res_topo_vect", np.flatnonzero(keep))
+
+        file_data.update({'set_topo_vect': set_topo_vect,
+                          'change_topo_vect': change_topo_vect,
+                          'res_topo_vect': res_topo_vect,
+                          'act_hash': act_hash})
+        file_data = {k: v[keep] for k, v in file_data.items()}
+
+        # Save the processed datapoints for a particular chronic and line
+        # disabled, together with the data from the filepath and environment
+        static_data = {'line_disabled': line_disabled,
+                       'chronic_id': chronic_id,
+                       'dayscomp': dayscomp}
+        static_data.update({k: env_info_dict[k] for k in ['sub_info',
+                                                          'gen_pos_topo_vect',
+                                                          'load_pos_topo_vect',
+                                                          'line_or_pos_topo_vect',
+                                                          'line_ex_pos_topo_vect',
+                                                          'dis_line_or_tv',
+                                                          'dis_line_ex_tv']})
+        split = self.splits[chronic_id]
+        output_filename = save_data_to_file(file_data, static_data, self.output_data_path + split + '/')
+        if output_filename is not None:
+            output_filename = split + '/' + output_filename
 
+        return fstats, action_counter, output_filename
+
+
+# The processor of a worker process in the process pool
+_worker_processor = None
+
+
+def _init_worker(config: dict, splits: Dict[int, str]):
+    """
+    Initialize the processor of a worker process.
+
+    Parameters
+    ----------
+    config : dict
+        Config dict with information such as file paths and constants.
+    splits : Dict[int, str]
+        The split of each chronic, see assign_splits().
+    """
+    global _worker_processor
+    _worker_processor = RawFileProcessor(config, splits)
+
+
+def _process_file_in_worker(fp: Path) -> Tuple[FeatureStatistics, Counter, Optional[str]]:
+    """
+    Process a raw data file with the processor of the worker process.
+
+    Parameters
+    ----------
+    fp : Path
+        The path of the raw data file.
+
+    Returns
+    -------
+    Tuple[FeatureStatistics, Counter, Optional[str]]
+        The feature statistics and action frequencies of the datapoints in
+        the file, and the relative path of the processed file.
+    """
+    return _worker_processor.process_file(fp)
+
+
+class PreprocessingManifest:
+    """
+    Keeps track of the raw data files that have been processed, so that a
+    subsequent run only needs to process new or changed files.
 
-def divide_files_train_val_test():
+    For each raw file, the manifest stores its size, modification time and
+    content hash, its split, the path of its processed file, and its
+    contribution to the feature statistics and the action frequencies. The
+    statistics of a split are obtained by merging these contributions.
     """
-    Divide the processed data files over train, val, and test subdirectories. If these subdirectories already exist,
-    then they are first removed.
+
+    def __init__(self):
+        self.entries = {}
+
+    def is_unchanged(self, rel_path: str, fp: Path) -> bool:
+        """
+        Check whether a raw file is unchanged since it was processed. The
+        content hash is only computed when the size or modification time
+        differ.
+
+        Parameters
+        ----------
+        rel_path : str
+            The path of the raw file, relative to the raw data directory.
+        fp : Path
+            The path of the raw file.
+
+        Returns
+        -------
+        bool
+            Whether the file is in the manifest and unchanged.
+        """
+        entry = self.entries.get(rel_path)
+        if entry is None:
+            return False
+
+        stat = os.stat(fp)
+        if entry['size'] != stat.st_size:
+            return False
+        if entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if entry['hash'] == util.hash_file(fp):
+            # The file was touched, but its contents are unchanged
+            entry['mtime_ns'] = stat.st_mtime_ns
+            return True
+        return False
+
+    def add(self, rel_path: str,
+            fp: Path,
+            split: str,
+            fstats: FeatureStatistics,
+            action_counter: Counter,
+            output_filename: Optional[str]):
+        """
+        Add a processed raw file to the manifest.
+
+        Parameters
+        ----------
+        rel_path : str
+            The path of the raw file, relative to the raw data directory.
+        fp : Path
+            The path of the raw file.
+        split : str
+            The split the file is assigned to.
+        fstats : FeatureStatistics
+            The feature statistics of the datapoints in the file.
+        action_counter : Counter
+            The action frequencies of the datapoints in the file.
+        output_filename : Optional[str]
+            The path of the processed file, relative to the directory of
+            processed files. None if no file was saved.
+        """
+        stat = os.stat(fp)
+        self.entries[rel_path] = {'size': stat.st_size,
+                                  'mtime_ns': stat.st_mtime_ns,
+                                  'hash': util.hash_file(fp),
+                                  'split': split,
+                                  'output_file': output_filename,
+                                  'feature_statistics': fstats.to_dict(),
+                                  'action_counter': dict(action_counter)}
+
+    def remove(self, rel_path: str) -> dict:
+        """
+        Remove a raw file from the manifest.
+
+        Parameters
+        ----------
+        rel_path : str
+            The path of the raw file, relative to the raw data directory.
+
+        Returns
+        -------
+        dict
+            The removed entry.
+        """
+        return self.entries.pop(rel_path)
+
+    def feature_statistics(self, split: str = 'train') -> FeatureStatistics:
+        """
+        Merge the feature statistics of the files of a split, in the order of
+        the files.
+
+        Parameters
+        ----------
+        split : str, optional
+            The split. The default is 'train'.
+
+        Returns
+        -------
+        FeatureStatistics
+            The feature statistics of the split.
+        """
+        fstats = FeatureStatistics()
+        for rel_path in sorted(self.entries):
+            if self.entries[rel_path]['split'] == split:
+                fstats.merge(FeatureStatistics.from_dict(self.entries[rel_path]['feature_statistics']))
+        return fstats
+
+    def action_counter(self, split: str = 'train') -> Counter:
+        """
+        Merge the action frequencies of the files of a split.
+
+        Parameters
+        ----------
+        split : str, optional
+            The split. The default is 'train'.
+
+        Returns
+        -------
+        Counter
+            The action frequencies of the split.
+        """
+        action_counter = Counter()
+        for entry in self.entries.values():
+            if entry['split'] == split:
+                action_counter.update({int(h): c for h, c in entry['action_counter'].items()})
+        return action_counter
+
+    def save(self, fpath: str):
+        """
+        Save the manifest as a json file.
+
+        Parameters
+        ----------
+        fpath : str
+            Where to store the json file.
+        """
+        with open(fpath, 'w') as outfile:
+            json.dump(self.entries, outfile, cls=NumpyEncoder)
+
+    @classmethod
+    def load(cls, fpath: str):
+        """
+        Factory class: initialize a PreprocessingManifest based on a file.
+
+        Parameters
+        ----------
+        fpath : str
+            The filepath of the file.
+        """
+        manifest = cls()
+        with open(fpath, 'r') as file:
+            manifest.entries = json.loads(file.read())
+        return manifest
+
+
+def remove_processed_file(processed_path: str, filename: Optional[str]):
+    """
+    Remove a processed data file, if it exists.
+
+    Parameters
+    ----------
+    processed_path : str
+        The directory of processed files.
+    filename : Optional[str]
+        The path of the processed file, relative to the directory of processed
+        files. If None, nothing is removed.
+    """
+    if filename is not None and os.path.exists(processed_path + filename):
+        os.remove(processed_path + filename)
+
+
+def prepare_split_dirs(processed_path: str, clear: bool):
+    """
+    Create the train, val, and test subdirectories of the directory of
+    processed files.
+
+    Parameters
+    ----------
+    processed_path : str
+        The directory of processed files.
+    clear : bool
+        Whether to first remove existing subdirectories, including the
+        processed datapoints in them.
 
     Raises
     ------
     RuntimeError
-        Whenever there are files in the existing train/val/test folders which are not .json files.
+        Whenever there are files in the existing train/val/test folders which are not .npz (data) or .json (dataset
+        index) files.
     """
-    config = util.load_config()
-    processed_path = config['paths']['processed_tutor_imitation']
+    for split in SPLITS:
+        split_path = processed_path + split
+        if clear and os.path.exists(split_path):
+            if not all([file.endswith(('.npz', '.json')) for file in os.listdir(split_path)]):
+                raise RuntimeError(f'All files in the {split} folder to be overwritten must be .npz or .json files.')
+            shutil.rmtree(split_path)
+        os.makedirs(split_path, exist_ok=True)
+
+
+def process_raw_tutor_data(config: dict, n_workers: int = 1, incremental: bool = False):
+    """
+    Process the raw datapoints and store the processed datapoints.
+
+    Each chronic is assigned to the train, val, or test split (see
+    assign_splits()), and the processed datapoints are stored in the
+    subdirectory of that split. The feature statistics and action frequencies
+    are computed over the train split only.
 
-    # Remove directories including existing processed datapoints
-    if os.path.exists(processed_path + 'train'):
-        if not all([file.endswith('.json') for file in os.listdir(processed_path + 'train')]):
-            raise RuntimeError('All files in the train folder to be overwritten must be .json files.')
-        shutil.rmtree(processed_path + 'train')
-    if os.path.exists(processed_path + 'val'):
-        if not all([file.endswith('.json') for file in os.listdir(processed_path + 'val')]):
-            raise RuntimeError('All files in the val folder to be overwritten must be .json files.')
-        shutil.rmtree(processed_path + 'val')
-    if os.path.exists(processed_path + 'test'):
-        if not all([file.endswith('.json') for file in os.listdir(processed_path + 'test')]):
-            raise RuntimeError('All files in the test folder to be overwritten must be .json files.')
-        shutil.rmtree(processed_path + 'test')
-
-    # List data files, shuffle them
-    data_files = os.listdir(processed_path)
-    assert all([file.endswith('.json') for file in data_files]), "All files in the directory of" \
-                                                                 "processed files must be .json files."
-    assert data_files, "The directory with processed files cannot be empty."
-    shuffle(data_files)
-
-    # Create the train, val, test directories
-    os.mkdir(processed_path + 'train')
-    os.mkdir(processed_path + 'val')
-    os.mkdir(processed_path + 'test')
-
-    # Divide shuffled files over the three subdirectories
-    train_range = config['dataset']['train_perc'] * len(data_files)
-    val_range = train_range + config['dataset']['val_perc'] * len(data_files)
-    for i, f in enumerate(data_files):
-        if i > val_range:
-            os.rename(processed_path + f, processed_path + 'test/' + f)
-        elif i > train_range:
-            os.rename(processed_path + f, processed_path + 'val/' + f)
-        else:
-            os.rename(processed_path + f, processed_path + 'train/' + f)
+    The raw data files can be processed by a pool of worker processes. Each
+    file produces partial feature statistics and action frequencies, which
+    are merged in the order of the files, so that the output does not depend
+    on the number of workers. The action spaces used by the workers are
+    (re)generated, if necessary, before the workers start.
+
+    The partial results are recorded in a manifest. In incremental mode, only
+    the raw files that are new or changed since the previous run are
+    processed; the results of the unchanged files are taken from the manifest.
+
+    Parameters
+    ----------
+    config : dict
+        Config dict with information such as file paths and constants.
+    n_workers : int, optional
+        The number of worker processes. If one, the files are processed in
+        the current process. The default is 1.
+    incremental : bool, optional
+        Whether to only process new or changed raw files. The default is False.
+    """
+    assert n_workers >= 1, "The number of workers should be at least one."
+
+    # Specify paths
+    tutor_data_path = config['paths']['tutor_imitation']
+    processed_path = config['paths']['processed_tutor_imitation']
+    fstats_path = config['paths']['feature_statistics']
+    ac_path = config['paths']['action_counter']
+    manifest_path = config['paths']['preprocessing_manifest']
+
+    if incremental and os.path.exists(manifest_path):
+        manifest = PreprocessingManifest.load(manifest_path)
+    else:
+        if incremental:
+            print('No manifest of a previous run found; processing all files.')
+        manifest = PreprocessingManifest()
+    prepare_split_dirs(processed_path, clear=not incremental)
+
+    all_filepaths = {str(fp.relative_to(tutor_data_path)): fp for fp in get_filepaths(tutor_data_path)}
+
+    # The splits are assigned over all chronics. Adding chronics can move
+    # existing chronics to another split, in which case their files are
+    # reprocessed below
+    splits = assign_splits([extract_data_from_filepath(Path(rp))[2] for rp in all_filepaths],
+                           config['dataset']['train_perc'],
+                           config['dataset']['val_perc'],
+                           config['dataset']['split_seed'])
+
+    def split_of(rel_path: str) -> str:
+        return splits[extract_data_from_filepath(Path(rel_path))[2]]
+
+    # Forget the raw files that were removed, changed, or assigned to another
+    # split, as well as their processed files
+    for rel_path in [rp for rp in manifest.entries
+                     if rp not in all_filepaths
+                     or not manifest.is_unchanged(rp, all_filepaths[rp])
+                     or manifest.entries[rp].get('split') != split_of(rp)]:
+        remove_processed_file(processed_path, manifest.remove(rel_path)['output_file'])
+
+    rel_paths = sorted(rp for rp in all_filepaths if rp not in manifest.entries)
+    filepaths = [all_filepaths[rp] for rp in rel_paths]
+    print(f'Processing {len(filepaths)} out of {len(all_filepaths)} raw data files.')
+
+    def merge_file_results(file_results: Iterable[Tuple[FeatureStatistics, Counter, Optional[str]]]):
+        # Record the partial results of the files in the manifest
+        for rp, fp, (file_fstats, file_action_counter, output_filename) in \
+                tqdm(zip(rel_paths, filepaths, file_results), total=len(filepaths)):
+            manifest.add(rp, fp, split_of(rp), file_fstats, file_action_counter, output_filename)
+
+    if n_workers == 1:
+        processor = RawFileProcessor(config, splits)
+        merge_file_results(map(processor.process_file, filepaths))
+    else:
+        # Missing or stale action spaces are (re)generated before the workers
+        # start, so that the workers do not generate the same files at once
+        for line_disabled in sorted({extract_data_from_filepath(Path(rp))[0] for rp in rel_paths}):
+            load_set_action_space(config['paths']['action_space'], line_disabled)
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_worker,
+                                 initargs=(config, splits)) as executor:
+            merge_file_results(executor.map(_process_file_in_worker, filepaths))
+
+    manifest.feature_statistics('train').save_feature_statistics(fstats_path)
+    with open(ac_path, 'w') as outfile:
+        json.dump(manifest.action_counter('train'),
+                  outfile,
+                  cls=NumpyEncoder)
+    manifest.save(manifest_path)
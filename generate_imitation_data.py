@@ -24,10 +24,15 @@ if __name__ == '__main__':
                         required=False, default=-1, type=int)
     parser.add_argument("--start_chronic_id",  help="The chronic to start with.",
                         required=False, default=0, type=int)
+    parser.add_argument("--top_k",  help="Only try the top-K actions of the ranked action space. " +
+                        "Defaults to the value in the config.",
+                        required=False, default=None, type=int)
     args = parser.parse_args()
     
     config = util.load_config()
+    top_k = args.top_k if args.top_k is not None else config['tutor_generated_data']['action_space_top_k']
     gnr.generate(config,
                  args.do_nothing_capacity_threshold,
                  args.disable_line,
-                 args.start_chronic_id)
+                 args.start_chronic_id,
+                 top_k)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline scoring of the 'set' busbar actions, used to reduce the action space
+the tutor searches.
+
+The tutor is replayed on a sample of chronics. Whenever it would act, all
+actions are evaluated as in CheckNMinOneStrategy, and each action is scored
+by how often it is the best action, and how often it is (near-)best, i.e.
+within a relative tolerance of the best action on the criterion that
+determined the selection. The actions are ranked by these scores, so that
+the tutor (and the validation) can be restricted to the top-K actions.
+"""
+
+import grid2op
+import numpy as np
+from imitation_generation.tutor import CheckNMinOneStrategy, near_best_actions
+from auxiliary.generate_action_space import load_set_action_space, LazySetBusActions, save_action_ranking, \
+    DEFAULT_ENV_NAME
+import auxiliary.grid2op_util as g2o_util
+
+
+class ActionScorer:
+    """
+    Class for accumulating, per action, how often it is the best and how
+    often it is a near-best action.
+    """
+
+    def __init__(self, n_actions: int, tolerance: float = 0.02):
+        """
+        Parameters
+        ----------
+        n_actions : int
+            The number of actions in the action space.
+        tolerance : float, optional
+            The relative tolerance within which an action counts as
+            near-best. The default is 0.02.
+        """
+        assert tolerance >= 0, "Tolerance cannot be negative."
+
+        self.tolerance = tolerance
+        self.n_best = np.zeros(n_actions, dtype=np.int64)
+        self.n_near_best = np.zeros(n_actions, dtype=np.int64)
+        self.n_evaluated = 0
+
+    def update(self,
+               action_idxs: np.array,
+               max_rhos: np.array,
+               max_max_rhos_NMinOne: np.array,
+               N0_rho_threshold: float) -> int:
+        """
+        Update the scores with the evaluation of the actions in a timestep,
+        as produced by CheckNMinOneStrategy.evaluate_actions().
+
+        Parameters
+        ----------
+        action_idxs : np.array
+            The indices of the evaluated actions. -1 is the do-nothing action.
+        max_rhos : np.array
+            The N-0 max. rho per evaluated action.
+        max_max_rhos_NMinOne : np.array
+            The N-1 max. max. rho per evaluated action.
+        N0_rho_threshold : float
+            The N-0 rho threshold of the strategy.
+
+        Returns
+        -------
+        int
+            The index of the best action. -1 is the do-nothing action.
+        """
+        best, near_best = near_best_actions(max_rhos, max_max_rhos_NMinOne, N0_rho_threshold, self.tolerance)
+
+        # The do-nothing action is not part of the action space
+        near_best_idxs = action_idxs[near_best]
+        np.add.at(self.n_near_best, near_best_idxs[near_best_idxs != -1], 1)
+        if action_idxs[best] != -1:
+            self.n_best[action_idxs[best]] += 1
+        self.n_evaluated += 1
+        return int(action_idxs[best])
+
+    def ranking(self) -> np.array:
+        """
+        Rank the actions by decreasing utility: by the number of times they
+        were the best action, then by the number of times they were a
+        near-best action, then by their id.
+
+        Returns
+        -------
+        np.array
+            The action ids, ordered by decreasing utility.
+        """
+        action_ids = np.arange(len(self.n_best))
+        return np.lexsort((action_ids, -self.n_near_best, -self.n_best))
+
+    def save(self, action_space_path: str, disable_line: int = -1, env_name: str = DEFAULT_ENV_NAME):
+        """
+        Save the ranking of the action space.
+
+        Parameters
+        ----------
+        action_space_path : str
+            The directory of the action space files.
+        disable_line : int, optional
+            The index of the line disabled. The default is -1, i.e no line.
+        env_name : str, optional
+            The name of the environment. The default is rte_case14_realistic.
+        """
+        action_ids = self.ranking()
+        save_action_ranking(action_space_path, action_ids, self.n_best[action_ids],
+                            self.n_near_best[action_ids], self.n_evaluated, disable_line, env_name)
+
+
+def score_actions(config: dict,
+                  n_chronics: int,
+                  do_nothing_capacity_threshold: float = 0.97,
+                  disable_line: int = -1,
+                  start_chronic_id: int = 0,
+                  tolerance: float = 0.02) -> ActionScorer:
+    """
+    Replay the tutor on a sample of chronics, and score the actions whenever
+    the tutor would act. The environment follows the best action, as the
+    tutor would.
+
+    Parameters
+    ----------
+    config : dict
+        The config file with parameters and setting.
+    n_chronics : int
+        The number of chronics to replay.
+    do_nothing_capacity_threshold : float, optional
+        The threshold max. line rho at which the tutor takes actions. The default is .97.
+    disable_line : int, optional
+        The index of the line to be disabled. The default is -1, which indicates no line disabled.
+    start_chronic_id : int, optional
+        The chronic to start replaying from. The default is 0.
+    tolerance : float, optional
+        The relative tolerance within which an action counts as near-best. The default is 0.02.
+
+    Returns
+    -------
+    ActionScorer
+        The scores of the actions.
+    """
+    # Assert preconditions
+    assert n_chronics > 0, "The number of chronics should be positive."
+    assert do_nothing_capacity_threshold >= 0.0, "Do nothing capacity threshold cannot be below zero."
+    assert disable_line >= -1, "The line to be disabled cannot be below -1."
+    assert start_chronic_id >= 0, "The ID of the chronic to start with cannot be below zero."
+
+    ts_in_day = int(config['rte_case14_realistic']['ts_in_day'])
+
+    # Initialize environment, strategy, and action space
+    env = g2o_util.init_env(config, grid2op.Rules.AlwaysLegal)
+    env.set_id(start_chronic_id)
+    strategy = CheckNMinOneStrategy(env.action_space, config['tutor_generated_data']['line_idxs_to_consider_N-1'])
+    actions = LazySetBusActions(env.action_space,
+                                load_set_action_space(config['paths']['action_space'], disable_line))
+    scorer = ActionScorer(len(actions), tolerance)
+
+    for num in range(start_chronic_id, start_chronic_id+n_chronics):
+        obs = env.reset()
+        fast_forward_divergingpowerflow_exception = False
+        print('current chronic: %s' % env.chronics_handler.get_name())
+
+        if disable_line != -1:
+            obs, _, _, _ = env.step(env.action_space({"set_line_status": (disable_line, -1)}))
+        reference_topo_vect = obs.topo_vect.copy()
+
+        while env.nb_time_step < env.chronics_handler.max_timestep():
+            if fast_forward_divergingpowerflow_exception:
+                fast_forward_divergingpowerflow_exception = g2o_util.skip_to_next_day(env, ts_in_day,
+                                                                                      num, disable_line)
+                continue
+
+            # At midnight, reset the topology to the reference
+            if env.nb_time_step % ts_in_day == ts_in_day-1:
+                obs, _, _, _ = env.step(env.action_space({'set_bus': reference_topo_vect}))
+                continue
+
+            # Score the actions if the tutor would act, and take the best action
+            obs = env.get_obs()
+            action = env.action_space()
+            if obs.rho.max() >= do_nothing_capacity_threshold:
+                action_idxs, max_rhos, max_max_rhos_NMinOne = strategy.evaluate_actions(actions, obs)
+                best_idx = scorer.update(action_idxs, max_rhos, max_max_rhos_NMinOne, strategy.N0_rho_threshold)
+                if best_idx != -1:
+                    action = actions[best_idx]
+            obs, _, _, _ = env.step(action)
+
+            if env.done:
+                fast_forward_divergingpowerflow_exception = g2o_util.skip_to_next_day(env, ts_in_day,
+                                                                                      num, disable_line)
+
+        print(f'Chronic exhausted! Actions evaluated in {scorer.n_evaluated} timesteps so far.')
+
+    return scorer
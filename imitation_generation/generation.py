@@ -9,8 +9,9 @@ Created on Fri Jan 28 13:51:31 2022
 import os
 import grid2op
 import numpy as np
+from typing import Optional
 from imitation_generation.tutor import Tutor, CheckNMinOneStrategy
-from auxiliary.generate_action_space import get_env_actions
+from auxiliary.generate_action_space import load_set_action_space, load_action_ranking, LazySetBusActions
 import auxiliary.grid2op_util as g2o_util
 
 # =============================================================================
@@ -96,7 +97,8 @@ def empty_records(obs_vect_size: int):
 def generate(config: dict,
              do_nothing_capacity_threshold: float = 0.97,
              disable_line: int = -1,
-             start_chronic_id: int = 0):
+             start_chronic_id: int = 0,
+             top_k: Optional[int] = None):
     """
     Generate imitation learning data from the tutor model.
 
@@ -110,11 +112,15 @@ def generate(config: dict,
         The index of the line to be disabled. The default is -1, which indicates no line disabled.
     start_chronic_id : int, optional
         The chronic to start generating data from. The default is 0.
+    top_k : Optional[int], optional
+        If given, the tutor only tries the top_k actions of the ranking of the action space,
+        as created by score_actions.py. The default is None, i.e. all actions are tried.
     """
     # Assert preconditions
     assert do_nothing_capacity_threshold >= 0.0, "Do nothing capacity threshold cannot be below zero."
     assert disable_line >= -1, "The line to be disabled cannot be below -1."
     assert start_chronic_id >= 0, "The ID of the chronic to start with cannot be below zero."
+    assert top_k is None or top_k > 0, "Top_k should be positive."
 
     # Load constants, settings, hyperparameters, arguments
     save_path = config['paths']['tutor_imitation']
@@ -126,12 +132,20 @@ def generate(config: dict,
     print("Number of available scenarios: " + str(len(env.chronics_handler.subpaths)))
     env.set_id(start_chronic_id)
     
-    # Prepare tutor and record objects
+    # Prepare tutor and record objects. The grid2op actions are created from the cached action space file
+    # when the tutor first uses them. With a top-K cut, the recorded action indices still refer to the full
+    # action space
     strategy = CheckNMinOneStrategy(env.action_space, config['tutor_generated_data']['line_idxs_to_consider_N-1'])
+    set_action_space = load_set_action_space(config['paths']['action_space'], disable_line)
+    action_ids = None
+    if top_k is not None:
+        action_ids = load_action_ranking(config['paths']['action_space'], disable_line, top_k)
+        set_action_space = set_action_space[action_ids]
     tutor = Tutor(env.action_space,
-                  get_env_actions(disable_line=disable_line),
+                  LazySetBusActions(env.action_space, set_action_space),
                   do_nothing_capacity_threshold,
-                  strategy)
+                  strategy,
+                  action_ids)
     obs_vect_size = len(env.get_obs().to_vect())
     records = empty_records(obs_vect_size)
     
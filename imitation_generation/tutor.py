@@ -20,6 +20,50 @@ from abc import ABC, abstractmethod
 import numpy as np
 
 
+def near_best_actions(max_rhos: np.array,
+                      max_max_rhos_NMinOne: np.array,
+                      N0_rho_threshold: float,
+                      tolerance: float) -> Tuple[int, np.array]:
+    """
+    Find the best and near-best actions among evaluated actions, as evaluated
+    by CheckNMinOneStrategy.evaluate_actions(): if any action with a N-0 max.
+    rho below the threshold has a finite N-1 max. max. rho, the criterion is
+    the N-1 max. max. rho; otherwise, it is the N-0 max. rho. This is the
+    selection criterion of CheckNMinOneStrategy.select_act().
+
+    Parameters
+    ----------
+    max_rhos : np.array
+        The N-0 max. rho per evaluated action.
+    max_max_rhos_NMinOne : np.array
+        The N-1 max. max. rho per evaluated action. Infinity for the actions
+        whose N-1 max. max. rho is not evaluated.
+    N0_rho_threshold : float
+        The N-0 rho threshold of the strategy.
+    tolerance : float
+        The relative tolerance w.r.t. the best criterion value within which
+        an action counts as near-best.
+
+    Returns
+    -------
+    best : int
+        The position of the best action.
+    near_best : np.array
+        Boolean array indicating the near-best actions, including the best.
+    """
+    below_threshold = max_rhos < N0_rho_threshold
+    if np.isfinite(max_max_rhos_NMinOne[below_threshold]).any():
+        criterion = np.where(below_threshold, max_max_rhos_NMinOne, float('inf'))
+    else:
+        criterion = max_rhos
+
+    # Argmin returns the first occurrence, so that ties are broken in favour of the earliest action
+    best = int(np.argmin(criterion))
+    near_best = np.isfinite(criterion) & (criterion <= criterion[best] * (1 + tolerance))
+    near_best[best] = True
+    return best, near_best
+
+
 class Strategy(ABC):
     """
     Base class for the strategy taken by the tutor model.
@@ -212,6 +256,43 @@ class CheckNMinOneStrategy(Strategy):
 
         return max(max_rhos)
 
+    def evaluate_actions(self,
+                         action_space: Sequence[grid2op.Action.TopologyAction],
+                         observation: grid2op.Observation.CompleteObservation) \
+            -> Tuple[np.array, np.array, np.array]:
+        """
+        Evaluates the actions on the criteria used by select_act(): the N-0 max. rho of the do-nothing action and
+        of each action that is not an implicit do-nothing action, and the N-1 max. max. rho of those actions with
+        a N-0 max. rho below the N-0 rho threshold.
+
+        Parameters
+        ----------
+        action_space : Sequence[grid2op.Action.TopologyAction]
+            The available actions.
+        observation :  grid2op.Observation.CompleteObservation
+            The observation, on which to evaluate the actions.
+
+        Returns
+        -------
+        action_idxs : np.array
+            The indices of the evaluated actions. The first entry, -1, is the do-nothing action.
+        max_rhos : np.array
+            The N-0 max. rho per evaluated action.
+        max_max_rhos_NMinOne : np.array
+            The N-1 max. max. rho per evaluated action. Infinity for the actions with a N-0 max. rho that is not
+            below the N-0 rho threshold.
+        """
+        actions = [(idx, a) for idx, a in enumerate(action_space)
+                   if not self.is_do_nothing_set_bus(observation.topo_vect, a.set_bus)]
+        actions.insert(0, (-1, self.env_action_space()))
+
+        action_idxs = np.array([idx for idx, _ in actions], dtype=int)
+        max_rhos = np.array([self.get_max_rho_simulated(observation, a) for _, a in actions], dtype=float)
+        max_max_rhos_NMinOne = np.array([self.max_max_rho_NMinOne(a, observation)
+                                         if max_rho < self.N0_rho_threshold else float('inf')
+                                         for (_, a), max_rho in zip(actions, max_rhos)], dtype=float)
+        return action_idxs, max_rhos, max_max_rhos_NMinOne
+
     def select_act(self,
                    action_space: Sequence[grid2op.Action.TopologyAction],
                    observation: grid2op.Observation.CompleteObservation) \
@@ -241,67 +322,16 @@ class CheckNMinOneStrategy(Strategy):
         sel_rho : float
             The rho value resulting from the selected action.
         """
-        action_chosen = sel_rho = action_idx = None
+        action_idxs, max_rhos, max_max_rhos_NMinOne = self.evaluate_actions(action_space, observation)
+        best, _ = near_best_actions(max_rhos, max_max_rhos_NMinOne, self.N0_rho_threshold, tolerance=0)
 
-        # Select the do-something actions
-        actions = [(idx, a) for idx, a in enumerate(action_space)
-                   if not self.is_do_nothing_set_bus(observation.topo_vect, a.set_bus)]
-        # Add back singular do-nothing action at the start
-        actions.insert(0, (-1, self.env_action_space()))
-        # Calculate N-0 max. rho per action
-        action_max_rho_tuples = [(idx, a, self.get_max_rho_simulated(observation, a)) for idx, a in actions]
-        # Select the actions with a N-0 max. rho below the N-0. max. rho threshold
-        action_max_rho_tuples_below_threshold = [(idx, a, max_rho) for idx, a, max_rho in action_max_rho_tuples
-                                                 if max_rho < self.N0_rho_threshold]
-
-        # If there are actions with a N-0 rho below the N-0 rho threshold,
-        # select the one among them with the best N-1 max. max. rho
-        # provided that this is not infinity
-        if action_max_rho_tuples_below_threshold:
-            lowest_max_max_rho_NMinOne = float('inf')
-
-            for idx, a, max_rho in action_max_rho_tuples_below_threshold:
-                # Calculate the N-1 max. max. rho
-                max_max_rho_NMinOne = self.max_max_rho_NMinOne(a, observation)
-
-                # Set action as best action if it has the lowest N-1 max. max. rho so far
-                if lowest_max_max_rho_NMinOne > max_max_rho_NMinOne:
-                    action_chosen = a
-                    action_idx = idx
-                    sel_rho = max_rho
-                    lowest_max_max_rho_NMinOne = max_max_rho_NMinOne
-
-            assert lowest_max_max_rho_NMinOne == float('inf') if action_chosen is None else True, \
-                   "If no action is selected, then the lowest N-1 max. max. rho must be infinity."
-
-        # At this point, either no action is selected or this action has a N0 max. rho below the N0 threshold.
-        assert action_chosen is None or sel_rho < self.N0_rho_threshold, "At this point, action chosen should be" \
-                                                                         "None or the the sel_rho below the threshold."
-
-        # If the best action so far still has one scenario that fails in the N-1 max. max. rho calculation,
-        # i.e. if the best N-1 max. max. rho is still infinite, then select the action with the best N-0 max. rho
-        if action_chosen is None:
-            assert sel_rho is None and action_idx is None, "Action chosen is none, but other variables not."
-
-            # Select action with best N-0 max. rho
-            for idx, a, max_rho in action_max_rho_tuples:
-
-                # Set the do-nothing action as the default: this works because the first entry in the action list
-                # is the do-nothing action
-                if action_chosen is None:
-                    assert idx == -1, "First action should be the do-nothing action."
-                    action_idx, action_chosen, sel_rho = idx, a, max_rho
-
-                # If the N0 max. rho is lower than that for any action before, set the action to the current
-                if sel_rho > max_rho:
-                    action_idx, action_chosen, sel_rho = idx, a, max_rho
+        action_idx, sel_rho = int(action_idxs[best]), float(max_rhos[best])
+        action_chosen = self.env_action_space() if action_idx == -1 else action_space[action_idx]
 
         # Assert postconditions
-        assert not (action_chosen is None or sel_rho is None or action_idx is None), "One of the output variables is" \
-                                                                                     "None."
         assert sel_rho >= 0, "Sel_rho cannot be negative"
         assert len(action_space) > action_idx >= -1, "Action idx is outside of it's possible range."
-        assert action_idx == -1 if sel_rho == np.float("inf") else True,\
+        assert action_idx == -1 if sel_rho == float("inf") else True,\
                "If sel_rho is infinite, the action should be do_nothing."
 
         return action_chosen, action_idx, sel_rho
@@ -312,7 +342,8 @@ class Tutor(BaseAgent):
                  env_action_space: grid2op.Action.ActionSpace,
                  selected_action_space: Sequence[grid2op.Action.TopologyAction],
                  do_nothing_capacity_threshold: float,
-                 strategy: Strategy):
+                 strategy: Strategy,
+                 action_ids: Optional[Sequence[int]] = None):
         """
         Parameters
         ----------
@@ -324,9 +355,17 @@ class Tutor(BaseAgent):
             The rho value, so that if not exceeded by any line a do-nothing action is selected.
         strategy : Strategy
             The strategy to use for selecting actions.
+        action_ids : Optional[Sequence[int]], optional
+            For each of the selected actions, the index of that action in the full set action space. Used when
+            the selected actions are a subset (e.g. the top-K ranked actions) of the full set action space, so that
+            the returned indices still refer to the full action space. The default is None, in which case the
+            selected actions are the full action space.
         """
         BaseAgent.__init__(self, action_space=env_action_space)
+        assert action_ids is None or len(action_ids) == len(selected_action_space), \
+            "There should be an action id for each selected action."
         self.actions = selected_action_space
+        self.action_ids = action_ids
         self.do_nothing_capacity_threshold = do_nothing_capacity_threshold
         self.strategy = strategy
 
@@ -397,7 +436,7 @@ class Tutor(BaseAgent):
         selected_action : grid2op.Action.BaseAction
             The selected action.
         selected_action_idx : int
-            The index of the selected action.
+            The index of the selected action in the full set action space.
             In case that the max. line capacity is below self.do_nothing_capacity_threshold,
             no action is selected, and the index is -2.
             In case that the max. line capacity is above self.do_nothing_capacity_threshold,
@@ -430,6 +469,8 @@ class Tutor(BaseAgent):
 
         # Select an action based on the strategy
         selected_action, selected_action_idx, selected_rho = self.strategy.select_act(self.actions, observation)
+        if self.action_ids is not None and selected_action_idx >= 0:
+            selected_action_idx = int(self.action_ids[selected_action_idx])
 
         # Print the selected action, return the results
         print('Action %d results in a forecasted max. rho of %.2f, search duration is %.2fs'
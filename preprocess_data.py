@@ -6,17 +6,22 @@ Created on Thu Jan 27 12:27:45 2022
 @author: matthijs
 """
 
+import argparse
 import auxiliary.util as util
-from data_preprocessing_analysis.imitation_data_preprocessing import process_raw_tutor_data, divide_files_train_val_test
+from data_preprocessing_analysis.imitation_data_preprocessing import process_raw_tutor_data
 
 
 def main():
-    # Preprocess data
-    config = util.load_config()
-    process_raw_tutor_data(config)
+    parser = argparse.ArgumentParser(description='Preprocess the raw tutor data.')
+    parser.add_argument("-w", "--n_workers", help="The number of worker processes used to process the raw " +
+                        "data files.", required=False, default=1, type=int)
+    parser.add_argument("-i", "--incremental", help="Only process the raw data files that are new or changed " +
+                        "since the previous run.", action='store_true')
+    args = parser.parse_args()
 
-    # Divide preprocessed data files over train, val, and test folders
-    divide_files_train_val_test()
+    # Preprocess data, directly into the train, val, and test folders
+    config = util.load_config()
+    process_raw_tutor_data(config, args.n_workers, args.incremental)
 
 
 if __name__ == "__main__":
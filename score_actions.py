@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Score the actions of the action space by replaying the tutor on a sample of
+chronics, and save the resulting ranking of the action space. The ranking
+can be used to restrict the tutor and the validation to the top-K actions.
+"""
+
+import argparse
+import auxiliary.util as util
+from imitation_generation.action_scoring import score_actions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank the action space by offline scoring of the actions.')
+    parser.add_argument("--n_chronics", help="The number of chronics to replay.",
+                        required=False, default=10, type=int)
+    parser.add_argument("--do_nothing_capacity_threshold",  help="The threshold " +
+                        "max. line rho at which the tutor takes actions.",
+                        required=False, default=.97, type=float)
+    parser.add_argument("--disable_line",  help="The index of the line to be disabled.",
+                        required=False, default=-1, type=int)
+    parser.add_argument("--start_chronic_id",  help="The chronic to start with.",
+                        required=False, default=0, type=int)
+    parser.add_argument("--tolerance", help="The relative tolerance w.r.t. the best action within which an " +
+                        "action counts as near-best.", required=False, default=0.02, type=float)
+    args = parser.parse_args()
+
+    config = util.load_config()
+    scorer = score_actions(config,
+                           args.n_chronics,
+                           args.do_nothing_capacity_threshold,
+                           args.disable_line,
+                           args.start_chronic_id,
+                           args.tolerance)
+    scorer.save(config['paths']['action_space'], args.disable_line)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,7 @@ Created on Wed Jan 19 13:01:28 2022
 from training.training import Run
 import argparse
 import auxiliary.util as util
-import training.models
+from training.network_type import NetworkType
 
 def main():
     
@@ -70,7 +70,7 @@ def main():
     if args.label_smoothing_alpha is not None:
         config['training']['hyperparams']['label_smoothing_alpha'] = args.label_smoothing_alpha
     if args.network_type is not None:
-        config['training']['GCN']['hyperparams']['network_type'] = training.models.GCN.NetworkType(
+        config['training']['GCN']['hyperparams']['network_type'] = NetworkType(
             args.network_type
         )
     if args.N_layers is not None:
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Logging to a wandb run from a background thread, so that rendering figures
+and uploading the logs does not block the training.
+"""
+from __future__ import annotations
+from typing import Callable, Optional, TYPE_CHECKING
+import queue
+import threading
+import traceback
+
+if TYPE_CHECKING:
+    import wandb
+
+
+class AsyncRunLogger:
+    """
+    Logs to a wandb run from a background worker thread. Logging requests are
+    put in a bounded queue, so that the training only blocks if the worker
+    falls behind by more than the queue size. The requests are logged in the
+    order in which they are made, so that the steps logged stay increasing.
+
+    Has the same log() method as the run, so that it can be passed wherever a
+    run is logged to.
+    """
+
+    def __init__(self, run: wandb.sdk.wandb_run.Run, max_queue_size: int = 16):
+        """
+        Parameters
+        ----------
+        run : wandb.sdk.wandb_run.Run
+            The run to log to.
+        max_queue_size : int, optional
+            The max. number of pending logging requests. The default is 16.
+        """
+        assert max_queue_size > 0, "The max. queue size should be positive."
+
+        self.run = run
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._work, name='AsyncRunLogger', daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        """
+        Process the logging requests until the stop request (None).
+        """
+        while True:
+            request = self._queue.get()
+            try:
+                if request is None:
+                    return
+                render, step = request
+                self.run.log(render(), step=step)
+            except Exception:
+                # A failed log should not stop the logging of the rest of the training
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def submit(self, render: Callable[[], dict], step: Optional[int] = None):
+        """
+        Request the logging of the output of a function, which is called on
+        the worker thread. The function should only use data that is not
+        modified afterwards, e.g. statistics moved to the host.
+
+        Parameters
+        ----------
+        render : Callable[[], dict]
+            The function, which returns the dictionary to log, e.g. with
+            figures it renders.
+        step : Optional[int], optional
+            The step to log at. The default is None, i.e. the current step
+            of the run.
+        """
+        assert self._thread.is_alive(), "The logger is closed."
+        self._queue.put((render, step))
+
+    def log(self, data: dict, step: Optional[int] = None):
+        """
+        Request the logging of a dictionary.
+
+        Parameters
+        ----------
+        data : dict
+            The dictionary to log.
+        step : Optional[int], optional
+            The step to log at. The default is None, i.e. the current step
+            of the run.
+        """
+        self.submit(lambda: data, step)
+
+    def flush(self):
+        """
+        Wait until all pending logging requests are processed.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Process the pending logging requests, and stop the worker thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
@@ -10,9 +10,12 @@ import os
 import json
 import random
 import data_preprocessing_analysis.imitation_data_preprocessing as idp
-from typing import List, Optional, Type
+from typing import List, Optional, Type, Dict, Tuple, Sequence
 import numpy as np
+from auxiliary.util import NumpyEncoder, hash_file
+import auxiliary.grid2op_util as g2o_util
 from training.models import GCN, FCNN
+from training.network_type import NetworkType
 from abc import ABC, abstractmethod
 
 
@@ -23,21 +26,20 @@ class TutorDataLoader:
 
     def __init__(self,
                  root: str,
-                 matrix_cache_path: str,
                  feature_statistics_path: str,
                  action_counter_path: str,
                  device: torch.device,
                  model_type: Type,
-                 network_type: Optional[GCN.NetworkType],
+                 network_type: Optional[NetworkType],
                  train: bool,
-                 action_frequency_threshold: int = 0):
+                 action_frequency_threshold: int = 0,
+                 sampling_temperature: Optional[float] = None,
+                 connectivity_cache_capacity: int = 10000):
         """
         Parameters
         ----------
         root : str
             The directory where the data files are located.
-        matrix_cache_path : str
-            The path of the matrix cache file.
         feature_statistics_path : str
             The path of the feature statistics file.
         action_counter_path: str
@@ -51,32 +53,98 @@ class TutorDataLoader:
             Whether the loaded data is used for training or validation.
             More information is included in validation.
         action_frequency_threshold : int
-            Minimum frequency of an action in the dataset in order to be
+            Minimum frequency of an action in the training set in order to be
             used during training. Can be used to filter out infrequent actions.
+            The filter is applied once, when building the dataset index.
             Default is zero.
+        sampling_temperature : Optional[float]
+            If None, iterate over all datapoints file by file. Otherwise,
+            draw datapoints with replacement, with probabilities proportional
+            to the inverse frequency of their action raised to this power.
+            A temperature of zero samples uniformly, a temperature of one
+            samples each action equally often. Default is None.
+        connectivity_cache_capacity : int
+            The maximum number of topologies, per grid layout, of which the
+            connectivity matrices are memoized. Default is 10000.
         """
 
-        self._file_names = os.listdir(root)
+        self._file_names = sorted([fn for fn in os.listdir(root)
+                                   if fn.startswith('data_') and fn.endswith('.npz')])
         self._file_paths = [os.path.join(root, fn) for fn in self._file_names]
         with open(feature_statistics_path, 'r') as file:
             feature_statistics = json.loads(file.read())
         with open(action_counter_path, 'r') as file:
             self._action_counter = json.loads(file.read())
+        self._action_counter_hash = hash_file(action_counter_path)
         self.action_frequency_threshold = action_frequency_threshold
 
+        # The index of the datapoints that survive the filters is loaded, or
+        # built, lazily on first use
+        self._index_path = os.path.join(root, DatasetIndex.FILE_NAME)
+        self._index = None
+
+        # The most recently loaded data file, as a tuple of its index and the
+        # file
+        self._cached_file = None
+
+        # The sampler used for weighted sampling is built lazily on first use
+        self.sampling_temperature = sampling_temperature
+        self._sampler = None
+
         if model_type == GCN:
-            assert isinstance(network_type, GCN.NetworkType), 'Invalid network type'
-            matrix_cache = idp.ConMatrixCache.load(matrix_cache_path)
+            assert isinstance(network_type, NetworkType), 'Invalid network type'
             self.process_dp_strategy = ProcessDataPointGCN(device,
                                                            train,
                                                            feature_statistics,
                                                            network_type,
-                                                           matrix_cache)
+                                                           connectivity_cache_capacity)
         elif model_type == FCNN:
             self.process_dp_strategy = ProcessDataPointFCNN(device,
                                                             train,
                                                             feature_statistics)
 
+    @property
+    def index(self) -> 'DatasetIndex':
+        """
+        The index of the datapoints that survive the filters. Loaded from
+        disk on first use, and rebuilt if the data files, the action counter,
+        or the action frequency threshold have changed.
+        """
+        if self._index is None:
+            index = DatasetIndex.load(self._index_path) if os.path.exists(self._index_path) else None
+            if index is None or not index.matches(self._file_paths,
+                                                  self._action_counter_hash,
+                                                  self.action_frequency_threshold):
+                index = DatasetIndex.build(self._file_paths,
+                                           self._action_counter,
+                                           self._action_counter_hash,
+                                           self.action_frequency_threshold)
+                index.save(self._index_path)
+            self._index = index
+        return self._index
+
+    def load_raw_file_datapoints(self, idx: int) -> idp.ProcessedDataFile:
+        """
+        Load the unprocessed datapoints in a particular file. The most
+        recently loaded file is cached, so that subsequent accesses to the
+        same file do not reload it.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the file in the list of file paths.
+
+        Returns
+        -------
+        idp.ProcessedDataFile
+            The file, which can be indexed to obtain its 'raw' datapoints.
+        """
+        if self._cached_file is None or self._cached_file[0] != idx:
+            # 'raw' is not fully true, as these datapoints should already have
+            # been preprocessed
+            self._cached_file = (idx, idp.ProcessedDataFile(self._file_paths[idx]))
+        return self._cached_file[1]
+
     def get_file_datapoints(self, idx: int) -> List[dict]:
         """
         Load the datapoints in a particular file. The file is indexed by an
@@ -92,30 +160,112 @@ class TutorDataLoader:
         processed_datapoints : List[dict]
             The list of datapoints. Each datapoint is a dictionary.
         """
-        # 'raw' is not fully true, as these datapoints should already have been
-        # preprocessed
-        with open(self._file_paths[idx], 'r') as file:
-            raw_datapoints = json.loads(file.read())
+        raw_datapoints = self.load_raw_file_datapoints(idx)
 
         processed_datapoints = []
-        for raw_dp in raw_datapoints:
-
-            # skip datapoints that occur too infrequently in the dataset
-            act_freq = self._action_counter[str(raw_dp['act_hash'])]
-            if act_freq < self.action_frequency_threshold:
-                continue
-
+        # Only the datapoints in the index survived the filters (such as the
+        # action frequency threshold)
+        for offset in self.index.offsets_per_file().get(idx, []):
             # process datapoint
-            dp = self.process_dp_strategy.process_datapoint(raw_dp)
+            dp = self.process_dp_strategy.process_datapoint(raw_datapoints[offset])
 
             # add processed datapoint to file list
             processed_datapoints.append(dp)
 
         return processed_datapoints
 
+    def __len__(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The number of datapoints that survive the filters.
+        """
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> dict:
+        """
+        Random access to a single datapoint by its position in the dataset
+        index. Accessing datapoints in index order is efficient, as the
+        datapoints in a file are stored contiguously in the index.
+
+        Parameters
+        ----------
+        i : int
+            The position of the datapoint in the dataset index.
+
+        Returns
+        -------
+        dp : dict
+            The processed datapoint.
+        """
+        if not -len(self) <= i < len(self):
+            raise IndexError('Datapoint index out of range.')
+        file_id, offset = self.index.file_ids[i], self.index.offsets[i]
+        raw_dp = self.load_raw_file_datapoints(int(file_id))[int(offset)]
+        return self.process_dp_strategy.process_datapoint(raw_dp)
+
+    def stratified_subsample(self, fraction: float, seed: int = 0) -> np.array:
+        """
+        Draw a subsample of the datapoints, stratified by action: of each
+        action, a fraction of its datapoints (rounded up, so at least one) is
+        drawn without replacement.
+
+        Parameters
+        ----------
+        fraction : float
+            The fraction of the datapoints per action to draw. Should be in
+            range (0,1].
+        seed : int, optional
+            The seed of the draw. The default is 0.
+
+        Returns
+        -------
+        np.array
+            The positions of the drawn datapoints in the dataset index, in
+            increasing order.
+        """
+        assert 0 < fraction <= 1, "Fraction should be in range (0,1]."
+        _, inverse, counts = np.unique(self.index.act_hashes, return_inverse=True, return_counts=True)
+
+        # Order the datapoints by action, and randomly within each action.
+        # Keep the first datapoints of each action
+        order = np.lexsort((np.random.default_rng(seed).random(len(inverse)), inverse))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank_in_action = np.arange(len(order)) - np.repeat(starts, counts)
+        keep = rank_in_action < np.repeat(np.ceil(fraction * counts).astype(int), counts)
+        return np.sort(order[keep])
+
+    @property
+    def sampler(self) -> 'AliasSampler':
+        """
+        The sampler over the dataset index used for weighted sampling. The
+        weight of a datapoint is the inverse frequency of its action, raised
+        to the power of the sampling temperature.
+        """
+        if self._sampler is None:
+            act_hashes, inverse = np.unique(self.index.act_hashes, return_inverse=True)
+            act_freqs = np.array([self._action_counter.get(str(h), 0) for h in act_hashes], dtype=np.float64)
+            # Actions not in the training set are weighted as if seen once
+            self._sampler = AliasSampler(np.maximum(act_freqs, 1)[inverse] ** -self.sampling_temperature)
+        return self._sampler
+
+    @property
+    def connectivity_hit_rate(self) -> Optional[float]:
+        """
+        The fraction of the connectivity matrix requests, over all grid
+        layouts, served from the connectivity caches. None if the datapoints
+        are not processed for a GCN.
+        """
+        if not isinstance(self.process_dp_strategy, ProcessDataPointGCN):
+            return None
+        return self.process_dp_strategy.connectivity_hit_rate
+
     def __iter__(self, shuffle: bool = True) -> dict:
         """
-        Iterate over the datapoints.
+        Iterate over the datapoints. If a sampling temperature is set, iterate
+        over a weighted sample (with replacement) of the size of the dataset
+        instead.
 
         Parameters
         ----------
@@ -129,7 +279,12 @@ class TutorDataLoader:
             The datapoint.
 
         """
-        file_idxs = list(range(len(self._file_paths)))
+        if self.sampling_temperature is not None:
+            yield from self._iter_weighted_sample()
+            return
+
+        # Files without any datapoints in the index need not be loaded
+        file_idxs = sorted(self.index.offsets_per_file().keys())
         if shuffle:
             random.shuffle(file_idxs)
 
@@ -138,6 +293,296 @@ class TutorDataLoader:
             for i, dp in enumerate(datapoints):
                 yield dp
 
+    def _iter_weighted_sample(self) -> dict:
+        """
+        Iterate over a weighted sample of datapoints, drawn with the alias
+        sampler. The sampled datapoints are grouped by file, so that each
+        file is loaded at most once; the order of the files and of the
+        datapoints within the files is shuffled.
+
+        Yields
+        ------
+        dp : dict
+            The datapoint.
+        """
+        rng = np.random.default_rng(random.getrandbits(64))
+        sample = self.sampler.sample(len(self), rng)
+
+        # Group the sampled positions in the index by file
+        sample = sample[np.argsort(self.index.file_ids[sample], kind='stable')]
+        file_ids, starts = np.unique(self.index.file_ids[sample], return_index=True)
+        groups = np.split(sample, starts[1:])
+
+        for g in rng.permutation(len(groups)):
+            raw_datapoints = self.load_raw_file_datapoints(int(file_ids[g]))
+            for i in rng.permutation(groups[g]):
+                raw_dp = raw_datapoints[int(self.index.offsets[i])]
+                yield self.process_dp_strategy.process_datapoint(raw_dp)
+
+
+class AliasSampler:
+    """
+    Samples indices from a discrete distribution in constant time per sample,
+    using Vose's alias method. Building the alias table takes linear time.
+    """
+
+    def __init__(self, weights: np.array):
+        """
+        Parameters
+        ----------
+        weights : np.array
+            The non-negative (unnormalized) weight of each index. Should have
+            a positive sum.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        assert weights.ndim == 1 and len(weights) > 0, "Weights should be a non-empty vector."
+        assert (weights >= 0).all() and weights.sum() > 0, "Weights should be non-negative with a positive sum."
+
+        n = len(weights)
+        prob = weights * n / weights.sum()
+        alias = np.arange(n)
+
+        # Pair each underfull bucket with an overfull bucket that tops it up
+        small = np.flatnonzero(prob < 1).tolist()
+        large = np.flatnonzero(prob >= 1).tolist()
+        while small and large:
+            s, l = small.pop(), large.pop()
+            alias[s] = l
+            prob[l] -= 1 - prob[s]
+            (small if prob[l] < 1 else large).append(l)
+        # Remaining buckets are full, up to numerical error
+        prob[small + large] = 1
+
+        self.prob = prob
+        self.alias = alias
+
+    def __len__(self) -> int:
+        return len(self.prob)
+
+    def sample(self, size: int, rng: np.random.Generator) -> np.array:
+        """
+        Draw indices with replacement.
+
+        Parameters
+        ----------
+        size : int
+            The number of indices to draw.
+        rng : np.random.Generator
+            The random number generator.
+
+        Returns
+        -------
+        np.array
+            The drawn indices.
+        """
+        buckets = rng.integers(len(self), size=size)
+        return np.where(rng.random(size) < self.prob[buckets], buckets, self.alias[buckets])
+
+
+class DatasetIndex:
+    """
+    Index of the datapoints, in a directory of processed data files, that
+    survive the filters applied during loading (i.e. the action frequency
+    threshold). Each entry consists of the index of a file and the offset of
+    the datapoint in that file.
+
+    Applying the filters requires a pass over all data files. Hence, the index
+    is built once and stored alongside the data files, and only rebuilt when
+    the data files, the action counter, or the filters change.
+    """
+
+    FILE_NAME = 'dataset_index.json'
+    VERSION = 3
+
+    def __init__(self,
+                 file_stamps: List[Tuple[str, int, int]],
+                 action_counter_hash: str,
+                 action_frequency_threshold: int,
+                 file_ids: np.array,
+                 offsets: np.array,
+                 act_hashes: np.array):
+        """
+        Parameters
+        ----------
+        file_stamps : List[Tuple[str, int, int]]
+            The name, size, and modification time (in ns) of each indexed
+            data file. Used to detect whether the data files have changed.
+        action_counter_hash : str
+            The hash of the action counter file used when building the index.
+            Used to detect whether the action counter has changed.
+        action_frequency_threshold : int
+            The action frequency threshold applied when building the index.
+        file_ids : np.array
+            For each datapoint in the index, the index of its file.
+        offsets : np.array
+            For each datapoint in the index, its offset in the file.
+        act_hashes : np.array
+            For each datapoint in the index, the hash of its action.
+        """
+        self.file_stamps = [tuple(s) for s in file_stamps]
+        self.action_counter_hash = action_counter_hash
+        self.action_frequency_threshold = action_frequency_threshold
+        self.file_ids = np.asarray(file_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.act_hashes = np.asarray(act_hashes, dtype=np.int64)
+        self._offsets_per_file = None
+
+    @staticmethod
+    def get_file_stamps(file_paths: Sequence[str]) -> List[Tuple[str, int, int]]:
+        """
+        Get the name, size, and modification time of each file.
+
+        Parameters
+        ----------
+        file_paths : Sequence[str]
+            The paths of the files.
+
+        Returns
+        -------
+        List[Tuple[str, int, int]]
+            The name, size, and modification time (in ns) of each file.
+        """
+        stamps = []
+        for fp in file_paths:
+            stat = os.stat(fp)
+            stamps.append((os.path.basename(fp), stat.st_size, stat.st_mtime_ns))
+        return stamps
+
+    @classmethod
+    def build(cls,
+              file_paths: Sequence[str],
+              action_counter: Dict[str, int],
+              action_counter_hash: str,
+              action_frequency_threshold: int):
+        """
+        Factory method: build the index by passing over the data files once.
+
+        Parameters
+        ----------
+        file_paths : Sequence[str]
+            The paths of the data files.
+        action_counter : Dict[str, int]
+            The frequency of each action hash in the training set. Actions
+            missing from it have a frequency of zero.
+        action_counter_hash : str
+            The hash of the action counter file, see auxiliary.util.hash_file().
+        action_frequency_threshold : int
+            Minimum frequency of an action in the training set in order for a
+            datapoint with that action to be included in the index.
+        """
+        file_ids, offsets, act_hashes = [], [], []
+        for file_id, fp in enumerate(file_paths):
+            with np.load(fp) as file:
+                file_act_hashes = file['act_hash']
+
+            # skip datapoints that occur too infrequently in the dataset
+            act_freqs = np.array([action_counter.get(str(h), 0) for h in file_act_hashes.tolist()])
+            file_offsets = np.flatnonzero(act_freqs >= action_frequency_threshold)
+
+            file_ids.append(np.full(len(file_offsets), file_id))
+            offsets.append(file_offsets)
+            act_hashes.append(file_act_hashes[file_offsets])
+
+        return cls(cls.get_file_stamps(file_paths),
+                   action_counter_hash,
+                   action_frequency_threshold,
+                   np.concatenate(file_ids) if file_ids else [],
+                   np.concatenate(offsets) if offsets else [],
+                   np.concatenate(act_hashes) if act_hashes else [])
+
+    def matches(self,
+                file_paths: Sequence[str],
+                action_counter_hash: str,
+                action_frequency_threshold: int) -> bool:
+        """
+        Check whether the index is still valid for a set of data files, action
+        counter, and filters.
+
+        Parameters
+        ----------
+        file_paths : Sequence[str]
+            The paths of the data files.
+        action_counter_hash : str
+            The hash of the action counter file.
+        action_frequency_threshold : int
+            The action frequency threshold.
+
+        Returns
+        -------
+        bool
+            Whether the index was built from the same data files with the same
+            action counter and filters.
+        """
+        return self.action_frequency_threshold == action_frequency_threshold and \
+            self.action_counter_hash == action_counter_hash and \
+            self.file_stamps == self.get_file_stamps(file_paths)
+
+    def offsets_per_file(self) -> Dict[int, List[int]]:
+        """
+        Group the offsets in the index by file. The grouping is computed once.
+
+        Returns
+        -------
+        Dict[int, List[int]]
+            Dictionary from the index of a file to the offsets of the indexed
+            datapoints in that file.
+        """
+        if self._offsets_per_file is None:
+            self._offsets_per_file = {}
+            for file_id, offset in zip(self.file_ids.tolist(), self.offsets.tolist()):
+                self._offsets_per_file.setdefault(file_id, []).append(offset)
+        return self._offsets_per_file
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def save(self, fpath: str):
+        """
+        Save the index as a json file.
+
+        Parameters
+        ----------
+        fpath : str
+            Where to store the json file.
+        """
+        with open(fpath, 'w') as outfile:
+            json.dump({'version': self.VERSION,
+                       'file_stamps': self.file_stamps,
+                       'action_counter_hash': self.action_counter_hash,
+                       'action_frequency_threshold': self.action_frequency_threshold,
+                       'file_ids': self.file_ids,
+                       'offsets': self.offsets,
+                       'act_hashes': self.act_hashes},
+                      outfile,
+                      cls=NumpyEncoder)
+
+    @classmethod
+    def load(cls, fpath: str):
+        """
+        Factory method: initialize a DatasetIndex based on a file.
+
+        Parameters
+        ----------
+        fpath : str
+            The filepath of the file.
+
+        Returns
+        -------
+        Optional[DatasetIndex]
+            The index. None if the file was written by another version of the
+            index format.
+        """
+        with open(fpath, 'r') as file:
+            index_dict = json.loads(file.read())
+        if index_dict.get('version') != cls.VERSION:
+            return None
+        return cls(index_dict['file_stamps'],
+                   index_dict['action_counter_hash'],
+                   index_dict['action_frequency_threshold'],
+                   index_dict['file_ids'],
+                   index_dict['offsets'],
+                   index_dict['act_hashes'])
+
 
 class ProcessDataPointStrategy(ABC):
     """
@@ -220,9 +665,12 @@ class ProcessDataPointStrategy(ABC):
                 The processed datapoint with the processed evaluation information added.
         """
         dp['line_disabled'] = raw_dp['line_disabled']
+        dp['dis_line_tv'] = (raw_dp['dis_line_or_tv'], raw_dp['dis_line_ex_tv'])
         dp['topo_vect'] = torch.tensor(raw_dp['topo_vect'],
                                        device=self.device,
                                        dtype=torch.long)
+        # Key of the topology vector, computed on the host, used to memoise the 'change' action spaces
+        dp['topo_vect_key'] = np.asarray(raw_dp['topo_vect'], dtype=np.int8).tobytes()
         return dp
 
 
@@ -235,8 +683,8 @@ class ProcessDataPointGCN(ProcessDataPointStrategy):
                  device: torch.device,
                  train: bool,
                  feature_statistics: dict,
-                 network_type: GCN.NetworkType,
-                 matrix_cache: idp.ConMatrixCache):
+                 network_type: NetworkType,
+                 connectivity_cache_capacity: int = 10000):
         """
         Parameters
         ----------
@@ -248,10 +696,51 @@ class ProcessDataPointGCN(ProcessDataPointStrategy):
             Dictionary with information (mean, std) used to normalize features.
         network_type : NetworkType
             The type of the GCN network.
+        connectivity_cache_capacity : int, optional
+            The maximum number of topologies, per grid layout, of which the
+            connectivity matrices are memoized. The default is 10000.
         """
         super().__init__(device, train, feature_statistics)
         self.network_type = network_type
-        self.matrix_cache = matrix_cache
+        self.connectivity_cache_capacity = connectivity_cache_capacity
+
+        # The connectivity providers, per line disabled, are created when the
+        # first datapoint of that grid layout is processed
+        self.connectivity_providers = {}
+
+    def get_connectivity_provider(self, raw_dp: dict) -> g2o_util.ConnectivityProvider:
+        """
+        Get the connectivity provider for the grid layout of a datapoint.
+
+        Parameters
+        ----------
+        raw_dp : dict
+            The 'raw' datapoint.
+
+        Returns
+        -------
+        g2o_util.ConnectivityProvider
+            The connectivity provider.
+        """
+        line_disabled = int(raw_dp['line_disabled'])
+        if line_disabled not in self.connectivity_providers:
+            self.connectivity_providers[line_disabled] = \
+                g2o_util.ConnectivityProvider(raw_dp['sub_info'],
+                                              raw_dp['line_or_pos_topo_vect'],
+                                              raw_dp['line_ex_pos_topo_vect'],
+                                              self.connectivity_cache_capacity)
+        return self.connectivity_providers[line_disabled]
+
+    @property
+    def connectivity_hit_rate(self) -> float:
+        """
+        The fraction of the connectivity matrix requests, over all grid
+        layouts, served from the caches of the connectivity providers. Zero
+        if there were no requests.
+        """
+        hits = sum(p.hits for p in self.connectivity_providers.values())
+        n_requests = hits + sum(p.misses for p in self.connectivity_providers.values())
+        return hits / n_requests if n_requests else 0.0
 
     def process_datapoint(self, raw_dp: dict):
         """
@@ -308,15 +797,15 @@ class ProcessDataPointGCN(ProcessDataPointStrategy):
                                          device=self.device,
                                          dtype=torch.float)
 
-        # Load the connectivity matrix, combine the edges for the specified
+        # Compute the connectivity matrix, combine the edges for the specified
         # network type
         same_busbar_e, other_busbar_e, line_e = \
-            self.matrix_cache.con_matrices[str(raw_dp['cm_index'])][1]
-        if self.network_type == GCN.NetworkType.HOMO:
+            self.get_connectivity_provider(raw_dp).get(raw_dp['topo_vect'])
+        if self.network_type == NetworkType.HOMO:
             dp['edges'] = torch.tensor(np.append(same_busbar_e, line_e, axis=1),
                                        device=self.device,
                                        dtype=torch.long)
-        elif self.network_type == GCN.NetworkType.HETERO:
+        elif self.network_type == NetworkType.HETERO:
             dp['edges'] = {('object', 'line', 'object'):
                                torch.tensor(line_e,
                                             device=self.device,
@@ -373,6 +862,10 @@ class ProcessDataPointFCNN(ProcessDataPointStrategy):
         dp : dict
             The resulting datapoint.
         """
+        # The input size of the FCNN is fixed to the layout without disabled
+        # lines
+        assert raw_dp['line_disabled'] == -1, "The FCNN only supports datapoints without a disabled line."
+
         dp = {}
 
         # Add the label
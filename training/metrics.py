@@ -5,9 +5,13 @@ Created on Thu Oct 28 08:11:12 2021
 
 @author: matthijs
 """
-from typing import Optional, Dict, Callable, List, Tuple
+from __future__ import annotations
+from typing import Optional, Dict, Callable, List, Tuple, TYPE_CHECKING
 import torch
-import wandb
+import numpy as np
+
+if TYPE_CHECKING:
+    import wandb
 
 
 class IncrementalAverage:
@@ -96,7 +100,7 @@ class IncrementalAverageMetrics:
         Parameters
         ----------
         run : wandb.sdk.wandb_run.Run
-            The run to log to.
+            The run to log to. Can also be an AsyncRunLogger of the run.
         step : int
             The current step in the run.
         """
@@ -120,6 +124,169 @@ class IncrementalAverageMetrics:
         return '\n'.join([f'{n}: {v}' for n, v in self.get_values()])
 
 
+class ValidationAnalysis:
+    """
+    A class for accumulating the statistics of the advanced validation
+    analysis. The statistics are accumulated per batch in tensors on the
+    device, and only moved to the host once, when they are retrieved.
+    """
+
+    def __init__(self, n_subs: int, device: torch.device):
+        """
+        Parameters
+        ----------
+        n_subs : int
+            The number of substations.
+        device : torch.device
+            The device to accumulate the statistics on.
+        """
+        self.n_classes = n_subs + 1
+        self.device = device
+
+        # Confusion counts of the true/predicted substations. Index 0 represents no substation
+        self.sub_conf_counts = torch.zeros(self.n_classes ** 2, dtype=torch.long, device=device)
+
+        # Distributions of the true/predicted/postprocessed predicted objects, allocated when the number of
+        # objects is known
+        self.Y_obs = self.P_obs = self.nearest_valid_P_obs = None
+        self._hash_weights = None
+
+        # Per batch, the ranks of the true actions in the list of valid actions sorted by nearness to the
+        # predicted actions, the hashes of the labels and topology vectors, and whether the
+        # classifications are correct
+        self.Y_ranks = []
+        self.label_hashes = []
+        self.topovect_hashes = []
+        self.correct = []
+
+    def hash_rows(self, X: torch.Tensor) -> torch.Tensor:
+        """
+        Hash the rows of an integer-valued tensor to integer ids, by a
+        weighted sum with fixed random 64-bit weights that wraps around on
+        overflow.
+
+        Parameters
+        ----------
+        X : torch.Tensor
+            The tensor, with shape (B, N_OBJECTS). Elements should be
+            integer-valued, in range [-2, 2].
+
+        Returns
+        -------
+        torch.Tensor[int]
+            The hash per row, with shape (B,).
+        """
+        if self._hash_weights is None:
+            generator = torch.Generator().manual_seed(0)
+            self._hash_weights = torch.randint(-2 ** 62, 2 ** 62, (X.shape[1],), dtype=torch.long,
+                                               generator=generator).to(self.device)
+        return ((X.long() + 3) * self._hash_weights).sum(dim=1)
+
+    def update(self,
+               Y: torch.Tensor,
+               P: torch.Tensor,
+               nearest_valid_P: torch.Tensor,
+               topo_vect: torch.Tensor,
+               Y_sub_mask: torch.Tensor,
+               Y_subs: torch.Tensor,
+               P_subs: torch.Tensor,
+               Y_ranks: torch.Tensor):
+        """
+        Update the statistics with a batch of datapoints. All tensors with
+        objects should have the full layout of the topology vector, i.e.
+        include the objects of disabled lines.
+
+        Parameters
+        ----------
+        Y : torch.Tensor[float]
+            The labels, with shape (B, N_OBJECTS).
+        P : torch.Tensor[float]
+            The predictions, with shape (B, N_OBJECTS).
+        nearest_valid_P : torch.Tensor[float]
+            The valid actions nearest to the predictions, with shape
+            (B, N_OBJECTS).
+        topo_vect : torch.Tensor
+            The topology vectors, with shape (B, N_OBJECTS).
+        Y_sub_mask : torch.Tensor[float]
+            The masks of the objects of the true changed substations, with
+            shape (B, N_OBJECTS).
+        Y_subs : torch.Tensor[int]
+            The true changed substations, with shape (B,). -1 if none.
+        P_subs : torch.Tensor[int]
+            The predicted changed substations, with shape (B,). -1 if none.
+        Y_ranks : torch.Tensor[int]
+            The ranks of the labels, with shape (B,).
+        """
+        self.sub_conf_counts += torch.bincount((Y_subs + 1) * self.n_classes + (P_subs + 1),
+                                               minlength=self.n_classes ** 2)
+
+        if self.Y_obs is None:
+            self.Y_obs = torch.zeros(Y.shape[1], device=self.device)
+            self.P_obs = torch.zeros(Y.shape[1], device=self.device)
+            self.nearest_valid_P_obs = torch.zeros(Y.shape[1], device=self.device)
+        self.Y_obs += Y.sum(dim=0)
+        self.P_obs += (P > 0.5).sum(dim=0)
+        self.nearest_valid_P_obs += nearest_valid_P.sum(dim=0)
+
+        self.Y_ranks.append(Y_ranks)
+        self.label_hashes.append(self.hash_rows(Y * Y_sub_mask))
+        self.topovect_hashes.append(self.hash_rows(topo_vect))
+        self.correct.append(torch.all(nearest_valid_P == torch.round(Y), dim=1))
+
+    def sub_confusion_matrix(self) -> np.array:
+        """
+        Returns
+        -------
+        np.array
+            The confusion matrix of the true (rows) and predicted (columns)
+            substations. Index 0 represents no substation.
+        """
+        return self.sub_conf_counts.reshape(self.n_classes, self.n_classes).cpu().numpy()
+
+    def object_distributions(self) -> Tuple[np.array, np.array, np.array]:
+        """
+        Returns
+        -------
+        Tuple[np.array, np.array, np.array]
+            The number of times each object is changed in the labels, in the
+            postprocessed predictions, and in the predictions.
+        """
+        return self.Y_obs.cpu().numpy(), self.nearest_valid_P_obs.cpu().numpy(), self.P_obs.cpu().numpy()
+
+    def ranks(self) -> np.array:
+        """
+        Returns
+        -------
+        np.array
+            The ranks of the true actions in the list of valid actions sorted
+            by nearness to the predicted actions.
+        """
+        return torch.cat(self.Y_ranks).cpu().numpy()
+
+    def correct_wrong_counts(self, hashes: List[torch.Tensor]) -> Tuple[np.array, np.array]:
+        """
+        Count the number of correct and wrong classifications per unique
+        hash.
+
+        Parameters
+        ----------
+        hashes : List[torch.Tensor]
+            Per batch, the hashes of the datapoints, e.g. self.label_hashes.
+
+        Returns
+        -------
+        Tuple[np.array, np.array]
+            The number of correct and wrong classifications per unique hash,
+            ordered by decreasing number of datapoints.
+        """
+        _, inverse = torch.unique(torch.cat(hashes), return_inverse=True)
+        correct = torch.cat(self.correct)
+        total = torch.bincount(inverse)
+        n_correct = torch.bincount(inverse[correct], minlength=len(total))
+        order = torch.argsort(total, descending=True, stable=True)
+        return n_correct[order].cpu().numpy(), (total - n_correct)[order].cpu().numpy()
+
+
 def macro_accuracy(**kwargs: dict) -> bool:
     """
     Calculates whether the predicted output wholly matches the true output.
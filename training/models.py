@@ -8,7 +8,7 @@ Created on Fri Jan 14 12:11:43 2022
 import torch
 from torch_geometric.nn import SAGEConv, Linear, HeteroConv
 from typing import Dict, List
-from enum import Enum, unique
+from training.network_type import NetworkType
 
 
 class GCN(torch.nn.Module):
@@ -18,10 +18,7 @@ class GCN(torch.nn.Module):
     features into a common embedding; and a number of GCN layers.
     """
 
-    @unique
-    class NetworkType(Enum):
-        HETERO = 'heterogeneous'
-        HOMO = 'homogeneous'
+    NetworkType = NetworkType
 
     def __init__(self,
                  LReLu_neg_slope: float,
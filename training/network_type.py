@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The network types of the GCN model. Kept separate from training.models, so
+that the network type can be resolved (e.g. when loading the config) without
+importing torch and torch_geometric.
+"""
+from enum import Enum, unique
+
+
+@unique
+class NetworkType(Enum):
+    HETERO = 'heterogeneous'
+    HOMO = 'homogeneous'
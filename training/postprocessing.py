@@ -6,96 +6,439 @@ Created on Thu Jan 27 10:04:10 2022
 @author: matthijs
 """
 
-from typing import Sequence, Tuple, Optional
+from typing import Tuple, Optional, Sequence
+from collections import OrderedDict
 import torch
-from auxiliary.generate_action_space import get_env_actions
+import numpy as np
+from auxiliary.generate_action_space import load_set_action_space, load_action_ranking
 import auxiliary.grid2op_util as g2o_util
 import auxiliary.util as util
 
+# Tolerance on the distances when ranking labels, so that rounding errors do
+# not count the label as nearer than itself
+DIST_TOLERANCE = 1e-5
+
 
 class ActSpaceCache:
     """
     Class for storing the action spaces per line removed, so to make
-    retrieving the action spaces more efficient.
+    retrieving the action spaces more efficient. The action space of a line
+    removed is created on first use, in the layout of the topology vector with
+    the objects of the removed line deleted.
 
-    Supports functionality for finding the valid actions nearest to a
-    predicted action.
+    Supports functionality for finding the valid actions nearest to a batch
+    of predicted actions. The busbar indicators of the action spaces used for
+    this are kept per line removed and device. Since topologies repeat
+    heavily, which actions change anything in a topology (i.e. which rows
+    form its 'change' action space) is memoised per line removed and topology
+    vector, in a least recently used cache on the device it is used on.
     """
 
-    def __init__(self, line_outages_considered: Sequence[int] = [-1]):
+    def __init__(self, action_space_path: str, top_k: Optional[int] = None, capacity: int = 1000):
         """
         Parameters
         ----------
-        line_outages_considered : Sequence[int], optional
-            For which lines removed to store the action space.
-            -1 in this list represent no line removed. The default is [-1].
+        action_space_path : str
+            The directory of the action space files.
+        top_k : Optional[int], optional
+            If given, the action spaces are restricted to the top_k actions
+            of their ranking, as created by score_actions.py. The default is
+            None, i.e. the full action spaces.
+        capacity : int, optional
+            The max. number of topologies of which the 'change' action spaces
+            are memoised. Zero disables memoisation. The default is 1000.
         """
+        assert top_k is None or top_k > 0, "Top_k should be positive."
+        assert capacity >= 0, "Capacity cannot be negative."
+        self.action_space_path = action_space_path
+        self.top_k = top_k
+        self.capacity = capacity
         self.set_act_space_per_lo = {}
-        for lo in line_outages_considered:
-            self.set_act_space_per_lo[lo] = torch.tensor(
-                [a._set_topo_vect for a in get_env_actions(lo)])
-
-    def get_change_actspace_by_nearness_pred(self,
-                                             line_disabled: int,
-                                             topo_vect: torch.Tensor,
-                                             P: torch.Tensor,
-                                             device: torch.device) -> torch.Tensor:
+        self.set_act_space_per_lo_device = {}
+        self.bus_act_space_per_lo_device = {}
+        self._changing_actions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_set_act_space(self, line_disabled: int,
+                          dis_line_tv: Tuple[int, int] = (-1, -1)) -> torch.Tensor:
+        """
+        Get the 'set' action space for a line removed, loading it from the
+        action space file if it isn't loaded yet.
+
+        Parameters
+        ----------
+        line_disabled : int
+            The line disabled. -1 represent no line disabled.
+        dis_line_tv : Tuple[int, int], optional
+            The indices, in the full topology vector, of the disabled line
+            origin and extremity. The default is (-1, -1), i.e. no line
+            disabled.
+
+        Returns
+        -------
+        torch.Tensor
+            The 'set' action space, with shape (N_ACTIONS, N_OBJECTS). The
+            objects of the disabled line are not included.
+        """
+        if line_disabled not in self.set_act_space_per_lo:
+            set_act_space = load_set_action_space(self.action_space_path, line_disabled)
+            if self.top_k is not None:
+                # Keep the order of the full action space
+                set_act_space = set_act_space[np.sort(load_action_ranking(self.action_space_path, line_disabled,
+                                                                          self.top_k))]
+            set_act_space = torch.tensor(np.array(set_act_space))
+            if line_disabled != -1:
+                # Remove the objects of the disabled line from the actions
+                assert dis_line_tv[0] != -1, "The objects of the disabled line should be specified."
+                keep = torch.ones(set_act_space.shape[1], dtype=torch.bool)
+                keep[list(dis_line_tv)] = False
+                set_act_space = set_act_space[:, keep]
+            self.set_act_space_per_lo[line_disabled] = set_act_space
+        return self.set_act_space_per_lo[line_disabled]
+
+    def get_set_act_space_on(self, line_disabled: int, device: torch.device,
+                             dis_line_tv: Tuple[int, int] = (-1, -1)) -> torch.Tensor:
+        """
+        Get the 'set' action space for a line removed on a device, keeping it
+        on that device.
+
+        Parameters
+        ----------
+        line_disabled : int
+            The line disabled. -1 represent no line disabled.
+        device : torch.device
+            What device to load the action space on.
+        dis_line_tv : Tuple[int, int], optional
+            The indices, in the full topology vector, of the disabled line
+            origin and extremity. The default is (-1, -1), i.e. no line
+            disabled.
+
+        Returns
+        -------
+        torch.Tensor
+            The 'set' action space, with shape (N_ACTIONS, N_OBJECTS).
+        """
+        if (line_disabled, str(device)) not in self.set_act_space_per_lo_device:
+            self.set_act_space_per_lo_device[(line_disabled, str(device))] = \
+                self.get_set_act_space(line_disabled, dis_line_tv).to(device)
+        return self.set_act_space_per_lo_device[(line_disabled, str(device))]
+
+    def get_bus_act_space_on(self, line_disabled: int, device: torch.device, dtype: torch.dtype,
+                             dis_line_tv: Tuple[int, int] = (-1, -1)) -> torch.Tensor:
+        """
+        Get the busbar indicators of the 'set' action space for a line removed
+        on a device, as used by nearest_change_actions_batch(): per action,
+        [S == 1, S == 2]. Kept per line removed, device, and dtype.
+
+        Parameters
+        ----------
+        line_disabled : int
+            The line disabled. -1 represent no line disabled.
+        device : torch.device
+            What device to load the busbar indicators on.
+        dtype : torch.dtype
+            The dtype of the busbar indicators, which should be the dtype of
+            the predictions.
+        dis_line_tv : Tuple[int, int], optional
+            The indices, in the full topology vector, of the disabled line
+            origin and extremity. The default is (-1, -1), i.e. no line
+            disabled.
+
+        Returns
+        -------
+        torch.Tensor
+            The busbar indicators, with shape (N_ACTIONS, 2 * N_OBJECTS).
+            Elements are in {0,1}.
+        """
+        key = (line_disabled, str(device), dtype)
+        if key not in self.bus_act_space_per_lo_device:
+            set_act_space = self.get_set_act_space_on(line_disabled, device, dis_line_tv)
+            self.bus_act_space_per_lo_device[key] = \
+                torch.cat([set_act_space == 1, set_act_space == 2], dim=1).to(dtype)
+        return self.bus_act_space_per_lo_device[key]
+
+    def get_changing_actions(self,
+                             line_disabled: int,
+                             topo_vects: torch.Tensor,
+                             topo_keys: Sequence[bytes],
+                             device: torch.device,
+                             dis_line_tv: Tuple[int, int] = (-1, -1)) -> torch.Tensor:
         """
-        Given a prediction from the model:
-            (1) compute the corresponding 'change' action space
-            (2) order the corresponding 'change' action space based on the
-            nearness to the prediction.
+        Get, per topology vector, which 'set' actions change any object, i.e.
+        the rows of the 'set' action space that form its 'change' action
+        space. Memoised per line removed and topology vector.
+
+        Parameters
+        ----------
+        line_disabled : int
+            The line disabled. -1 represent no line disabled.
+        topo_vects : torch.Tensor[int]
+            The current topology vectors, with shape (B, N_OBJECTS). Should
+            have elements in {1,2}. Should exclude the objects of the
+            disabled line.
+        topo_keys : Sequence[bytes]
+            Per topology vector, a key identifying it, computed on the host
+            (see ProcessDataPointStrategy.add_val_info()), so that looking up
+            the cache does not synchronise with the device.
+        device : torch.device
+            What device to load the data structures on.
+        dis_line_tv : Tuple[int, int], optional
+            The indices, in the full topology vector, of the disabled line
+            origin and extremity. The default is (-1, -1), i.e. no line
+            disabled.
+
+        Returns
+        -------
+        torch.Tensor[bool]
+            Whether each action changes any object, with shape
+            (B, N_ACTIONS).
+        """
+        keys = [(line_disabled, str(device), topo_key) for topo_key in topo_keys]
+        missing = {}
+        for i, key in enumerate(keys):
+            if key in self._changing_actions:
+                self.hits += 1
+                self._changing_actions.move_to_end(key)
+            else:
+                self.misses += 1
+                missing.setdefault(key, i)
+
+        # Compute the missing topologies with a single GEMM
+        computed = {}
+        if missing:
+            A = self.get_bus_act_space_on(line_disabled, device, torch.float, dis_line_tv)
+            missing_tvs = topo_vects[list(missing.values())].to(device)
+            T = torch.cat([missing_tvs == 2, missing_tvs == 1], dim=1).float()
+            computed = dict(zip(missing, (T @ A.T) > 0.5))
+
+        changing = torch.stack([computed[key] if key in computed else self._changing_actions[key]
+                                for key in keys])
+        if self.capacity > 0:
+            for key, row in computed.items():
+                self._changing_actions[key] = row
+                if len(self._changing_actions) > self.capacity:
+                    self._changing_actions.popitem(last=False)
+        return changing
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of 'change' action space lookups served from the cache.
+        Zero if there were no lookups.
+        """
+        n_lookups = self.hits + self.misses
+        return self.hits / n_lookups if n_lookups else 0.0
+
+    def get_nearest_change_actions_batch(self,
+                                         line_disabled: int,
+                                         topo_vects: torch.Tensor,
+                                         P: torch.Tensor,
+                                         device: torch.device,
+                                         Y: Optional[torch.Tensor] = None,
+                                         dis_line_tv: Tuple[int, int] = (-1, -1),
+                                         topo_keys: Optional[Sequence[bytes]] = None,
+                                         k: int = 1) \
+            -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Given predictions from the model for datapoints with the same line
+        disabled, find per datapoint the k 'change' actions nearest to the
+        prediction, by L1 distance. Optionally, also compute the rank of the
+        label among all 'change' actions, as the number of actions strictly
+        nearer to the prediction than the label. See
+        nearest_change_actions_batch().
 
         Parameters
         ----------
         line_disabled : int
             The line disabled, used to index the correct action space.
             -1 represent the action space with no line disabled.
-        topo_vect : torch.Tensor[int]
-            The current topoly vector. Should have elements in {1,2}.
-            Used to compute the 'change' action space. Should have a length
-            corresponding to the number of objects in the network.
+        topo_vects : torch.Tensor[int]
+            The current topology vectors, with shape (B, N_OBJECTS). Should
+            have elements in {1,2}. Should exclude the objects of the
+            disabled line.
         P : torch.Tensor[float]
-            The predictions from the model. Predictions are in range (0,1).
-            Should have a length corresponding to the number of objects
-            in the network.
+            The predictions from the model, with shape (B, N_OBJECTS).
         device : torch.device
             What device to load the data structures on.
+        Y : Optional[torch.Tensor], optional
+            The labels, with shape (B, N_OBJECTS), of which to compute the
+            ranks. The default is None.
+        dis_line_tv : Tuple[int, int], optional
+            The indices, in the full topology vector, of the disabled line
+            origin and extremity. The default is (-1, -1), i.e. no line
+            disabled.
+        topo_keys : Optional[Sequence[bytes]], optional
+            Per topology vector, a key identifying it. If given, the 'change'
+            action spaces are memoised (see get_changing_actions()). The
+            default is None.
+        k : int, optional
+            The number of nearest actions to return per row. The default
+            is 1.
 
         Returns
         -------
-        change_act_space : torch.Tensor
-            Sorted 'change' action space. Should have the shape
-            (N_ACTIONS, N_OBJECTS). Sorted by increasing nearness to the
-            predicted action space.
+        nearest_actions : torch.Tensor
+            The nearest 'change' actions per row, with shape
+            (B, k, N_OBJECTS), sorted by increasing distance to the
+            prediction.
+        Y_ranks : Optional[torch.Tensor]
+            The rank of the label per row, with shape (B,). None if no labels
+            are given.
         """
-        # Index the action space for 'set' actions
-        set_act_space = self.set_act_space_per_lo[line_disabled].to(device)
+        A = self.get_bus_act_space_on(line_disabled, device, P.dtype, dis_line_tv)
+        changing = None
+        if topo_keys is not None:
+            changing = self.get_changing_actions(line_disabled, topo_vects, topo_keys, device, dis_line_tv)
+        return nearest_change_actions_batch(A, topo_vects.to(device), P, Y, changing, k)
+
+
+def nearest_change_actions_batch(A: torch.Tensor,
+                                 topo_vects: torch.Tensor,
+                                 P: torch.Tensor,
+                                 Y: Optional[torch.Tensor] = None,
+                                 changing: Optional[torch.Tensor] = None,
+                                 k: int = 1) \
+        -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    For a batch of predictions, find per row the k nearest 'change' actions
+    by L1 distance, without materialising the 'change' action space per row.
+    The label ranks are computed by counting, without sorting the distances.
+
+    A 'set' action changes an object if it sets the object to busbar 1 while
+    it is on busbar 2, or vice versa. Hence, with A = [S==1, S==2] and
+    T = [topo_vect==2, topo_vect==1], the 'change' actions of a row are
+    C = A * T, elementwise per action. Since these are binary,
+    |P - C| summed equals sum(P) + sum(C) - 2 P.C, so that the distances to
+    all actions are sum(P) + (T - 2 [P, P] * T) @ A^T, a single GEMM per
+    batch. Actions that change nothing are replaced by a single do-nothing
+    action, which comes first. Which actions change anything is given by
+    T @ A^T > 0; if it is known, e.g. memoised per topology, the GEMM only
+    needs to compute the distance terms.
+
+    Parameters
+    ----------
+    A : torch.Tensor
+        The busbar indicators of the 'set' action space, with shape
+        (N_ACTIONS, 2 * N_OBJECTS) and the dtype of P, as returned by
+        ActSpaceCache.get_bus_act_space_on().
+    topo_vects : torch.Tensor[int]
+        The current topology vectors, with shape (B, N_OBJECTS). Should have
+        elements in {1,2}.
+    P : torch.Tensor[float]
+        The predictions, with shape (B, N_OBJECTS).
+    Y : Optional[torch.Tensor], optional
+        The labels, with shape (B, N_OBJECTS), of which to compute the ranks:
+        the number of 'change' actions strictly nearer to the prediction than
+        the label. The default is None.
+    changing : Optional[torch.Tensor], optional
+        Whether each action changes any object in the topology of each row,
+        with shape (B, N_ACTIONS), as returned by
+        ActSpaceCache.get_changing_actions(). The default is None, in which
+        case it is computed.
+    k : int, optional
+        The number of nearest actions to return per row, found with
+        torch.topk. Capped at the number of 'set' actions plus one. If a row
+        has fewer than k 'change' actions, the remaining actions are
+        do-nothing actions. The default is 1.
+
+    Returns
+    -------
+    nearest_actions : torch.Tensor
+        The nearest 'change' actions per row, with shape (B, k, N_OBJECTS),
+        sorted by increasing distance to the prediction.
+    Y_ranks : Optional[torch.Tensor]
+        The rank of the label per row, with shape (B,). None if no labels are
+        given.
+    """
+    assert k > 0, "K should be positive."
+    T = torch.cat([topo_vects == 2, topo_vects == 1], dim=1).to(P.dtype)
+    PT = torch.cat([P, P], dim=1) * T
+
+    # A single GEMM gives the distance terms and, if not given, the number of changed objects
+    B = len(P)
+    P_sum = P.sum(dim=1, keepdim=True)
+    if changing is None:
+        prods = torch.cat([T - 2 * PT, T]) @ A.T
+        dists_actions = P_sum + prods[:B]
+        changing = prods[B:] > 0.5
+    else:
+        dists_actions = P_sum + (T - 2 * PT) @ A.T
 
-        # Compute the 'change' action space
-        topo_vect_rpt = topo_vect.repeat(set_act_space.shape[0], 1)
-        change_act_space = (set_act_space != 0) * (set_act_space != topo_vect_rpt)
+    # The do-nothing action comes first, actions that change nothing are
+    # excluded
+    dists = torch.cat([P_sum, dists_actions.masked_fill(~changing, float('inf'))], dim=1)
+    if k == 1:
+        # Argmin breaks ties by the first action, unlike topk
+        nearest_idxs = torch.argmin(dists, dim=1, keepdim=True)
+    else:
+        _, nearest_idxs = torch.topk(dists, min(k, dists.shape[1]), dim=1, largest=False, sorted=True)
 
-        # Remove all do-nothing actions
-        change_act_space = change_act_space[change_act_space.sum(dim=1) != 0]
+    # Construct the nearest 'change' actions; the do-nothing action, and
+    # actions that change nothing, are zero
+    n_objects = P.shape[1]
+    nearest_A = A[(nearest_idxs - 1).clamp(min=0)] * (nearest_idxs > 0).unsqueeze(-1)
+    nearest_C = nearest_A * T.unsqueeze(1)
+    nearest_actions = nearest_C[..., :n_objects] + nearest_C[..., n_objects:]
 
-        # Add back a single do-nothing action
-        change_act_space = torch.cat([torch.zeros((1,
-                                                   change_act_space.shape[1]),
-                                                  device=device),
-                                      change_act_space])
+    Y_ranks = None
+    if Y is not None:
+        Y_dists = abs(P - Y).sum(dim=1, keepdim=True)
+        Y_ranks = (dists < Y_dists - DIST_TOLERANCE).sum(dim=1)
+    return nearest_actions, Y_ranks
 
-        # Calculate the row-wise abs. difference between the predicted action
-        # and the 'change' action space
-        P_rpt = P.repeat(change_act_space.shape[0], 1)
-        P_diff = abs(P_rpt - change_act_space)
 
-        # Sort the 'change' action space by the difference with the
-        # predicted action
-        P_diff_ind_sorted = torch.argsort(P_diff.sum(axis=1))
-        change_act_space = change_act_space[P_diff_ind_sorted]
+def insert_disabled_line_objects(x: torch.Tensor, dis_line_tv: Tuple[int, int]) -> torch.Tensor:
+    """
+    Insert zeros for the objects of a disabled line in a tensor the shape of
+    the topology vector without those objects, so that tensors of different
+    line disabled layouts can be compared and summed.
+
+    Parameters
+    ----------
+    x : torch.Tensor
+        The tensor, without the objects of the disabled line. The objects
+        are in the last dimension, so that a batch can be given.
+    dis_line_tv : Tuple[int, int]
+        The indices, in the full topology vector, of the disabled line origin
+        and extremity. (-1, -1) if no line is disabled.
 
-        return change_act_space
+    Returns
+    -------
+    torch.Tensor
+        The tensor with the last dimension the shape of the full topology
+        vector.
+    """
+    if dis_line_tv[0] == -1:
+        return x
+    n_full = x.shape[-1] + 2
+    full_x = torch.zeros(x.shape[:-1] + (n_full,), dtype=x.dtype, device=x.device)
+    # The indices are computed on the host, since masked indexing synchronises with the device
+    keep = torch.tensor([i for i in range(n_full) if i not in dis_line_tv], device=x.device)
+    full_x[..., keep] = x
+    return full_x
+
+
+def object_substations(sub_info: Sequence[int], device: torch.device) -> torch.Tensor:
+    """
+    Find the substation of each object in the topology vector. Computed on
+    the host, so that it does not synchronise with the device.
+
+    Parameters
+    ----------
+    sub_info : Sequence[int]
+        Sequence with elements representing the number of object connected to
+        each substation.
+    device : torch.device
+        What device to put the result on.
+
+    Returns
+    -------
+    torch.Tensor[int]
+        The substation of each object, with shape (N_OBJECTS,).
+    """
+    sub_info = np.asarray(sub_info, dtype=np.int64)
+    return torch.as_tensor(np.repeat(np.arange(len(sub_info)), sub_info), device=device)
 
 
 def get_P_one_sub(P: torch.Tensor, sub_info: torch.Tensor) \
@@ -132,3 +475,37 @@ def get_P_one_sub(P: torch.Tensor, sub_info: torch.Tensor) \
                                        lambda x: torch.sum(torch.clamp(x - 0.5, min=0)))
     return torch.cat([sub if i == max_substation_idx else torch.zeros_like(sub)
                       for i, sub in enumerate(P_grouped)]), max_substation_idx
+
+
+def get_P_one_sub_batch(P: torch.Tensor, obj_subs: torch.Tensor, n_subs: int) \
+        -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Batched variant of get_P_one_sub(): selects, per row, the action only at
+    the substation for which the predictions where the most extreme. Does
+    NOT produce one hot vectors.
+
+    Parameters
+    ----------
+    P : torch.Tensor
+        The predictions, with shape (B, N_OBJECTS).
+    obj_subs : torch.Tensor[int]
+        The substation of each object, as returned by object_substations().
+    n_subs : int
+        The number of substations.
+
+    Returns
+    -------
+    torch.Tensor
+        The predictions, but with zero except for at the most extreme
+        substation. If all elements of a row are below the 0.5 threshold,
+        zero everywhere.
+    torch.Tensor[int]
+        The index of the substation per row, with shape (B,). -1 if all
+        elements of the row are below the 0.5 threshold.
+    """
+    sub_sums = torch.zeros((len(P), n_subs), dtype=P.dtype, device=P.device)
+    sub_sums.index_add_(1, obj_subs, torch.clamp(P - 0.5, min=0))
+    # Argmax returns the first maximal substation, as get_P_one_sub() does
+    sub_idxs = torch.where((P >= 0.5).any(dim=1), torch.argmax(sub_sums, dim=1),
+                           torch.full((len(sub_sums),), -1, dtype=torch.long, device=sub_sums.device))
+    return P * (obj_subs == sub_idxs.unsqueeze(1)), sub_idxs
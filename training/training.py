@@ -5,20 +5,25 @@ Created on Wed Jan  5 15:47:34 2022
 
 @author: matthijs
 """
-from typing import Tuple, Optional
+from __future__ import annotations
+from typing import Tuple, Optional, List, Iterable, TYPE_CHECKING
 import torch
-import wandb
 import training.metrics as metrics
 from training.models import GCN, FCNN
 from training.dataloader import TutorDataLoader
+from training.async_logging import AsyncRunLogger
 from tqdm import tqdm
-import collections
+import time
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.metrics import ConfusionMatrixDisplay
 import auxiliary.util as util
 import auxiliary.grid2op_util as g2o_util
-from training.postprocessing import get_P_one_sub, ActSpaceCache
+from training.postprocessing import get_P_one_sub, get_P_one_sub_batch, object_substations, ActSpaceCache, \
+    insert_disabled_line_objects
+
+# wandb, matplotlib and sklearn are imported where they are used, so that
+# importing this module (e.g. for inference) does not import them
+if TYPE_CHECKING:
+    import wandb
 
 
 def BCELoss_labels_weighted(P: torch.Tensor, Y: torch.Tensor, W: torch.Tensor) \
@@ -76,6 +81,39 @@ def get_Y_subchanged(Y: torch.Tensor, sub_info: torch.Tensor) \
                       for i, sub in enumerate(Y_grouped)]), idx
 
 
+def get_Y_subchanged_batch(Y: torch.Tensor, obj_subs: torch.Tensor, n_subs: int) \
+        -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Batched variant of get_Y_subchanged(): find, per row, the substation at
+    which the 'true' actions (i.e. the label) were taken.
+
+    Parameters
+    ----------
+    Y : torch.Tensor
+        The labels, with shape (B, N_OBJECTS).
+    obj_subs : torch.Tensor[int]
+        The substation of each object, as returned by
+        training.postprocessing.object_substations().
+    n_subs : int
+        The number of substations.
+
+    Returns
+    -------
+    torch.Tensor
+        The masks of the substations where the true actions are taken, with
+        shape (B, N_OBJECTS). Fully zeros for rows where the 'true' action is
+        a do-nothing action.
+    torch.Tensor[int]
+        The index of the substation per row, with shape (B,). -1 if the
+        'true' action is a do-nothing action.
+    """
+    sub_sums = torch.zeros((len(Y), n_subs), dtype=Y.dtype, device=Y.device)
+    sub_sums.index_add_(1, obj_subs, Y)
+    sub_idxs = torch.where((Y >= 0.5).any(dim=1), torch.argmax(sub_sums, dim=1),
+                           torch.full((len(sub_sums),), -1, dtype=torch.long, device=sub_sums.device))
+    return (obj_subs == sub_idxs.unsqueeze(1)).to(Y.dtype), sub_idxs
+
+
 def label_weights(mask: torch.Tensor, w: float) \
         -> torch.Tensor:
     """
@@ -99,6 +137,75 @@ def label_weights(mask: torch.Tensor, w: float) \
     return weights
 
 
+def render_val_analysis(statistics: dict, n_subs: int) -> dict:
+    """
+    Render the analysis of the validation set to figures and histograms.
+    Uses matplotlib figures without pyplot, so that it can be called outside
+    the main thread.
+
+    Parameters
+    ----------
+    statistics : dict
+        The statistics of the analysis on the host, as collected by
+        Run.log_val_analysis().
+    n_subs : int
+        The number of substations.
+
+    Returns
+    -------
+    dict
+        The figures and histograms to log, by name.
+    """
+    import wandb
+    from matplotlib.figure import Figure
+    from sklearn.metrics import ConfusionMatrixDisplay
+
+    logs = {}
+
+    # Substation confusion matrix
+    classes = np.arange(-1, n_subs).tolist()
+    fig = Figure(figsize=(12, 12))
+    ConfusionMatrixDisplay(statistics['sub_conf_mat'], display_labels=classes).plot(ax=fig.subplots())
+    logs['sub_conf_mat'] = fig
+
+    # Distributions for the true/predicted/postprocessed-predicted objects
+    Y_obs, nearest_valid_P_obs, P_obs = statistics['object_distributions']
+    fig = Figure()
+    ax = fig.subplots(3, 1, sharex=True)
+    n_obs = len(Y_obs)
+    ax[0].bar(range(n_obs), Y_obs)
+    ax[0].title.set_text('True object action distribution')
+    ax[1].bar(range(n_obs), nearest_valid_P_obs)
+    ax[1].title.set_text('Postprocessed predicted object action distribution')
+    ax[2].bar(range(n_obs), P_obs)
+    ax[2].title.set_text('Predicted object action distribution')
+    fig.tight_layout()
+    logs['object_pred_bars'] = fig
+
+    # Histogram of the ranks of the true actions in the list of
+    # valid actions sorted by nearness to the predicted actions
+    logs['Y_rank_in_nearest_v_acts'] = wandb.Histogram(statistics['Y_ranks'])
+
+    # Difference between the self weights and the other weights
+    for k, v in statistics['diffs_weights'].items():
+        logs['diffs_weights_' + k] = wandb.Histogram(v)
+
+    # The (in)correct classifications of the labels and topology vectors as stacked
+    # histograms, ordered by decreasing frequency
+    for name in ['label_correct_dist', 'topovect_correct_dist']:
+        n_correct, n_wrong = statistics[name]
+        indices = np.arange(len(n_correct))
+        fig = Figure()
+        fig.subplots().hist([indices, indices],
+                            weights=[n_correct, n_wrong],
+                            color=['lime', 'red'],
+                            bins=len(indices),
+                            stacked=True)
+        logs[name] = fig
+
+    return logs
+
+
 class Run:
     """
     Class that specifies the running of a model.
@@ -118,7 +225,6 @@ class Run:
         self.config = config
         self.train_config = train_config = config['training']
         processed_data_path = config['paths']['processed_tutor_imitation']
-        matrix_cache_path = config['paths']['con_matrix_cache']
         feature_statistics_path = config['paths']['feature_statistics']
         action_counter_path = config['paths']['action_counter']
 
@@ -157,24 +263,27 @@ class Run:
         # Initialize dataloaders
         network_type = train_config['GCN']['hyperparams']['network_type']
         af_th = train_config['hyperparams']['action_frequency_threshold']
+        sampling_temp = train_config['hyperparams']['sampling_temperature']
+        cc_capacity = train_config['settings']['connectivity_cache_capacity']
         self.train_dl = TutorDataLoader(processed_data_path + '/train',
-                                        matrix_cache_path,
                                         feature_statistics_path,
                                         action_counter_path,
                                         device=self.device,
                                         model_type=type(self.model),
                                         network_type=network_type,
                                         train=True,
-                                        action_frequency_threshold=af_th)
+                                        action_frequency_threshold=af_th,
+                                        sampling_temperature=sampling_temp,
+                                        connectivity_cache_capacity=cc_capacity)
         self.val_dl = TutorDataLoader(processed_data_path + '/val',
-                                      matrix_cache_path,
                                       feature_statistics_path,
                                       action_counter_path,
                                       device=self.device,
                                       model_type=type(self.model),
                                       network_type=network_type,
                                       train=False,
-                                      action_frequency_threshold=af_th)
+                                      action_frequency_threshold=af_th,
+                                      connectivity_cache_capacity=cc_capacity)
 
         # Initialize metrics objects
         IA = metrics.IncrementalAverage
@@ -202,13 +311,22 @@ class Run:
         self.val_metrics = IAM(val_metrics_dict)
 
         # Initialize action space cache used for
-        self.as_cache = ActSpaceCache()
+        self.as_cache = ActSpaceCache(config['paths']['action_space'],
+                                      train_config['settings']['val_action_space_top_k'],
+                                      train_config['settings']['change_action_cache_capacity'])
 
         # Early stopping parameter
         self.stop_countdown = train_config['hyperparams']['early_stopping_patience']
         self.best_score = 0
 
+        # Validation subsample, used for evaluations between evaluations of the full validation set
+        self.n_val_evaluations = 0
+        self.val_subsample = None
+        if train_config['settings']['val_subsample_fraction'] is not None:
+            self.val_subsample = self.val_dl.stratified_subsample(train_config['settings']['val_subsample_fraction'])
+
         # Start wandb run
+        import wandb
         if 'model_name' in train_config['wandb']:
             self.run = wandb.init(project=train_config['wandb']["project"],
                                   entity=train_config['wandb']["entity"],
@@ -220,10 +338,16 @@ class Run:
                                   entity=train_config['wandb']["entity"],
                                   tags=train_config['wandb']['model_tags'],
                                   config=train_config)
-        self.run.watch(self.model,
-                       log_freq=train_config['settings']['train_log_freq'],
-                       log='all',
-                       log_graph=True)
+        # The hooks of wandb.watch log from the training thread, not through the background logger, so
+        # their logs are attached to the step most recently logged by the logger, which may lag behind
+        if train_config['settings']['watch_log'] is not None or train_config['settings']['watch_log_graph']:
+            self.run.watch(self.model,
+                           log_freq=train_config['settings']['train_log_freq'],
+                           log=train_config['settings']['watch_log'],
+                           log_graph=train_config['settings']['watch_log_graph'])
+
+        # Logs to the run from a background thread
+        self.logger = AsyncRunLogger(self.run, train_config['settings']['logging_queue_size'])
 
     def predict_datapoint(self, dp: dict) -> torch.Tensor:
         """
@@ -312,101 +436,129 @@ class Run:
                                P_subchanged_idx=P_subchanged_idx,
                                Y_subchanged_idx=Y_sub_idx)
 
-    def process_single_val_dp(self, dp: dict) \
-            -> Tuple[torch.Tensor, torch.tensor, int, torch.tensor, int,
-                     torch.Tensor]:
+    def process_val_batch(self, dps: List[dict], analysis: Optional[metrics.ValidationAnalysis] = None):
         """
-        Process a single validation datapoint. This involves:
-            (1) Making a model prediction
-            (2) Extracting the label and smoothing it
-            (3) Computing the weighted loss
+        Process a batch of validation datapoints. This involves:
+            (1) Making model predictions
+            (2) Extracting the labels and smoothing them
+            (3) Computing the weighted losses
             (4) Updating the validation metrics
-            (5) Returning statistics for further analysis
+            (5) Possibly, updating the statistics for further analysis
+        The datapoints with the same line disabled are processed at once: their
+        changed substations, the valid actions nearest to their predictions,
+        and their statistics are computed with batched tensor operations.
 
         Parameters
         ----------
-        dp : dict
-            The datapoint.
-
-        Returns
-        -------
-        y : torch.Tensor[int]
-            The label. Should have the length equal to the number of objects in
-            the network. Elements should be in {0,1}.
-        P : torch.Tensor[int]
-            The prediction of the model.
-        nearest_valid_P : torch.Tensor[int]
-            The valid action nearest to the prediction. Should have the length
-            equal to the number of objects in the network. Elements should be
-            in {0,1}.
-        Y_sub_idx : int
-            The index of substation changed in the label.
-        Y_sub_mask : torch.Tensor[bool]
-            The mask indicating which objects in the topology vector
-            correspond to the true changed substation. Should have the length
-            equal to the number of objects in the network. Elements should be
-            in {0,1}.
-        P_subchanged_idx : int
-            The index of substation changed in the predicted action. Computed
-            based on nearest_valid_P.
-        nearest_valid_actions : torch.Tensor[int]
-            Matrix indicating the order of the valid actions in order of
-            nearness to the prediction actions. Rows indicate actions.
-            Should have dimensions (n_actions, n_objects).
+        dps : List[dict]
+            The datapoints.
+        analysis : Optional[metrics.ValidationAnalysis], optional
+            If given, the statistics for the analysis are updated with the
+            datapoints. The default is None.
         """
-
-        # Make model prediction
-        P = self.predict_datapoint(dp)
-
-        # Extract the label, apply label smoothing
-        Y = dp['change_topo_vect']
         label_smth_alpha = self.train_config['hyperparams']['label_smoothing_alpha']
-        Y_smth = (1 - label_smth_alpha) * dp['change_topo_vect'] + \
-                 label_smth_alpha * 0.5 * torch.ones_like(Y, device=self.device)
-
-        # Compute the weights for the loss
         non_sub_label_weight = self.train_config['hyperparams']['non_sub_label_weight']
-        Y_sub_mask, Y_sub_idx = get_Y_subchanged(Y, dp['sub_info'])
-        one_sub_P, P_subchanged_idx = get_P_one_sub(P, dp['sub_info'])
-        P_sub_mask = one_sub_P > 0
-        weights = label_weights(~torch.logical_or(Y_sub_mask, P_sub_mask), non_sub_label_weight)
 
-        # Compute the loss
-        l = BCELoss_labels_weighted(P, Y_smth, weights)
+        # Make model predictions
+        Ps = [self.predict_datapoint(dp) for dp in dps]
+
+        for line_disabled in dict.fromkeys(dp['line_disabled'] for dp in dps):
+            idxs = [i for i, dp in enumerate(dps) if dp['line_disabled'] == line_disabled]
+            dis_line_tv = dps[idxs[0]]['dis_line_tv']
+            sub_info = dps[idxs[0]]['sub_info']
+            obj_subs = object_substations(sub_info, self.device)
+            P = torch.stack([Ps[i] for i in idxs])
+            Y = torch.stack([dps[i]['change_topo_vect'] for i in idxs])
+            topo_vect = torch.stack([dps[i]['topo_vect'] for i in idxs])
+
+            # Find the nearest valid actions and the ranks of the labels
+            nearest, Y_ranks = self.as_cache.get_nearest_change_actions_batch(
+                line_disabled,
+                topo_vect,
+                P,
+                self.device,
+                Y=Y,
+                dis_line_tv=dis_line_tv,
+                topo_keys=[dps[i]['topo_vect_key'] for i in idxs])
+            nearest_valid_P = nearest[:, 0]
+
+            # Apply label smoothing
+            Y_smth = (1 - label_smth_alpha) * Y + label_smth_alpha * 0.5 * torch.ones_like(Y)
+
+            # Compute the weights for the loss
+            Y_sub_mask, Y_subs = get_Y_subchanged_batch(Y, obj_subs, len(sub_info))
+            one_sub_P, _ = get_P_one_sub_batch(P, obj_subs, len(sub_info))
+            weights = label_weights(~torch.logical_or(Y_sub_mask, one_sub_P > 0), non_sub_label_weight)
+
+            # Calculate statistics for metrics
+            _, P_subs = get_P_one_sub_batch(nearest_valid_P, obj_subs, len(sub_info))
+
+            # Update metrics. The metrics take the substation indices as ints, which are moved to the host once
+            # per batch
+            for i, Y_sub_idx, P_sub_idx in zip(range(len(idxs)), Y_subs.tolist(), P_subs.tolist()):
+                l = BCELoss_labels_weighted(P[i], Y_smth[i], weights[i])
+                self.val_metrics.log(P=P[i], Y=Y[i], one_sub_P=one_sub_P[i], l=l,
+                                     P_subchanged_idx=P_sub_idx if P_sub_idx != -1 else None,
+                                     Y_subchanged_idx=Y_sub_idx if Y_sub_idx != -1 else None,
+                                     nearest_valid_P=nearest_valid_P[i])
+
+            # Statistics used in further analysis. The objects of disabled lines are inserted, so that the
+            # statistics have the full layout
+            if analysis is not None:
+                analysis.update(*[insert_disabled_line_objects(x, dis_line_tv)
+                                  for x in (Y, P, nearest_valid_P, topo_vect, Y_sub_mask)],
+                                Y_subs, P_subs, Y_ranks)
+
+    def validation_pass(self, datapoints: Iterable[dict], with_analysis: bool = False) \
+            -> Optional[metrics.ValidationAnalysis]:
+        """
+        Evaluate validation datapoints: update the validation metrics and, if
+        with_analysis is set, accumulate statistics for the analysis.
 
-        # Calculate statistics for metrics
-        get_cabnp = self.as_cache.get_change_actspace_by_nearness_pred
-        nearest_valid_actions = get_cabnp(dp['line_disabled'],
-                                          dp['topo_vect'],
-                                          P,
-                                          self.device)
-        nearest_valid_P = nearest_valid_actions[0]
-        _, P_subchanged_idx = get_P_one_sub(nearest_valid_P,
-                                            dp['sub_info'])
+        Parameters
+        ----------
+        datapoints : Iterable[dict]
+            The datapoints.
+        with_analysis : bool, optional
+            Whether to accumulate statistics for the analysis. The default is
+            False.
 
-        # Update metrics
-        self.val_metrics.log(P=P, Y=Y, one_sub_P=one_sub_P, l=l,
-                             P_subchanged_idx=P_subchanged_idx,
-                             Y_subchanged_idx=Y_sub_idx,
-                             nearest_valid_P=nearest_valid_P)
+        Returns
+        -------
+        Optional[metrics.ValidationAnalysis]
+            The statistics for the analysis. None if with_analysis is not set.
+        """
+        analysis = None
+        if with_analysis:
+            analysis = metrics.ValidationAnalysis(self.config['rte_case14_realistic']['n_subs'], self.device)
 
-        # Return statistics used in further analysis
-        return Y, P, nearest_valid_P, Y_sub_idx, Y_sub_mask, P_subchanged_idx, \
-            nearest_valid_actions
+        val_batch_size = self.train_config['settings']['val_batch_size']
+        for dps in util.batched(datapoints, val_batch_size):
+            self.process_val_batch(dps, analysis)
+        return analysis
 
     def evaluate_val_set(self, step: int, run: wandb.sdk.wandb_run.Run):
         """
         Evaluate the validation set. Consists of:
             (1) updating validation metrics,
-            (2) creating a confusion matrix for the substations,
-            (3) creating a histogram of the ranks of the true actions in the
+            (2) checking early stopping,
+            (3) creating a confusion matrix for the substations,
+            (4) creating a histogram of the ranks of the true actions in the
             list of valid actions sorted by nearness to the predicted actions,
-            (4) creating histograms of the difference between self weights and
+            (5) creating histograms of the difference between self weights and
             other weights,
-            (5) creating a stacked histogram of the labels and the (in)correct
+            (6) creating a stacked histogram of the labels and the (in)correct
             classifications of those.
         All of these are logged to a wandb run.
 
+        If val_subsample_fraction is set, only the stratified subsample of the
+        validation set is evaluated first. The full validation set (and the
+        analysis (3)-(6)) is only evaluated every full_val_freq evaluations,
+        or when the subsample score is within full_val_margin of the best
+        score, i.e. when it can be an improvement. Only evaluations of the
+        full validation set count for the early stopping, so that the
+        patience has the same meaning with and without a subsample.
+
         Parameters
         ----------
         step : int
@@ -414,187 +566,119 @@ class Run:
         run : wandb.sdk.wandb_run.Run
             The wandb run to log the analysis results to.
         """
-        # Initializing lists for tracking the predicted/true substations
-        Y_subs = []
-        P_subs = []
-
-        # Initializing distributions for tracking the true/predicted/postprocessed predicted objects
-        Y_obs = P_obs = nearest_valid_P_obs = None
-
-        # Initializing lists for tracking the ranks of the true actions in
-        # the list of valid actions sorted by nearness to the predicted actions
-        Y_rank_in_nearest_v_acts = []
-
-        # Initializing counters for counting the number of (in)correct classifications of each label
-        correct_counter_label = collections.Counter()
-        wrong_counter_label = collections.Counter()
-
-        # Initializing counters for counting the number of (in)correct classifications of each topology vector
-        correct_counter_topovect = collections.Counter()
-        wrong_counter_topovect = collections.Counter()
+        settings = self.train_config['settings']
+        tick = time.perf_counter()
 
         with torch.no_grad():
-            for dp in self.val_dl:
+            full = self.val_subsample is None or self.n_val_evaluations % settings['full_val_freq'] == 0
+            self.n_val_evaluations += 1
+
+            # Evaluate the subsample, and check whether its score is near enough to the best score
+            # to evaluate the full validation set
+            if not full:
+                self.validation_pass((self.val_dl[i] for i in self.val_subsample), with_analysis=False)
+                subsample_score = self.val_metrics.metrics_dict['val_macro_accuracy_valid'][1].get()
+                self.logger.log(dict([('val_subsample_' + k[len('val_'):], v)
+                                      for k, v in self.val_metrics.get_values()]), step=step)
+                self.val_metrics.reset()
+                full = subsample_score >= self.best_score - settings['full_val_margin']
 
-                Y, P, nearest_valid_P, Y_sub_idx, Y_sub_mask, P_subchanged_idx, \
-                    nearest_valid_actions = self.process_single_val_dp(dp)
-
-                if not self.config['training']['settings']['advanced_val_analysis']:
-                    continue
-
-                # Increment the counters for counting the number of (in)correct classifications of each label
-                # and topology vector
-                sub_Y = tuple(Y[Y_sub_mask.bool()].cpu().tolist())
-                if torch.equal(nearest_valid_P, torch.round(Y)):
-                    correct_counter_label[(Y_sub_idx, sub_Y)] += 1
-                    correct_counter_topovect[tuple(dp['topo_vect'].tolist())] += 1
-                else:
-                    wrong_counter_label[(Y_sub_idx, sub_Y)] += 1
-                    wrong_counter_topovect[tuple(dp['topo_vect'].tolist())] += 1
-
-                # Update lists for tracking the predicted/true substations
-                Y_subs.append(Y_sub_idx)
-                P_subs.append(P_subchanged_idx)
-
-                # Update distributions for the true/predicted/postprocessed-predicted objects
-                if dp['line_disabled'] != -1:
-                    raise NotImplementedError
-                if Y_obs is None:
-                    Y_obs = Y
-                    P_obs = P
-                    nearest_valid_P_obs = nearest_valid_P
+            # Checking early stopping
+            if full:
+                analysis = self.validation_pass(self.val_dl, with_analysis=settings['advanced_val_analysis'])
+                val_macro_accuracy_valid = self.val_metrics.metrics_dict['val_macro_accuracy_valid'][1].get()
+                if val_macro_accuracy_valid > self.best_score:
+                    self.best_score = val_macro_accuracy_valid
+                    self.stop_countdown = self.train_config['hyperparams']['early_stopping_patience']
+                    torch.save(self.model.state_dict(), "models/" + run.name)
+                    early_stopping_decision = 'improved'
                 else:
-                    Y_obs += Y
-                    P_obs += P > 0.5
-                    nearest_valid_P_obs += nearest_valid_P
-
-                # Update lists for tracking the ranks of the true actions in
-                # the list of valid actions sorted by nearness to the predicted
-                # actions
-                Y_index_in_valid = torch.where((nearest_valid_actions == Y)
-                                               .all(dim=1))[0].item()
-                Y_rank_in_nearest_v_acts.append(Y_index_in_valid)
+                    self.stop_countdown -= 1
+                    early_stopping_decision = 'no_improvement'
 
-            # Checking early stopping
-            val_macro_accuracy_valid = self.val_metrics.metrics_dict['val_macro_accuracy_valid'][1].get()
-            if val_macro_accuracy_valid > self.best_score:
-                self.best_score = val_macro_accuracy_valid
-                self.stop_countdown = self.train_config['hyperparams']['early_stopping_patience']
-                torch.save(self.model.state_dict(), "models/" + run.name)
+                # Logging metrics
+                self.val_metrics.log_to_wandb(self.logger, step)
+                self.val_metrics.reset()
             else:
-                self.stop_countdown -= 1
+                early_stopping_decision = 'subsample_no_improvement'
+
+            # Logging the validation wall time and the early stopping decision
+            self.logger.log({'val_wall_time': time.perf_counter() - tick,
+                             'val_full': full,
+                             'early_stopping_decision': early_stopping_decision,
+                             'early_stopping_countdown': self.stop_countdown,
+                             'best_score': self.best_score,
+                             'val_change_action_cache_hit_rate': self.as_cache.hit_rate}, step=step)
             if self.stop_countdown < 1:
                 quit()
 
-            # Logging metrics
-            self.val_metrics.log_to_wandb(run, step)
-            self.val_metrics.reset()
-
-            if not self.config['training']['settings']['advanced_val_analysis']:
-                return
-
-            # Logging substation confusion matrix
-            Y_subs = [(v if v is not None else -1) for v in Y_subs]
-            P_subs = [(v if v is not None else -1) for v in P_subs]
-            n_subs = self.config['rte_case14_realistic']['n_subs']
-            classes = np.arange(-1, n_subs).tolist()
-            disp = ConfusionMatrixDisplay.from_predictions(Y_subs,
-                                                           P_subs,
-                                                           labels=classes)
-            fig = disp.figure_
-            fig.set_size_inches(12, 12)
-            run.log({"sub_conf_mat": fig}, step=step)
-            plt.close(fig)
-
-            # Plotting distributions for the true/predicted/postprocessed-predicted objects
-            fig, ax = plt.subplots(3, 1, sharex=True)
-            n_obs = len(Y_obs)
-            ax[0].bar(range(n_obs), Y_obs)
-            ax[0].title.set_text('True object action distribution')
-            ax[1].bar(range(n_obs), nearest_valid_P_obs)
-            ax[1].title.set_text('Postprocessed predicted object action distribution')
-            ax[2].bar(range(n_obs), P_obs)
-            ax[2].title.set_text('Predicted object action distribution')
-            plt.tight_layout()
-            run.log({"object_pred_bars": fig}, step=step)
-            plt.close(fig)
-
-            # Logging histogram of the ranks of the true actions in the list of
-            # valid actions sorted by nearness to the predicted actions
-            run.log({"Y_rank_in_nearest_v_acts":
-                     wandb.Histogram(Y_rank_in_nearest_v_acts)}, step=step)
-
-            # Logging difference between the self weights and the other weights
-            if type(self.model) == GCN:
-                diffs = self.model.compute_difference_weights()
-                diffs = dict([('diffs_weights_' + k, v) for k, v in diffs.items()])
-                run.log(dict([(k, wandb.Histogram(v)) for k, v in diffs.items()]),
-                        step)
-
-            # Logging label counters as stacked histogram
-            comb_counter_mc = (correct_counter_label + wrong_counter_label).most_common()
-            correct_indices = util.flatten([correct_counter_label[a] * [i] for i, (a, _)
-                                            in enumerate(comb_counter_mc)])
-            wrong_indices = util.flatten([wrong_counter_label[a] * [i] for i, (a, _)
-                                          in enumerate(comb_counter_mc)])
-            fig, ax = plt.subplots()
-            n_bins = max(correct_indices + wrong_indices) + 1
-            ax.hist([correct_indices, wrong_indices],
-                    color=['lime', 'red'],
-                    bins=n_bins,
-                    stacked=True)
-            run.log({"label_correct_dist": fig}, step=step)
-            plt.close(fig)
-
-            # Logging topoly vector counters as stacked histogram
-            comb_counter_mc = (correct_counter_topovect + wrong_counter_topovect).most_common()
-            correct_indices = util.flatten([correct_counter_topovect[a] * [i] for i, (a, _)
-                                            in enumerate(comb_counter_mc)])
-            wrong_indices = util.flatten([wrong_counter_topovect[a] * [i] for i, (a, _)
-                                          in enumerate(comb_counter_mc)])
-            fig, ax = plt.subplots()
-            n_bins = max(correct_indices + wrong_indices) + 1
-            ax.hist([correct_indices, wrong_indices],
-                    color=['lime', 'red'],
-                    bins=n_bins,
-                    stacked=True)
-            run.log({"topovect_correct_dist": fig}, step=step)
-            plt.close(fig)
+            if full and settings['advanced_val_analysis']:
+                self.log_val_analysis(analysis, step)
+
+    def log_val_analysis(self, analysis: metrics.ValidationAnalysis, step: int):
+        """
+        Log the analysis of the validation set. The statistics are moved to
+        the host, after which the figures are rendered and logged by the
+        background logger.
+
+        Parameters
+        ----------
+        analysis : metrics.ValidationAnalysis
+            The statistics for the analysis, as returned by validation_pass().
+        step : int
+            The current step.
+        """
+        statistics = {'sub_conf_mat': analysis.sub_confusion_matrix(),
+                      'object_distributions': analysis.object_distributions(),
+                      'Y_ranks': analysis.ranks(),
+                      'label_correct_dist': analysis.correct_wrong_counts(analysis.label_hashes),
+                      'topovect_correct_dist': analysis.correct_wrong_counts(analysis.topovect_hashes),
+                      'diffs_weights': {}}
+        if type(self.model) == GCN:
+            statistics['diffs_weights'] = self.model.compute_difference_weights()
+
+        n_subs = self.config['rte_case14_realistic']['n_subs']
+        self.logger.submit(lambda: render_val_analysis(statistics, n_subs), step)
 
     def start(self):
         """
         Start the training run. Includes periodic evaluation on the validation
-        set.
+        set. The pending logs are logged before the run finishes, also when
+        the training stops early.
         """
         with self.run as run:
-
-            # Initialize progress bar
-            n_epoch = self.train_config['hyperparams']['n_epoch']
-            est_tsize = self.train_config['constants']['estimated_train_size']
-            pbar = tqdm(total=n_epoch * est_tsize)
-
-            self.model.train()
-            self.model.zero_grad()
-            step = 0
-
-            for e in range(n_epoch):
-                for dp in self.train_dl:
-                    # Process a single train datapoint
-                    self.process_single_train_dp(dp, step)
-
-                    # Periodically log train metrics
-                    train_log_freq = self.train_config['settings']['train_log_freq']
-                    if (not step % train_log_freq) and (step != 0):
-                        self.train_metrics.log_to_wandb(run, step)
-                        self.train_metrics.reset()
-
-                    # Periodically evaluate the validation set
-                    val_log_freq = self.train_config['settings']['val_log_freq']
-                    if (not step % val_log_freq) and (step != 0):
-                        self.model.eval()
-                        self.evaluate_val_set(step, run)
-                        self.model.train()
-
-                    step += 1
-                    pbar.update(1)
-            pbar.close()
+            try:
+                # Initialize progress bar
+                n_epoch = self.train_config['hyperparams']['n_epoch']
+                pbar = tqdm(total=n_epoch * len(self.train_dl))
+
+                self.model.train()
+                self.model.zero_grad()
+                step = 0
+
+                for e in range(n_epoch):
+                    for dp in self.train_dl:
+                        # Process a single train datapoint
+                        self.process_single_train_dp(dp, step)
+
+                        # Periodically log train metrics
+                        train_log_freq = self.train_config['settings']['train_log_freq']
+                        if (not step % train_log_freq) and (step != 0):
+                            self.train_metrics.log_to_wandb(self.logger, step)
+                            self.train_metrics.reset()
+                            if self.train_dl.connectivity_hit_rate is not None:
+                                self.logger.log({'train_connectivity_hit_rate': self.train_dl.connectivity_hit_rate},
+                                                step=step)
+
+                        # Periodically evaluate the validation set
+                        val_log_freq = self.train_config['settings']['val_log_freq']
+                        if (not step % val_log_freq) and (step != 0):
+                            self.model.eval()
+                            self.evaluate_val_set(step, run)
+                            self.model.train()
+
+                        step += 1
+                        pbar.update(1)
+                pbar.close()
+            finally:
+                self.logger.close()